@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+import asyncio
+import sys
+import os
+import threading
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
+from snapshot_create import aio, clients
+from snapshot_create.fake_compute import FakeComputeBackend
+from snapshot_create.records import DiskRecord
+
+
+@pytest.fixture
+def backend():
+    backend = FakeComputeBackend(ready_after=1.0, time_scale=0.001, seed=1)
+    clients.use_backend(backend)
+    yield backend
+    clients.use_backend(None)
+
+
+def test_create_snapshot_and_disk(backend):
+    backend.add_disk("p", "us-central1-a", "src-disk")
+
+    async def main():
+        snapshot = await aio.create_snapshot("p", "src-disk", "snap-1", zone="us-central1-a")
+        disk = await aio.create_disk_from_snapshot("p", "us-central1-b", "restored", "pd-balanced", 10,
+                                                   "p", "snap-1")
+        return snapshot, disk
+
+    snapshot, disk = asyncio.run(main())
+
+    assert snapshot.status == "READY"
+    assert disk["status"] == "READY"
+    assert disk["sourceSnapshot"].endswith("/snap-1")
+    # partial response: only what a DiskRecord keeps
+    assert set(disk) <= set(DiskRecord.FIELDS)
+
+
+def test_many_disks_share_threads_and_list_calls(backend):
+    backend.add_snapshot("src", "snap-1")
+    threads_before = threading.active_count()
+
+    async def main():
+        # timeouts are simulated seconds; 300 of them last only 0.3 s at this time_scale
+        return await asyncio.gather(*[
+            aio.create_disk_from_snapshot("src", "us-central1-a", f"disk-{i}", "pd-balanced", 10,
+                                          "target", "snap-1", timeout=10_000)
+            for i in range(300)])
+
+    disks = asyncio.run(main())
+
+    assert all(d["status"] == "READY" for d in disks)
+    assert threading.active_count() - threads_before <= aio.IO_THREADS
+    # readiness comes from aggregated list calls, not a get per disk per poll
+    assert backend.calls["disks.aggregatedList"] < 300
+    assert backend.calls["disks.get"] == 300
+
+
+def test_timeout_and_cancellation(backend):
+    backend.add_disk("p", "us-central1-a", "src-disk")
+    backend.ready_after = lambda: 10_000.0
+
+    async def main():
+        watcher = aio.get_watcher()
+        with pytest.raises(TimeoutError):
+            await aio.create_snapshot("p", "src-disk", "slow", zone="us-central1-a", timeout=0.2)
+        task = asyncio.create_task(aio.wait_for_snapshot_creation("p", "slow", timeout=60))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        return watcher.pending()
+
+    assert asyncio.run(main()) == 0
+
+
+def test_list_and_delete_snapshots(backend):
+    for i in range(7):
+        backend.add_snapshot("p", f"snap-{i}")
+
+    async def main():
+        names = [s["name"] async for s in aio.iter_snapshots("p", max_results=3)]
+        await aio.delete_snapshot("p", "snap-6")
+        latest = await aio.list_snapshots("p", filter="name = snap-*")
+        return names, latest
+
+    names, latest = asyncio.run(main())
+
+    assert sorted(names) == [f"snap-{i}" for i in range(7)]
+    assert backend.calls["snapshots.list"] >= 3
+    assert latest["name"] != "snap-6"
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+import sys
+import os
+import threading
+import time
+from unittest import mock
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
+from snapshot_create.batch import run_batch, summarize
+from snapshot_create.create_snapshot import create_snapshots
+
+
+def test_run_batch_collects_errors_without_stopping():
+    def work(entry):
+        if entry["name"] == "bad":
+            raise RuntimeError("boom")
+        if entry["name"] == "exit":
+            sys.exit(1)
+        return entry["name"].upper()
+
+    entries = [{"name": "a"}, {"name": "bad"}, {"name": "exit"}, {"name": "b"}]
+    results = run_batch(work, entries, key=lambda e: e["name"], concurrency=4)
+
+    # results keep config order
+    assert [r.key for r in results] == ["a", "bad", "exit", "b"]
+    assert results[0].value == "A" and results[3].value == "B"
+    assert isinstance(results[1].error, RuntimeError)
+    assert isinstance(results[2].error, SystemExit)
+    assert summarize(results) == {"succeeded": ["a", "b"], "failed": ["bad", "exit"]}
+
+
+def test_run_batch_respects_zone_limit():
+    lock = threading.Lock()
+    in_flight = {"zone-a": 0}
+    peak = {"zone-a": 0}
+
+    def work(entry):
+        with lock:
+            in_flight[entry["zone"]] += 1
+            peak[entry["zone"]] = max(peak[entry["zone"]], in_flight[entry["zone"]])
+        time.sleep(0.02)
+        with lock:
+            in_flight[entry["zone"]] -= 1
+
+    entries = [{"name": f"d{i}", "zone": "zone-a"} for i in range(8)]
+    results = run_batch(work, entries, key=lambda e: e["name"], concurrency=8,
+                        zone_of=lambda e: e["zone"], zone_limit=2)
+
+    assert all(r.ok for r in results)
+    assert peak["zone-a"] == 2
+
+
+def test_run_batch_zone_at_its_limit_does_not_hold_up_other_zones():
+    zone_b_ran = threading.Event()
+
+    def work(entry):
+        if entry["zone"] == "zone-a":
+            # only finishes once zone-b got a worker too
+            return zone_b_ran.wait(timeout=2)
+        zone_b_ran.set()
+        return True
+
+    entries = [{"name": f"a{i}", "zone": "zone-a"} for i in range(4)] + [{"name": "b0", "zone": "zone-b"}]
+    results = run_batch(work, entries, key=lambda e: e["name"], concurrency=2,
+                        zone_of=lambda e: e["zone"], zone_limit=1)
+
+    assert all(r.value is True for r in results)
+
+
+@mock.patch("snapshot_create.create_snapshot.create_snapshot", autospec=True)
+def test_create_snapshots_batch(mock_create_snapshot):
+    def fake_create_snapshot(**kwargs):
+        if kwargs["disk_name"] == "disk-2":
+            raise RuntimeError("quota exceeded")
+        return kwargs["snapshot_name"]
+
+    mock_create_snapshot.side_effect = fake_create_snapshot
+    entries = [
+        {"target_zone": "us-central1-a", "disk_name": "disk-1",
+         "disk_project_id": "src-project", "src_snapshot_name": "snap-1"},
+        {"target_zone": "us-central1-b", "disk_name": "disk-2",
+         "disk_project_id": "src-project", "src_snapshot_name": "snap-2"},
+    ]
+
+    results = create_snapshots("test-project", entries, concurrency=2)
+
+    assert results[0].ok and results[0].value == "snap-1"
+    assert not results[1].ok
+    mock_create_snapshot.assert_any_call(
+        target_project_id="test-project", disk_name="disk-1", snapshot_name="snap-1",
+        zone="us-central1-a", disk_project_id="src-project", exit_on_error=False, watcher=None, journal=None)
@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+import sys
+import os
+import json
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
+from snapshot_create.benchmark import SCENARIOS, Case, compare, percentile, run_benchmarks
+
+
+def test_percentile():
+    values = [float(v) for v in range(1, 101)]
+    assert percentile(values, 50) == 50.0
+    assert percentile(values, 99) == 99.0
+    assert percentile([], 50) is None
+
+
+@pytest.mark.parametrize("scenario", SCENARIOS)
+def test_every_scenario_runs_against_fake_backend(scenario, tmp_path):
+    out = tmp_path / "results.jsonl"
+    case = Case(scenario, size=3, concurrency=2, latency=0.0, ready_after=1.0, time_scale=0.001)
+
+    [record] = run_benchmarks([case], out=str(out), isolate=False)
+
+    assert record["failed"] == 0
+    assert record["api_calls"] > 0
+    assert record["peak_rss_mb"] > 0
+    # a listing has no resources becoming ready
+    if scenario != "list":
+        assert record["ready_p50_s"] <= record["ready_p99_s"] <= record["wall_s"]
+    assert json.loads(out.read_text()) == record
+
+
+def test_compare_matches_cases(tmp_path):
+    baseline = tmp_path / "baseline.jsonl"
+    old = {**Case("disks", 10).__dict__, "wall_s": 2.0, "calls_per_resource": 4.0, "commit": "aaa"}
+    baseline.write_text(json.dumps(old) + "\n")
+    new = {**old, "wall_s": 1.0, "calls_per_resource": 2.0, "commit": "bbb"}
+    other = {**new, "size": 20}
+
+    [line] = compare(str(baseline), [new, other])
+    assert "-50.0%" in line
+    assert "[aaa -> bbb]" in line
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+import sys
+import os
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
+from snapshot_create import clients
+from snapshot_create.cleanup import ATTACHED, DELETED, MISSING, delete_disks, resolve_disks
+from snapshot_create.fake_compute import FakeComputeBackend
+from snapshot_create.utils import delete_disk_if_exists
+from snapshot_create.watcher import ReadinessWatcher
+
+
+@pytest.fixture
+def backend():
+    backend = FakeComputeBackend(ready_after=1.0, time_scale=0.001, seed=1)
+    clients.use_backend(backend)
+    yield backend
+    clients.use_backend(None)
+
+
+def test_existence_is_resolved_with_list_calls(backend):
+    for i in range(120):
+        backend.add_disk("p", "us-central1-a", f"disk-{i}")
+    targets = [("p", "us-central1-a", f"disk-{i}") for i in range(130)]
+
+    found = resolve_disks(targets)
+
+    assert sum(disk is not None for disk in found.values()) == 120
+    assert found[("p", "us-central1-a", "disk-125")] is None
+    # 130 names in chunks of 50, one zone: three disks.list, no gets
+    assert backend.calls["disks.list"] == 3
+    assert backend.calls["disks.get"] == 0
+
+
+def test_bulk_delete_skips_missing_and_attached(backend):
+    backend.add_disk("p", "us-central1-a", "free-1")
+    backend.add_disk("p", "us-central1-b", "free-2")
+    backend.add_disk("p", "us-central1-a", "boot", users=["projects/p/zones/us-central1-a/instances/vm-1"])
+    targets = [("p", "us-central1-a", "free-1"), ("p", "us-central1-b", "free-2"),
+               ("p", "us-central1-a", "boot"), ("p", "us-central1-a", "gone"),
+               ("p", "us-central1-a", "free-1")]
+
+    with ReadinessWatcher() as watcher:
+        results = delete_disks(targets, concurrency=4, watcher=watcher)
+
+    assert [(r.key, r.value) for r in results] == [
+        ("p/us-central1-a/free-1", DELETED), ("p/us-central1-b/free-2", DELETED),
+        ("p/us-central1-a/boot", ATTACHED), ("p/us-central1-a/gone", MISSING)]
+    assert backend.calls["disks.delete"] == 2
+    # two zones: one aggregatedList to resolve, then the watcher's shared polls
+    assert backend.calls["disks.get"] == 0
+    assert [d["name"] for d in backend.list_disks("p", "us-central1-a")] == ["boot"]
+
+
+def test_rejected_delete_reports_its_operation_error(backend):
+    backend.add_disk("p", "us-central1-a", "disk-1")
+    backend.reject_operations("disks.delete")
+
+    with ReadinessWatcher() as watcher:
+        [result] = delete_disks([("p", "us-central1-a", "disk-1")], watcher=watcher, timeout=5)
+
+    assert "simulated failure" in str(result.error)
+    assert watcher.pending() == 0
+
+
+def test_dry_run_deletes_nothing(backend):
+    backend.add_disk("p", "us-central1-a", "disk-1")
+
+    [result] = delete_disks([("p", "us-central1-a", "disk-1")], dry_run=True)
+
+    assert result.value == DELETED
+    assert backend.calls["disks.delete"] == 0
+
+
+def test_delete_disk_if_exists_no_longer_lists_the_zone(backend):
+    backend.add_disk("p", "us-central1-a", "disk-1")
+    backend.add_disk("p", "us-central1-a", "boot", users=["projects/p/zones/us-central1-a/instances/vm-1"])
+
+    delete_disk_if_exists("p", "us-central1-a", "disk-1")
+    delete_disk_if_exists("p", "us-central1-a", "boot")
+
+    assert backend.calls["disks.list"] == 0
+    assert backend.calls["disks.delete"] == 1
+    assert [d["name"] for d in backend.list_disks("p", "us-central1-a")] == ["boot"]
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+import sys
+import os
+import subprocess
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
+from snapshot_create import cli, clients
+from snapshot_create.fake_compute import FakeComputeBackend
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '../'))
+
+
+@pytest.fixture
+def backend():
+    backend = FakeComputeBackend(ready_after=1.0, time_scale=0.001, seed=1)
+    clients.use_backend(backend)
+    yield backend
+    clients.use_backend(None)
+
+
+def _write_config(tmp_path, text):
+    path = tmp_path / "config.yaml"
+    path.write_text(text)
+    return str(path)
+
+
+def test_help_and_validate_load_no_google_library(tmp_path):
+    config = _write_config(tmp_path, "disks:\n  - {target_zone: us-central1-a, disk_name: d, disk_type: pd-ssd, "
+                                     "disk_size_gb: 10, src_project_id: p, src_snapshot_name: s}\n")
+    code = ("import sys\n"
+            "from snapshot_create import cli\n"
+            "cli.build_parser().format_help()\n"
+            "cli.main(['validate', '-c', sys.argv[1]])\n"
+            "print(sorted(m for m in sys.modules if m.split('.')[0] in ('google', 'googleapiclient')))\n")
+
+    done = subprocess.run([sys.executable, "-c", code, config], cwd=ROOT, capture_output=True, text=True, check=True)
+
+    assert done.stdout.splitlines() == [f"{config}: valid (disks: 1)", "[]"]
+
+
+def test_validate_reports_every_problem(tmp_path, capsys):
+    config = _write_config(tmp_path, "snapshots:\n  - {disk_name: d}\n  - nonsense\n")
+
+    with pytest.raises(SystemExit) as exit:
+        cli.main(["validate", "-c", config])
+
+    assert exit.value.code == 1
+    err = capsys.readouterr().err
+    assert err.startswith("Invalid config:") and "snapshots[0]" in err and "snapshots[1]" in err
+
+
+def test_snapshot_create_runs_through_the_cli(backend, tmp_path):
+    backend.add_disk("p", "us-central1-a", "disk-1")
+    config = _write_config(tmp_path, "snapshots:\n  - {target_zone: us-central1-a, disk_name: disk-1, "
+                                     "disk_type: pd-ssd, disk_size_gb: 10, disk_project_id: p, "
+                                     "src_snapshot_name: snap-1}\n")
+
+    cli.main(["snapshot", "create", "-c", config, "-p", "p"])
+
+    assert backend.get_snapshot("p", "snap-1")["status"] == "READY"
+    assert os.path.exists(f"{config}.journal")
+    with pytest.raises(SystemExit) as exit:
+        cli.main(["cleanup", "-p", "p"])
+    assert exit.value.code == 2
+    with pytest.raises(SystemExit) as exit:
+        cli.main(["cleanup", "-p", "p", "--disk", "disk-1"])
+    assert exit.value.code == 2
+    with pytest.raises(SystemExit) as exit:
+        cli.main(["cleanup", "-p", "p", "-c", config])
+    assert exit.value.code == 2
+
+
+def test_snapshot_list_needs_a_project_and_lists_every_snapshot(backend, capsys):
+    backend.add_snapshot("p", "snap-1")
+    backend.add_snapshot("p", "other")
+
+    with pytest.raises(SystemExit) as exit:
+        cli.main(["snapshot", "list"])
+    assert exit.value.code == 2
+    cli.main(["snapshot", "list", "-p", "p", "-k", "5"])
+
+    out = capsys.readouterr().out
+    assert "snap-1" in out and "other" in out
@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+import sys
+import os
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
+from snapshot_create import clients
+from snapshot_create.utils import wait_for_snapshot_creation
+
+
+def test_get_client_is_shared_across_threads():
+    clients.clear_cache()
+    client_class = mock.MagicMock(__name__="DisksClient")
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        instances = list(executor.map(
+            lambda _: clients.get_client(client_class), range(32)))
+
+    client_class.assert_called_once_with()
+    assert all(instance is instances[0] for instance in instances)
+
+
+def test_get_client_keyed_by_quota_project():
+    clients.clear_cache()
+    client_class = mock.MagicMock(__name__="SnapshotsClient")
+    client_class.side_effect = lambda **kwargs: mock.MagicMock()
+
+    first = clients.get_client(client_class, quota_project_id="project-a")
+    second = clients.get_client(client_class, quota_project_id="project-b")
+
+    assert first is not second
+    assert clients.get_client(client_class, quota_project_id="project-a") is first
+    client_class.assert_any_call(client_options={"quota_project_id": "project-a"})
+
+
+@mock.patch("snapshot_create.utils.compute_v1.SnapshotsClient", autospec=True)
+def test_wait_uses_injected_client(mock_snapshots_client_class):
+    injected = mock.MagicMock()
+    injected.get.return_value.status = "READY"
+
+    assert wait_for_snapshot_creation("test-project", "test-snapshot", snapshot_client=injected)
+    mock_snapshots_client_class.assert_not_called()
+    injected.get.assert_called_once_with(project="test-project", snapshot="test-snapshot",
+                                         metadata=[("x-goog-fieldmask", "status")])
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+import sys
+import os
+import pytest
+import yaml
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
+from snapshot_create import clients
+from snapshot_create.config import ConfigError, load_config, validate_config
+from snapshot_create.fake_compute import FakeComputeBackend
+
+CONFIG_DIR = os.path.join(os.path.dirname(__file__), '../snapshot_create')
+
+
+@pytest.fixture
+def backend():
+    backend = FakeComputeBackend(ready_after=1.0, time_scale=0.001, seed=1)
+    clients.use_backend(backend)
+    yield backend
+    clients.use_backend(None)
+
+
+def _write(tmp_path, config):
+    path = tmp_path / "config.yaml"
+    path.write_text(yaml.safe_dump(config))
+    return str(path)
+
+
+def test_selectors_expand_with_one_aggregated_list_per_project(backend, tmp_path):
+    for i in range(4):
+        backend.add_disk("fleet", "us-central1-a", f"web-{i}", size_gb=20, disk_type="pd-ssd",
+                         labels={"tier": "prod"})
+    backend.add_disk("fleet", "us-east1-b", "web-9", disk_type="pd-ssd", labels={"tier": "prod"})
+    backend.add_disk("fleet", "europe-west1-b", "web-8", disk_type="pd-ssd", labels={"tier": "prod"})
+    backend.add_disk("fleet", "us-central1-a", "web-7", disk_type="pd-balanced", labels={"tier": "prod"})
+    backend.add_disk("fleet", "us-central1-a", "db-0", disk_type="pd-ssd", labels={"tier": "dev"})
+    path = _write(tmp_path, {"snapshots": [
+        {"select": {"zone": "us-*", "labels": {"tier": "prod"}, "disk_type": "pd-ssd"},
+         "src_snapshot_name": "{disk_name}-nightly"},
+        {"select": {"name_regex": "^db-"}, "src_snapshot_name": "{disk_name}-{zone}"},
+        {"target_zone": "z", "disk_name": "d", "disk_type": "pd-ssd", "disk_size_gb": 10,
+         "disk_project_id": "other", "src_snapshot_name": "hand-written"},
+    ]})
+
+    snapshots = load_config(path, "fleet")["snapshots"]
+
+    assert [s["src_snapshot_name"] for s in snapshots] == [
+        "web-0-nightly", "web-1-nightly", "web-2-nightly", "web-3-nightly", "web-9-nightly",
+        "db-0-us-central1-a", "hand-written"]
+    assert snapshots[0] == {"target_zone": "us-central1-a", "disk_name": "web-0", "disk_type": "pd-ssd",
+                            "disk_size_gb": 20, "disk_project_id": "fleet", "src_snapshot_name": "web-0-nightly"}
+    assert backend.calls["disks.aggregatedList"] == 1
+    assert backend.calls["disks.get"] == 0
+
+
+def test_disk_selectors_default_to_the_source_disk(backend, tmp_path):
+    backend.add_disk("src", "us-central1-a", "web-0", size_gb=30, disk_type="pd-ssd")
+    path = _write(tmp_path, {"disks": [
+        {"select": {"name_regex": "web"}, "src_project_id": "src",
+         "src_snapshot_name": "{disk_name}-nightly", "disk_name": "{disk_name}-restored"}]})
+
+    disks = load_config(path, "target")["disks"]
+
+    assert disks == [{"target_zone": "us-central1-a", "disk_name": "web-0-restored", "disk_type": "pd-ssd",
+                      "disk_size_gb": 30, "src_project_id": "src", "src_snapshot_name": "web-0-nightly"}]
+
+
+def test_every_problem_is_reported_before_any_call(backend):
+    config = {"disks": [
+        {"target_zone": "z", "disk_name": "d", "disk_type": "pd-ssd", "disk_size_gb": "ten",
+         "src_project_id": "p", "src_snapshot_name": "s", "colour": "red"},
+        {"select": {"name_regex": "(", "zone": 3}, "src_snapshot_name": "{disk}"},
+    ]}
+
+    with pytest.raises(ConfigError) as error:
+        validate_config(config)
+
+    assert sorted(error.value.problems) == sorted([
+        "disks[0]: unknown field colour",
+        "disks[0].disk_size_gb: expected int, got str",
+        "disks[1].select.zone: expected str, got int",
+        "disks[1].select.name_regex: missing ), unterminated subpattern at position 0",
+        "disks[1].src_snapshot_name: unknown placeholder(s) disk",
+        "disks[1]: missing src_project_id",
+    ])
+    assert sum(backend.calls.values()) == 0
+
+
+@pytest.mark.parametrize("name", ["create_snapshot_config.yaml", "create_disk_config.yaml"])
+def test_shipped_configs_are_valid(name):
+    validate_config(yaml.safe_load(open(os.path.join(CONFIG_DIR, name))))
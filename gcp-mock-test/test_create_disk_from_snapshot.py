@@ -5,11 +5,13 @@ from unittest import mock
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
 from snapshot_create.create_disk_from_snapshot import create_disk_from_snapshot
 from snapshot_create.utils import *
+from snapshot_create import clients
+from snapshot_create.discovery import load_document
 
 @mock.patch("snapshot_create.create_disk_from_snapshot.wait_for_disk_creation", autospec=True)
-@mock.patch("snapshot_create.create_disk_from_snapshot.read_config", autospec=True)
-@mock.patch("snapshot_create.create_disk_from_snapshot.build", autospec=True)
-def test_create_disk_from_snapshot(mock_build, mock_read_config, mock_wait_for_disk_creation):
+@mock.patch("snapshot_create.create_disk_from_snapshot.load_config", autospec=True)
+@mock.patch("snapshot_create.clients.build_from_document", autospec=True)
+def test_create_disk_from_snapshot(mock_build, mock_load_config, mock_wait_for_disk_creation):
     '''
      Mock service and request objects
      Note - mock object without spec might not be best practice
@@ -35,6 +37,9 @@ def test_create_disk_from_snapshot(mock_build, mock_read_config, mock_wait_for_d
     # Mock the get request execution
     mock_get_request.return_value = {"name": "test-disk"}
 
+    # the discovery service is shared per thread, start from an empty cache
+    clients.clear_cache()
+
     # Call the function under test
     result = create_disk_from_snapshot(
         src_project_id="test-src-project",
@@ -48,7 +53,8 @@ def test_create_disk_from_snapshot(mock_build, mock_read_config, mock_wait_for_d
     print("RESULT", result)
 
     # Assertions
-    mock_build.assert_called_once_with("compute", "v1", cache_discovery=False)
+    # built from the cached discovery document, no download
+    mock_build.assert_called_once_with(load_document(), requestBuilder=clients.InstrumentedRequest)
     mock_disks.insert.assert_called_once_with(
         project="test-target-project",
         zone="us-central1-a",
@@ -68,4 +74,38 @@ def test_create_disk_from_snapshot(mock_build, mock_read_config, mock_wait_for_d
         disk="test-disk"
     )
     # mock_get_request.assert_called_once()  # Ensure execute is called on get
-    assert result == mock_get_request
\ No newline at end of file
+    assert result == mock_get_request
+
+
+@mock.patch("snapshot_create.clients.build_from_document", autospec=True)
+def test_create_disk_from_snapshot_reuses_service(mock_build):
+    clients.clear_cache()
+    for name in ("disk-1", "disk-2"):
+        create_disk_from_snapshot(
+            src_project_id="test-src-project",
+            target_zone="us-central1-a",
+            disk_name=name,
+            disk_type="pd-standard",
+            disk_size_gb=100,
+            target_project_id="test-target-project",
+            src_snapshot_name="test-snapshot"
+        )
+    # discovery document is parsed once, not per disk
+    mock_build.assert_called_once()
+
+
+def test_create_disk_from_snapshot_injected_service():
+    mock_service = mock.MagicMock()
+    with mock.patch("snapshot_create.clients.build_from_document", autospec=True) as mock_build:
+        create_disk_from_snapshot(
+            src_project_id="test-src-project",
+            target_zone="us-central1-a",
+            disk_name="test-disk",
+            disk_type="pd-standard",
+            disk_size_gb=100,
+            target_project_id="test-target-project",
+            src_snapshot_name="test-snapshot",
+            service=mock_service
+        )
+    mock_build.assert_not_called()
+    mock_service.disks.return_value.insert.assert_called_once()
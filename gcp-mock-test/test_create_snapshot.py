@@ -59,10 +59,13 @@ def test_create_snapshot_with_zone(mock_wait, mock_snapshots_client_class, mock_
     )
 
     mock_disks_client.get.assert_called_once_with(
-        project="test-project", zone="us-central1-a", disk="test-disk"
+        project="test-project", zone="us-central1-a", disk="test-disk",
+        metadata=[("x-goog-fieldmask", "selfLink")]
     )
     mock_snapshots_client.insert.assert_called_once()
-    mock_wait.assert_called_once_with("test-project", "test-snapshot")
+    mock_wait.assert_called_once_with(
+        "test-project", "test-snapshot", snapshot_client=mock_snapshots_client,
+        operation=mock_snapshots_client.insert.return_value, watcher=None)
     assert result == mock_snapshot
 
 # Mocking all necessary classes and methods for region-based snapshot creation
@@ -87,10 +90,13 @@ def test_create_snapshot_with_region(mock_wait, mock_snapshots_client_class, moc
     )
 
     mock_region_disks_client.get.assert_called_once_with(
-        project="test-project", region="us-central1", disk="test-disk"
+        project="test-project", region="us-central1", disk="test-disk",
+        metadata=[("x-goog-fieldmask", "selfLink")]
     )
     mock_snapshots_client.insert.assert_called_once()
-    mock_wait.assert_called_once_with("test-project", "test-snapshot")
+    mock_wait.assert_called_once_with(
+        "test-project", "test-snapshot", snapshot_client=mock_snapshots_client,
+        operation=mock_snapshots_client.insert.return_value, watcher=None)
     assert result == mock_snapshot
     
     
@@ -120,10 +126,13 @@ def test_create_snapshot_with_zone2(mock_wait,  mock_compute_v1):
     )
 
     mock_disks_client.get.assert_called_once_with(
-        project="test-project", zone="us-central1-a", disk="test-disk"
+        project="test-project", zone="us-central1-a", disk="test-disk",
+        metadata=[("x-goog-fieldmask", "selfLink")]
     )
     mock_snapshots_client.insert.assert_called_once()
-    mock_wait.assert_called_once_with("test-project", "test-snapshot")
+    mock_wait.assert_called_once_with(
+        "test-project", "test-snapshot", snapshot_client=mock_snapshots_client,
+        operation=mock_snapshots_client.insert.return_value, watcher=None)
     assert result == mock_snapshot
 
 
@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+import sys
+import os
+import json
+import threading
+import time
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
+from snapshot_create import clients
+from snapshot_create.config import ConfigError
+from snapshot_create.daemon import FAILED, PROCESSING, SUCCEEDED, Daemon, read_status, submit
+from snapshot_create.fake_compute import FakeComputeBackend
+from snapshot_create.watcher import ReadinessWatcher
+
+
+@pytest.fixture
+def backend():
+    backend = FakeComputeBackend(ready_after=1.0, time_scale=0.001, seed=1)
+    clients.use_backend(backend)
+    yield backend
+    clients.use_backend(None)
+
+
+@pytest.fixture
+def serve(tmp_path):
+    daemons = []
+
+    def start(workers=8, **kwargs):
+        daemon = Daemon(str(tmp_path), workers=workers, poll_interval=0.01, watcher=ReadinessWatcher(),
+                        **kwargs)
+        thread = threading.Thread(target=daemon.run)
+        thread.start()
+        daemons.append((daemon, thread))
+        return daemon
+
+    yield start
+    for daemon, thread in daemons:
+        daemon.stop()
+        thread.join(timeout=30)
+
+
+def _wait_for(spool, job_id, timeout=20):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        status = read_status(spool, job_id)
+        if status and status["state"] in (SUCCEEDED, FAILED):
+            return status
+        time.sleep(0.01)
+    raise AssertionError(f"job {job_id} did not finish: {read_status(spool, job_id)}")
+
+
+def _snapshot(disk, name, project="team-a"):
+    return {"target_zone": "us-central1-a", "disk_name": disk, "disk_type": "pd-ssd", "disk_size_gb": 10,
+            "disk_project_id": project, "src_snapshot_name": name}
+
+
+def test_jobs_of_several_teams_share_one_daemon(backend, tmp_path, serve):
+    spool = str(tmp_path)
+    for i in range(5):
+        backend.add_disk("team-a", "us-central1-a", f"disk-{i}")
+    backend.add_snapshot("team-b", "golden")
+    serve()
+
+    snapshots = submit(spool, "snapshots", "team-a", [_snapshot(f"disk-{i}", f"snap-{i}") for i in range(5)])
+    selected = submit(spool, "disks", "team-b", [
+        {"select": {"project": "team-a", "name_regex": "^disk-[0-2]$"}, "src_project_id": "team-b",
+         "src_snapshot_name": "golden", "disk_name": "{disk_name}-copy"}])
+    clones = submit(spool, "disks", "team-b", [
+        {"target_zone": "us-central1-b", "disk_name": f"clone-{i}", "disk_type": "pd-ssd",
+         "disk_size_gb": 10, "src_project_id": "team-b", "src_snapshot_name": "golden"} for i in range(3)])
+
+    assert _wait_for(spool, snapshots)["results"] == {f"snap-{i}": {"state": "ready"} for i in range(5)}
+    assert _wait_for(spool, selected)["results"] == {
+        f"us-central1-a/disk-{i}-copy": {"state": "ready"} for i in range(3)}
+    status = _wait_for(spool, clones)
+    assert status["state"] == SUCCEEDED and status["plan"]["create"] == 3
+    assert backend.calls["disks.insert"] == 6
+    assert sorted(os.listdir(tmp_path / "done")) == sorted(f"{job}.jsonl" for job in (snapshots, selected, clones))
+
+
+def test_a_project_at_its_limit_leaves_workers_to_other_teams(backend, tmp_path, serve, monkeypatch):
+    spool = str(tmp_path)
+    for i in range(4):
+        backend.add_disk("team-a", "us-central1-a", f"disk-{i}")
+    backend.add_disk("team-b", "us-central1-a", "disk-b")
+    team_a_ran, team_b_ran = threading.Event(), threading.Event()
+
+    def snapshot_entry(self, job, entry):
+        # team-a's entries only finish once team-b got a worker
+        if job.job["project_id"] == "team-a":
+            team_a_ran.set()
+            if not team_b_ran.wait(timeout=5):
+                raise RuntimeError("team-b never got a worker")
+        team_b_ran.set()
+
+    monkeypatch.setattr(Daemon, "_snapshot_entry", snapshot_entry)
+    serve(workers=2, project_limit=1)
+
+    big = submit(spool, "snapshots", "team-a", [_snapshot(f"disk-{i}", f"snap-{i}") for i in range(4)])
+    # team-b comes in while all of team-a's entries are queued
+    assert team_a_ran.wait(timeout=5)
+    time.sleep(0.05)
+    small = submit(spool, "snapshots", "team-b", [_snapshot("disk-b", "snap-b", project="team-b")])
+
+    assert _wait_for(spool, small)["state"] == SUCCEEDED
+    assert _wait_for(spool, big)["state"] == SUCCEEDED
+
+
+def test_bad_jobs_fail_without_touching_anything(backend, tmp_path, serve):
+    spool = str(tmp_path)
+    with pytest.raises(ConfigError):
+        submit(spool, "disks", "p", [{"disk_name": "incomplete"}])
+    serve()
+
+    job = submit(spool, "snapshots", "team-a", [_snapshot("missing-disk", "snap-1")])
+
+    status = _wait_for(spool, job)
+    assert status["state"] == FAILED
+    assert status["problems"] == ["snap-1: source disk missing-disk in us-central1-a of project team-a does not exist"]
+    assert backend.calls["snapshots.insert"] == 0
+
+
+def test_claimed_jobs_are_resumed_after_a_restart(backend, tmp_path, serve):
+    spool = str(tmp_path)
+    backend.add_disk("team-a", "us-central1-a", "disk-0")
+    job = submit(spool, "snapshots", "team-a", [_snapshot("disk-0", "snap-0")])
+    # a daemon claimed the file and stopped before running it
+    os.makedirs(tmp_path / PROCESSING, exist_ok=True)
+    os.replace(tmp_path / "incoming" / f"{job}.jsonl", tmp_path / PROCESSING / f"{job}.jsonl")
+
+    serve()
+
+    assert _wait_for(spool, job)["state"] == SUCCEEDED
+    assert json.loads((tmp_path / "done" / f"{job}.jsonl").read_text())["id"] == job
@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+import sys
+import os
+import json
+import pytest
+from unittest import mock
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
+from snapshot_create import discovery
+
+
+@pytest.fixture(autouse=True)
+def fresh_document():
+    discovery.reset()
+    yield
+    discovery.reset()
+
+
+def test_newest_cached_revision_wins_and_is_parsed_once(tmp_path):
+    (tmp_path / "compute.v1.20240101.json").write_text(json.dumps({"revision": "20240101"}))
+    (tmp_path / "compute.v1.20250101.json").write_text(json.dumps({"revision": "20250101"}))
+
+    with mock.patch("snapshot_create.discovery.json.loads", wraps=json.loads) as loads:
+        first = discovery.load_document(tmp_path)
+        second = discovery.load_document(tmp_path)
+
+    assert first["revision"] == "20250101"
+    assert second is first
+    loads.assert_called_once()
+
+
+def test_falls_back_to_bundled_copy(tmp_path):
+    (tmp_path / "compute.v1.20250101.json").write_text("{truncated")
+
+    document = discovery.load_document(tmp_path)
+
+    assert document["name"] == "compute"
+    assert "disks" in document["resources"]
+
+
+def test_refresh_writes_versioned_file(tmp_path):
+    for revision in ("20240101", "20240201", "20240301"):
+        (tmp_path / f"compute.v1.{revision}.json").write_text(json.dumps({"revision": revision}))
+    response = mock.MagicMock()
+    response.json.return_value = {"revision": "20250401", "name": "compute"}
+
+    with mock.patch("snapshot_create.discovery.requests.get", return_value=response) as get:
+        path = discovery.refresh_document(tmp_path)
+
+    get.assert_called_once_with(discovery.DISCOVERY_URL, timeout=30)
+    assert path.name == "compute.v1.20250401.json"
+    assert [p.name for p in discovery.cached_files(tmp_path)] == [
+        "compute.v1.20240201.json", "compute.v1.20240301.json", "compute.v1.20250401.json"]
+    assert discovery.load_document(tmp_path)["revision"] == "20250401"
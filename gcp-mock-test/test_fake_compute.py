@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+import sys
+import os
+import pytest
+from google.api_core import exceptions
+from googleapiclient.errors import HttpError
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
+from snapshot_create import clients
+from snapshot_create.create_disk_from_snapshot import create_disk_from_snapshot
+from snapshot_create.create_snapshot import create_snapshot
+from snapshot_create.fake_compute import FakeApiError, FakeComputeBackend, backend_from_spec, matches_filter
+from snapshot_create.list_snapshot import iter_snapshots
+from snapshot_create.ratelimit import RetryPolicy
+from snapshot_create.watcher import ReadinessWatcher
+
+
+@pytest.fixture
+def backend():
+    backend = FakeComputeBackend(ready_after=1.0, time_scale=0.01, seed=1)
+    clients.use_backend(backend)
+    yield backend
+    clients.use_backend(None)
+
+
+def test_snapshot_then_disk_end_to_end(backend):
+    backend.add_disk("src-project", "us-central1-a", "disk-1", size_gb=20)
+
+    snapshot = create_snapshot("src-project", "disk-1", "snap-1", "us-central1-a",
+                               None, "us", "src-project", exit_on_error=False)
+    assert snapshot.status == "READY"
+    assert snapshot.disk_size_gb == 20
+
+    create_disk_from_snapshot("src-project", "us-central1-b", "disk-2", "pd-ssd", None,
+                              "target-project", "snap-1", raise_on_error=True, wait=True)
+    disk = backend.get_disk("target-project", "us-central1-b", "disk-2")
+    assert disk["status"] == "READY"
+    assert disk["sizeGb"] == "20"
+    assert backend.calls["snapshots.insert"] == 1
+    assert backend.calls["disks.insert"] == 1
+
+
+def test_injected_errors_surface_as_library_errors(backend):
+    backend.add_disk("src-project", "us-central1-a", "disk-1")
+    # 429s are retried, so they only surface once every attempt was throttled
+    backend.inject_errors("snapshots.insert", *[429] * RetryPolicy().max_attempts)
+    backend.inject_errors("disks.insert", 503)
+
+    with pytest.raises(exceptions.TooManyRequests):
+        create_snapshot("src-project", "disk-1", "snap-1", "us-central1-a",
+                        None, "us", "src-project", exit_on_error=False)
+    with pytest.raises(HttpError) as error:
+        create_disk_from_snapshot("src-project", "us-central1-b", "disk-2", "pd-ssd", None,
+                                  "target-project", "snap-1", raise_on_error=True)
+    assert error.value.resp.status == 503
+
+
+def test_list_is_paginated(backend):
+    for i in range(1200):
+        backend.add_snapshot("src-project", f"snap-{i}")
+
+    assert len(list(iter_snapshots("src-project"))) == 1200
+    assert backend.calls["snapshots.list"] == 3
+
+
+def test_watcher_against_backend(backend):
+    backend.add_disk("target-project", "us-central1-a", "disk-1", ready=False)
+
+    with ReadinessWatcher() as watcher:
+        disk = watcher.watch_disk("target-project", "us-central1-a", "disk-1").result(timeout=5)
+
+    assert disk.status == "READY"
+    assert backend.calls["disks.aggregatedList"] >= 1
+
+
+def test_watcher_times_out_on_the_simulated_clock(backend):
+    backend.ready_after = lambda: 10_000.0
+    backend.add_disk("target-project", "us-central1-a", "disk-1", ready=False)
+
+    # 50 simulated seconds are half a real second at time_scale 0.01
+    with ReadinessWatcher() as watcher:
+        with pytest.raises(TimeoutError, match="did not become ready"):
+            watcher.watch_disk("target-project", "us-central1-a", "disk-1", timeout=50).result(timeout=10)
+
+
+def test_quota_window_is_on_the_simulated_clock():
+    backend = FakeComputeBackend(quota_per_second=10, time_scale=0.01)
+
+    # 2 calls per simulated second stay under the quota, however fast they run in real time
+    for _ in range(20):
+        backend._call("disks.get", "p")
+        backend.sleep(0.5)
+    throttled = 0
+    for _ in range(20):
+        try:
+            backend._call("disks.get", "p")
+        except FakeApiError as e:
+            assert e.code == 429
+            throttled += 1
+    assert throttled >= 10
+
+
+def test_backend_from_spec_takes_every_knob():
+    backend = backend_from_spec('{"forbidden_projects": ["locked"], "quota_per_second": 5}')
+
+    assert backend.forbidden_projects == {"locked"}
+    with pytest.raises(FakeApiError) as error:
+        backend._call("disks.get", "locked")
+    assert error.value.code == 403
+
+
+def test_matches_filter():
+    snapshot = {"name": "snap-2", "status": "READY", "creationTimestamp": "2024-01-02T00:00:00.000-07:00"}
+
+    assert matches_filter(snapshot, "name=snap-*")
+    assert matches_filter(snapshot, '(name = "snap-1") OR (name = "snap-2")')
+    assert matches_filter(snapshot, 'creationTimestamp > "2024-01-01T00:00:00.000-07:00" AND status = READY')
+    assert not matches_filter(snapshot, "status != READY")
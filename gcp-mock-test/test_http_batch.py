@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+import sys
+import os
+import time
+import httplib2
+import pytest
+from googleapiclient.discovery import build_from_document
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
+from snapshot_create import clients
+from snapshot_create.create_disk_from_snapshot import create_disks_from_snapshots
+from snapshot_create.discovery import load_document
+from snapshot_create.fake_compute import FakeComputeBackend
+from snapshot_create.http_batch import BatchCall, execute_batched
+from snapshot_create.journal import DISKS, FAILED, READY, Journal
+
+
+@pytest.fixture
+def backend():
+    backend = FakeComputeBackend(ready_after=1.0, time_scale=0.001, seed=1)
+    clients.use_backend(backend)
+    yield backend
+    clients.use_backend(None)
+
+
+def _disk_entries(n):
+    return [{"target_zone": "us-central1-a", "disk_name": f"disk-{i}", "disk_type": "pd-balanced",
+             "disk_size_gb": 10, "src_project_id": "src", "src_snapshot_name": "snap-1"} for i in range(n)]
+
+
+def test_calls_are_chunked_into_batches(backend):
+    for i in range(250):
+        backend.add_disk("p", "us-central1-a", f"disk-{i}")
+    service = clients.get_compute_service()
+    calls = [BatchCall(f"disk-{i}", "disks.get", "p",
+                       service.disks().get(project="p", zone="us-central1-a", disk=f"disk-{i}"))
+             for i in range(250)]
+
+    results = execute_batched(service, calls, batch_size=100)
+
+    assert [r.value["name"] for r in results] == [f"disk-{i}" for i in range(250)]
+    assert backend.calls["batch"] == 3
+    assert backend.calls["disks.get"] == 250
+
+
+def test_partial_failures_stay_with_their_item(backend):
+    backend.add_disk("p", "us-central1-a", "disk-0")
+    backend.add_disk("p", "us-central1-a", "disk-2")
+    backend.inject_errors("disks.get", 503)
+    service = clients.get_compute_service()
+    calls = [BatchCall(f"disk-{i}", "disks.get", "p",
+                       service.disks().get(project="p", zone="us-central1-a", disk=f"disk-{i}"))
+             for i in range(3)]
+
+    results = execute_batched(service, calls)
+
+    # the 503 on disk-0 was retried in a second batch, the 404 of disk-1 is final
+    assert results[0].ok and results[2].ok
+    assert results[1].error.resp.status == 404
+    assert backend.calls["batch"] == 2
+
+
+def test_failed_batch_request_is_retried_as_a_unit(backend):
+    for i in range(20):
+        backend.add_disk("p", "us-central1-a", f"disk-{i}")
+    backend.inject_errors("batch", 503)
+    service = clients.get_compute_service()
+    calls = [BatchCall(f"disk-{i}", "disks.get", "p",
+                       service.disks().get(project="p", zone="us-central1-a", disk=f"disk-{i}"))
+             for i in range(20)]
+
+    results = execute_batched(service, calls)
+
+    assert all(r.ok for r in results)
+    assert backend.calls["batch"] == 2
+    assert service.guard.breaker("p").state == "closed"
+
+
+def test_bulk_create_and_wait(backend, tmp_path):
+    backend.add_snapshot("src", "snap-1")
+    entries = _disk_entries(120)
+    backend.inject_errors("disks.insert", 503)
+
+    with Journal(str(tmp_path / "run.journal")) as journal:
+        results = create_disks_from_snapshots("target", entries, batch_size=50, journal=journal)
+
+        # a 503 may have created the disk, so the insert is not sent again
+        assert not results[0].ok
+        assert journal.state(DISKS, "us-central1-a/disk-0") == FAILED
+        assert all(r.ok and r.value["status"] == "READY" for r in results[1:])
+        assert journal.is_done(DISKS, "us-central1-a/disk-119")
+    assert backend.calls["disks.insert"] == 120
+    # three insert batches, then polling rounds of at most three batches each
+    assert backend.calls["batch"] < 20
+
+
+def test_bulk_wait_times_out_on_the_fake_backend_clock(backend):
+    backend.add_snapshot("src", "snap-1")
+    backend.ready_after = lambda: 10_000
+
+    start = time.monotonic()
+    results = create_disks_from_snapshots("target", _disk_entries(3), timeout=300)
+
+    assert all(isinstance(r.error, TimeoutError) for r in results)
+    assert time.monotonic() - start < 10
+
+
+def test_bulk_resume_does_not_insert_again(backend, tmp_path):
+    backend.add_snapshot("src", "snap-1")
+    path = str(tmp_path / "run.journal")
+    with Journal(path) as journal:
+        create_disks_from_snapshots("target", _disk_entries(3), wait=False, journal=journal)
+
+    with Journal(path, resume=True) as journal:
+        results = create_disks_from_snapshots("target", _disk_entries(3), journal=journal)
+        assert all(journal.state(DISKS, r.key) == READY for r in results)
+    assert backend.calls["disks.insert"] == 3
+
+
+def test_real_service_batches_to_compute_batch_endpoint():
+    service = build_from_document(load_document(), http=httplib2.Http(),
+                                  requestBuilder=clients.InstrumentedRequest)
+    batch = service.new_batch_http_request()
+    batch.add(service.disks().get(project="p", zone="z", disk="d"), request_id="z/d")
+
+    assert batch._batch_uri == "https://compute.googleapis.com/batch/compute/v1"
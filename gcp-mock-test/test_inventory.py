@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+import sys
+import os
+from unittest import mock
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
+from snapshot_create.inventory import Inventory
+from snapshot_create.list_snapshot import iter_snapshots, list_snapshots
+from snapshot_create.utils import delete_disk_if_exists
+
+DISK_URL = "https://www.googleapis.com/compute/v1/projects/test-project/zones/us-central1-a/disks/"
+
+
+def snapshot(name, day, disk="disk-1", status="READY"):
+    return {"name": name, "status": status, "sourceDisk": DISK_URL + disk,
+            "creationTimestamp": f"2025-04-{day:02d}T10:00:00.000-07:00"}
+
+
+def single_page_service(*pages):
+    '''Each snapshots().list call returns the next single-page response, then empty pages'''
+    service = mock.MagicMock()
+    snapshots = service.snapshots.return_value
+    snapshots.list.side_effect = [
+        mock.MagicMock(**{"execute.return_value": page}) for page in pages + ({},) * 5]
+    snapshots.list_next.return_value = None
+    return service
+
+
+def test_latest_snapshot_of_disk_is_a_local_lookup():
+    service = single_page_service({"items": [
+        snapshot("a", 1), snapshot("b", 3), snapshot("c", 2), snapshot("other", 5, disk="disk-2")]})
+    inventory = Inventory(":memory:", service=service)
+
+    assert inventory.latest_snapshot("test-project", source_disk="us-central1-a/disks/disk-1")["name"] == "b"
+    assert inventory.latest_snapshot("test-project", source_disk="zones/us-central1-a/disks/disk-2")["name"] == "other"
+    assert inventory.snapshot_exists("test-project", "c")
+    # everything above came from one listing
+    service.snapshots.return_value.list.assert_called_once()
+
+
+def test_incremental_refresh_fetches_only_newer_snapshots():
+    service = single_page_service(
+        {"items": [snapshot("a", 1), snapshot("b", 2)]},
+        {"items": [snapshot("c", 4)]},
+    )
+    inventory = Inventory(":memory:", refresh_interval=0, service=service)
+
+    inventory.refresh_snapshots("test-project")
+    inventory.refresh_snapshots("test-project")
+    # no further refreshes from the lookups below
+    inventory.refresh_interval = inventory.ttl = 3600
+
+    second = service.snapshots.return_value.list.call_args_list[1]
+    assert second.kwargs["filter"] == 'creationTimestamp > "2025-04-02T10:00:00.000-07:00"'
+    assert [s["name"] for s in inventory.find_snapshots("test-project")] == ["c", "b", "a"]
+
+
+def test_incremental_refresh_rechecks_snapshots_still_in_flight():
+    service = single_page_service(
+        {"items": [snapshot("a", 1, status="CREATING"), snapshot("b", 2)]},
+        {"items": [snapshot("a", 1), snapshot("b", 2)]},
+    )
+    inventory = Inventory(":memory:", refresh_interval=0, service=service)
+
+    inventory.refresh_snapshots("test-project")
+    inventory.refresh_snapshots("test-project")
+    # no further refreshes from the lookups below
+    inventory.refresh_interval = inventory.ttl = 3600
+
+    second = service.snapshots.return_value.list.call_args_list[1]
+    assert second.kwargs["filter"] == 'creationTimestamp >= "2025-04-01T10:00:00.000-07:00"'
+    assert inventory.find_snapshots("test-project", name="a")[0]["status"] == "READY"
+
+
+def test_ttl_forces_full_relist_and_drops_deleted():
+    service = single_page_service(
+        {"items": [snapshot("a", 1), snapshot("b", 2)]},
+        {"items": [snapshot("b", 2)]},
+    )
+    inventory = Inventory(":memory:", ttl=0, refresh_interval=0, service=service)
+
+    inventory.refresh_snapshots("test-project")
+    inventory.refresh_snapshots("test-project")
+    # no further refreshes from the lookups below
+    inventory.refresh_interval = inventory.ttl = 3600
+
+    assert "filter" not in service.snapshots.return_value.list.call_args_list[1].kwargs
+    assert not inventory.snapshot_exists("test-project", "a")
+    assert inventory.snapshot_exists("test-project", "b")
+
+
+def test_list_snapshots_reads_inventory():
+    service = single_page_service({"items": [snapshot("snap-1", 1), snapshot("snap-2", 2)]})
+    inventory = Inventory(":memory:", service=service)
+
+    assert list_snapshots("test-project", "name=snap-*", inventory=inventory)["name"] == "snap-2"
+
+
+def test_inventory_returns_the_records_a_listing_returns():
+    item = dict(snapshot("snap-1", 1), diskSizeGb="10", storageBytes="1024", labels={"team": "a"},
+                selfLink="https://www.googleapis.com/compute/v1/projects/test-project/global/snapshots/snap-1")
+    listed = next(iter_snapshots("test-project", service=single_page_service({"items": [item]})))
+    inventory = Inventory(":memory:", service=single_page_service({"items": [item]}))
+
+    cached = list_snapshots("test-project", "name=snap-1", inventory=inventory)
+
+    assert type(cached) is type(listed) and cached == listed
+    assert cached.creation_timestamp == item["creationTimestamp"] and cached["sourceDisk"] == item["sourceDisk"]
+
+
+def test_snapshot_list_command_reads_the_inventory(tmp_path, capsys):
+    from snapshot_create import cli
+    service = single_page_service({"items": [snapshot("snap-1", 1), snapshot("snap-2", 2)]})
+    path = str(tmp_path / "inventory.sqlite3")
+
+    with mock.patch("snapshot_create.list_snapshot.get_compute_service", return_value=service):
+        cli.main(["snapshot", "list", "-p", "test-project", "-f", "name=snap-*", "-k", "2", "--inventory", path])
+
+    assert service.snapshots.return_value.list.call_count == 1
+    out = capsys.readouterr().out
+    assert out.index("snap-2") < out.index("snap-1")
+
+
+@mock.patch("snapshot_create.utils.compute_v1.DisksClient", autospec=True)
+def test_delete_disk_if_exists_skips_missing_disk(mock_disks_client_class):
+    service = mock.MagicMock()
+    service.disks.return_value.aggregatedList.return_value.execute.return_value = {
+        "items": {"zones/us-central1-a": {"disks": [
+            {"name": "disk-1", "creationTimestamp": "2025-04-01T10:00:00.000-07:00"}]}}}
+    service.disks.return_value.aggregatedList_next.return_value = None
+    inventory = Inventory(":memory:", service=service)
+
+    delete_disk_if_exists("test-project", "us-central1-a", "missing-disk", inventory=inventory)
+
+    assert inventory.disk_exists("test-project", "us-central1-a", "disk-1")
+    mock_disks_client_class.return_value.get.assert_not_called()
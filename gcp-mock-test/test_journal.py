@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+import sys
+import os
+import json
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
+from snapshot_create import clients
+from snapshot_create.create_disk_from_snapshot import create_disk_from_snapshot
+from snapshot_create.create_snapshot import create_snapshot
+from snapshot_create.fake_compute import FakeComputeBackend
+from snapshot_create.journal import (
+    DISKS, FAILED, OPERATION, READY, SNAPSHOTS, SUBMITTED, Journal, entries_to_run, load)
+from snapshot_create.plan import plan_snapshots
+
+
+@pytest.fixture
+def backend():
+    backend = FakeComputeBackend(ready_after=1.0, time_scale=0.001)
+    clients.use_backend(backend)
+    yield backend
+    clients.use_backend(None)
+
+
+def test_replay_keeps_latest_state_and_ignores_torn_line(tmp_path):
+    path = str(tmp_path / "run.journal")
+    with Journal(path) as journal:
+        journal.record(DISKS, "zone-a/disk-1", SUBMITTED, project="p")
+        journal.record(DISKS, "zone-a/disk-1", OPERATION, operation="operation-1")
+        journal.record(DISKS, "zone-a/disk-2", SUBMITTED, project="p")
+        journal.record(DISKS, "zone-a/disk-2", READY)
+        journal.record(SNAPSHOTS, "snap-1", FAILED, error="boom")
+    with open(path, "a") as f:
+        f.write('{"kind": "disks", "key": "zone-a/disk-3", "sta')
+
+    entries = load(path)
+    assert entries[(DISKS, "zone-a/disk-1")]["operation"] == "operation-1"
+    assert entries[(DISKS, "zone-a/disk-1")]["project"] == "p"
+    assert (DISKS, "zone-a/disk-3") not in entries
+
+    resumed = Journal(path, resume=True)
+    assert resumed.pending(DISKS, "zone-a/disk-1")["state"] == OPERATION
+    assert resumed.is_done(DISKS, "zone-a/disk-2")
+    assert resumed.state(SNAPSHOTS, "snap-1") == FAILED
+    resumed.close()
+    # a fresh run starts an empty journal
+    Journal(path).close()
+    assert load(path) == {}
+
+
+def test_resumed_snapshot_is_reattached_not_reinserted(backend, tmp_path):
+    source = "https://www.googleapis.com/compute/v1/projects/src/zones/us-central1-a/disks/disk-{}"
+    backend.add_disk("src", "us-central1-a", "disk-1")
+    backend.add_disk("src", "us-central1-a", "disk-2")
+    backend.add_disk("src", "us-central1-a", "disk-3")
+    # run 1 finished snap-1 and had submitted snap-2 when it was interrupted
+    backend.add_snapshot("target", "snap-1", source_disk=source.format(1))
+    backend.add_snapshot("target", "snap-2", source_disk=source.format(2), ready=False)
+    path = str(tmp_path / "run.journal")
+    with Journal(path) as journal:
+        journal.record(SNAPSHOTS, "snap-1", READY)
+        journal.record(SNAPSHOTS, "snap-2", OPERATION, operation="operation-9")
+    entries = [{"target_zone": "us-central1-a", "disk_name": f"disk-{i}", "disk_project_id": "src",
+                "src_snapshot_name": f"snap-{i}"} for i in (1, 2, 3)]
+    backend.calls.clear()
+
+    with Journal(path, resume=True) as journal:
+        todo = entries_to_run(plan_snapshots("target", entries), journal)
+        assert [e["src_snapshot_name"] for e in todo] == ["snap-2", "snap-3"]
+        for entry in todo:
+            create_snapshot("target", entry["disk_name"], entry["src_snapshot_name"], zone="us-central1-a",
+                            disk_project_id="src", exit_on_error=False, journal=journal)
+        assert journal.is_done(SNAPSHOTS, "snap-2")
+        assert journal.is_done(SNAPSHOTS, "snap-3")
+
+    # only snap-3 was inserted; snap-2 was waited on
+    assert backend.calls["snapshots.insert"] == 1
+    assert [json.loads(line)["state"] for line in open(path)][-1] == READY
+
+
+def test_resumed_disk_waits_on_recorded_operation(backend, tmp_path):
+    backend.add_snapshot("src", "snap-1")
+    operation = backend.insert_disk("target", "us-central1-a", {
+        "name": "disk-1", "sourceSnapshot": "projects/src/global/snapshots/snap-1"})
+    path = str(tmp_path / "run.journal")
+    with Journal(path) as journal:
+        journal.record(DISKS, "us-central1-a/disk-1", OPERATION, operation=operation["name"])
+    backend.calls.clear()
+
+    with Journal(path, resume=True) as journal:
+        assert create_disk_from_snapshot("src", "us-central1-a", "disk-1", "pd-balanced", 10, "target",
+                                         "snap-1", raise_on_error=True, wait=True, journal=journal)
+        assert journal.is_done(DISKS, "us-central1-a/disk-1")
+
+    assert backend.calls["disks.insert"] == 0
+    assert backend.calls["zoneOperations.wait"] >= 1
+
+
+def test_failure_is_journaled(backend, tmp_path):
+    backend.add_disk("src", "us-central1-a", "disk-1")
+    backend.inject_errors("snapshots.insert", 503)
+
+    with Journal(str(tmp_path / "run.journal")) as journal:
+        with pytest.raises(Exception):
+            create_snapshot("target", "disk-1", "snap-1", zone="us-central1-a", disk_project_id="src",
+                            exit_on_error=False, journal=journal)
+        assert journal.state(SNAPSHOTS, "snap-1") == FAILED
+        # a failed entry is retried by the next run
+        assert journal.pending(SNAPSHOTS, "snap-1") is None
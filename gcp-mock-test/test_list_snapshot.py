@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+import sys
+import os
+from unittest import mock
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
+from snapshot_create.list_snapshot import iter_snapshots, list_snapshots, top_k_snapshots
+from snapshot_create.records import SNAPSHOT_LIST_FIELDS
+
+
+def paged_service(pages):
+    '''
+    Discovery-style service whose snapshots().list_next walks `pages`
+    and returns None after the last one, like googleapiclient does
+    '''
+    service = mock.MagicMock()
+    snapshots = service.snapshots.return_value
+    requests = [mock.MagicMock() for _ in pages]
+    for request, page in zip(requests, pages):
+        request.execute.return_value = page
+    snapshots.list.return_value = requests[0]
+    snapshots.list_next.side_effect = requests[1:] + [None]
+    return service, requests
+
+
+def snapshot(name, created):
+    return {"name": name, "creationTimestamp": created}
+
+
+def test_iter_snapshots_follows_every_page_lazily():
+    service, requests = paged_service([
+        {"items": [snapshot("a", "2025-04-01T10:00:00.000-07:00")], "nextPageToken": "t1"},
+        {"items": [snapshot("b", "2025-04-02T10:00:00.000-07:00")], "nextPageToken": "t2"},
+        {"items": [snapshot("c", "2025-04-03T10:00:00.000-07:00")]},
+    ])
+
+    stream = iter_snapshots("test-project", filter="name=snap*", service=service)
+    assert next(stream)["name"] == "a"
+    # only the first page has been fetched so far
+    requests[1].execute.assert_not_called()
+    assert [s["name"] for s in stream] == ["b", "c"]
+    service.snapshots.return_value.list.assert_called_once_with(
+        project="test-project", maxResults=500, filter="name=snap*", fields=SNAPSHOT_LIST_FIELDS)
+
+
+def test_list_snapshots_returns_most_recent_across_pages():
+    service, _ = paged_service([
+        {"items": [snapshot("old", "2025-04-01T10:00:00.000-07:00"),
+                   # earlier in UTC than "new" despite the larger local time
+                   snapshot("mid", "2025-04-02T23:00:00.000+09:00")]},
+        {"items": [snapshot("new", "2025-04-02T10:00:00.000-07:00")]},
+        {},
+    ])
+
+    assert list_snapshots("test-project", "name=snap*", service=service)["name"] == "new"
+
+
+def test_list_snapshots_without_filter_sorts_server_side():
+    service, _ = paged_service([{"items": [snapshot("newest", "2025-04-03T10:00:00.000-07:00")]}])
+
+    assert list_snapshots("test-project", None, service=service)["name"] == "newest"
+    service.snapshots.return_value.list.assert_called_once_with(
+        project="test-project", maxResults=1, orderBy="creationTimestamp desc",
+        fields=SNAPSHOT_LIST_FIELDS)
+
+
+def test_list_snapshots_empty_project():
+    service, _ = paged_service([{}])
+
+    assert list_snapshots("test-project", "name=missing", service=service) is None
+
+
+def test_top_k_snapshots():
+    snapshots = (snapshot(f"s{day}", f"2025-04-{day:02d}T10:00:00.000-07:00") for day in range(1, 29))
+
+    assert [s["name"] for s in top_k_snapshots(snapshots, 3)] == ["s28", "s27", "s26"]
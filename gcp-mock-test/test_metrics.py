@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+import sys
+import os
+import json
+import pytest
+from unittest import mock
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
+from snapshot_create import clients
+from snapshot_create.create_disk_from_snapshot import create_disk_from_snapshot
+from snapshot_create.create_snapshot import create_snapshot
+from snapshot_create.fake_compute import FakeComputeBackend
+from snapshot_create.metrics import METRICS, Histogram, Metrics, response_hook, rest_method
+from snapshot_create.utils import wait_for_disk_creation
+
+
+@pytest.fixture
+def backend():
+    METRICS.reset()
+    backend = FakeComputeBackend(ready_after=1.0, time_scale=0.001)
+    clients.use_backend(backend)
+    yield backend
+    clients.use_backend(None)
+    METRICS.reset()
+
+
+def test_histogram_quantiles():
+    histogram = Histogram((1, 2, 5, 10))
+    for value in [0.5] * 50 + [3] * 45 + [20] * 5:
+        histogram.observe(value)
+
+    assert histogram.count == 100
+    assert histogram.quantile(0.5) == pytest.approx(1.0)
+    assert 2 < histogram.quantile(0.9) <= 5
+    assert histogram.quantile(0.99) == 10
+
+
+def test_prometheus_and_json_export(tmp_path):
+    metrics = Metrics()
+    metrics.inc("api_errors_total", method="disks.insert", code=429)
+    metrics.observe("api_request_seconds", 0.2, method="disks.get")
+
+    text = metrics.to_prometheus()
+    assert '# TYPE gcp_utilities_api_errors_total counter' in text
+    assert 'gcp_utilities_api_errors_total{code="429",method="disks.insert"} 1' in text
+    assert 'gcp_utilities_api_request_seconds_bucket{method="disks.get",le="0.25"} 1' in text
+    assert 'gcp_utilities_api_request_seconds_bucket{method="disks.get",le="+Inf"} 1' in text
+    assert 'gcp_utilities_api_request_seconds_count{method="disks.get"} 1' in text
+
+    metrics.write(str(tmp_path / "metrics.json"))
+    summary = json.loads((tmp_path / "metrics.json").read_text())
+    assert summary["histograms"]["api_request_seconds"][0]["count"] == 1
+    metrics.write(str(tmp_path / "metrics.prom"))
+    assert (tmp_path / "metrics.prom").read_text() == text
+
+
+@pytest.mark.parametrize("http_method, path, expected", [
+    ("GET", "/compute/v1/projects/p/zones/z/disks/d", "disks.get"),
+    ("GET", "/compute/v1/projects/p/zones/z/disks", "disks.list"),
+    ("POST", "/compute/v1/projects/p/global/snapshots", "snapshots.insert"),
+    ("DELETE", "/compute/v1/projects/p/global/snapshots/s", "snapshots.delete"),
+    ("GET", "/compute/v1/projects/p/aggregated/disks", "disks.aggregatedList"),
+    ("POST", "/compute/v1/projects/p/zones/z/operations/op/wait", "zoneOperations.wait"),
+    ("GET", "/compute/v1/projects/p/global/operations/op", "globalOperations.get"),
+    ("GET", "/compute/v1/projects/p/regions/r/disks/d", "regionDisks.get"),
+])
+def test_rest_method(http_method, path, expected):
+    assert rest_method(http_method, f"https://compute.googleapis.com{path}?alt=json") == expected
+
+
+def test_response_hook_records_latency_and_errors():
+    metrics = Metrics()
+    response = mock.MagicMock(status_code=429)
+    response.request.method = "POST"
+    response.request.url = "https://compute.googleapis.com/compute/v1/projects/p/zones/z/disks"
+    response.elapsed.total_seconds.return_value = 0.3
+
+    with mock.patch("snapshot_create.metrics.METRICS", metrics):
+        response_hook(response)
+
+    assert metrics.histogram("api_request_seconds", method="disks.insert").count == 1
+    assert metrics.counter("api_errors_total", method="disks.insert", code=429) == 1
+
+
+def test_create_and_wait_are_measured(backend):
+    backend.add_snapshot("src", "snap-1")
+    backend.inject_errors("disks.insert", 503)
+
+    assert create_disk_from_snapshot("src", "us-central1-a", "disk-1", "pd-ssd", 10, "target", "snap-1") is None
+    assert create_disk_from_snapshot("src", "us-central1-a", "disk-1", "pd-ssd", 10, "target", "snap-1",
+                                     wait=True)
+
+    assert METRICS.counter("api_errors_total", method="disks.insert", code=503) == 1
+    assert METRICS.histogram("api_request_seconds", method="disks.insert").count == 2
+    assert METRICS.histogram("api_request_seconds", method="zoneOperations.wait").count >= 1
+    assert METRICS.counter("waits_total", kind="disk", outcome="ready") == 1
+    assert METRICS.histogram("time_to_ready_seconds", kind="disk").count == 1
+    # one operations.wait plus the confirming get
+    assert METRICS.histogram("wait_polls", kind="disk").sum >= 2
+
+
+def test_polls_inside_extended_operations_are_counted(backend):
+    backend.add_disk("src", "us-central1-a", "disk-1")
+
+    create_snapshot(target_project_id="target", disk_name="disk-1", snapshot_name="snap-1",
+                    zone="us-central1-a", disk_project_id="src", exit_on_error=False)
+
+    # every globalOperations.get made by ExtendedOperation.result(), plus the confirming get
+    assert backend.calls["globalOperations.get"] >= 2
+    assert METRICS.histogram("wait_polls", kind="snapshot").sum == backend.calls["globalOperations.get"] + 1
+
+
+def test_wait_outcome_not_ready(backend):
+    backend.add_disk("target", "us-central1-a", "disk-1")
+    backend._disks[("target", "us-central1-a", "disk-1")].failed = True
+
+    assert not wait_for_disk_creation("target", "us-central1-a", "disk-1")
+    assert METRICS.counter("waits_total", kind="disk", outcome="not_ready") == 1
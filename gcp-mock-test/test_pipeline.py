@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+import sys
+import os
+import threading
+from unittest import mock
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
+from snapshot_create.pipeline import run_pipeline
+
+
+def snapshot_entry(name, disk):
+    return {"target_zone": "us-central1-a", "disk_name": disk,
+            "disk_project_id": "src-project", "src_snapshot_name": name}
+
+
+def disk_entry(name, snapshot, src_project_id="snap-project"):
+    return {"target_zone": "us-central1-b", "disk_name": name, "disk_type": "pd-ssd",
+            "disk_size_gb": 10, "src_project_id": src_project_id, "src_snapshot_name": snapshot}
+
+
+@mock.patch("snapshot_create.pipeline.create_disk_from_snapshot", autospec=True)
+@mock.patch("snapshot_create.pipeline.create_snapshot", autospec=True)
+def test_disk_starts_before_slow_snapshot_finishes(mock_create_snapshot, mock_create_disk):
+    disk_a_started = threading.Event()
+
+    def fake_create_snapshot(**kwargs):
+        # the slow snapshot only finishes once the fast snapshot's disk is underway
+        if kwargs["snapshot_name"] == "slow":
+            assert disk_a_started.wait(timeout=5)
+        return kwargs["snapshot_name"]
+
+    def fake_create_disk(**kwargs):
+        if kwargs["disk_name"] == "disk-a":
+            disk_a_started.set()
+
+    mock_create_snapshot.side_effect = fake_create_snapshot
+    mock_create_disk.side_effect = fake_create_disk
+
+    result = run_pipeline(
+        snapshot_project_id="snap-project",
+        target_project_id="target-project",
+        snapshot_entries=[snapshot_entry("slow", "disk-1"), snapshot_entry("fast", "disk-2")],
+        disk_entries=[disk_entry("disk-a", "fast"), disk_entry("disk-b", "slow")],
+        snapshot_workers=2,
+        disk_workers=2,
+    )
+
+    assert result.ok
+    assert sorted(r.key for r in result.disks) == ["disk-a", "disk-b"]
+    mock_create_disk.assert_any_call(
+        src_project_id="snap-project", target_zone="us-central1-b", disk_name="disk-a",
+        disk_type="pd-ssd", disk_size_gb=10, target_project_id="target-project",
+        src_snapshot_name="fast", raise_on_error=True, wait=True, watcher=None, journal=None)
+
+
+@mock.patch("snapshot_create.pipeline.create_disk_from_snapshot", autospec=True)
+@mock.patch("snapshot_create.pipeline.create_snapshot", autospec=True)
+def test_failed_snapshot_skips_its_disks(mock_create_snapshot, mock_create_disk):
+    mock_create_snapshot.side_effect = RuntimeError("disk not found")
+
+    result = run_pipeline(
+        snapshot_project_id="snap-project",
+        target_project_id="target-project",
+        snapshot_entries=[snapshot_entry("snap-1", "disk-1")],
+        disk_entries=[disk_entry("disk-a", "snap-1"),
+                      disk_entry("disk-b", "existing", src_project_id="other-project")],
+    )
+
+    assert not result.ok
+    by_key = {r.key: r for r in result.disks}
+    assert not by_key["disk-a"].ok
+    # a disk from an already existing snapshot still gets created
+    assert by_key["disk-b"].ok
+    assert mock_create_disk.call_count == 1
+
+
+@mock.patch("snapshot_create.pipeline.create_disk_from_snapshot", autospec=True)
+@mock.patch("snapshot_create.pipeline.create_snapshot", autospec=True)
+def test_independent_disks_do_not_wait_for_the_snapshot_stage(mock_create_snapshot, mock_create_disk):
+    independent_started = threading.Event()
+
+    def fake_create_snapshot(**kwargs):
+        # the snapshot stage is full until the independent disk is underway
+        assert independent_started.wait(timeout=5)
+        return kwargs["snapshot_name"]
+
+    def fake_create_disk(**kwargs):
+        if kwargs["disk_name"] == "disk-other":
+            independent_started.set()
+
+    mock_create_snapshot.side_effect = fake_create_snapshot
+    mock_create_disk.side_effect = fake_create_disk
+
+    result = run_pipeline(
+        snapshot_project_id="snap-project",
+        target_project_id="disk-project",
+        snapshot_entries=[snapshot_entry(f"snap-{i}", f"src-{i}") for i in range(4)],
+        disk_entries=[disk_entry("disk-other", "golden", src_project_id="other-project")],
+        snapshot_workers=1,
+    )
+
+    assert result.ok
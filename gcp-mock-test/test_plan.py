@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+import sys
+import os
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
+from snapshot_create import clients
+from snapshot_create.fake_compute import FakeComputeBackend
+from snapshot_create.plan import CONFLICT, CREATE, SKIP, plan_disks, plan_snapshots
+
+
+def disk_entry(name, size=20, snapshot="snap-1", zone="us-central1-a"):
+    return {"target_zone": zone, "disk_name": name, "disk_type": "pd-ssd", "disk_size_gb": size,
+            "src_project_id": "src-project", "src_snapshot_name": snapshot}
+
+
+def existing_disk(name, size=20, snapshot="snap-1"):
+    return {
+        "name": name,
+        "sizeGb": str(size),
+        "status": "READY",
+        "type": "https://www.googleapis.com/compute/v1/projects/target-project/zones/us-central1-a/diskTypes/pd-ssd",
+        "sourceSnapshot": f"https://www.googleapis.com/compute/v1/projects/src-project/global/snapshots/{snapshot}",
+    }
+
+
+@pytest.fixture
+def backend():
+    backend = FakeComputeBackend(time_scale=0.001)
+    clients.use_backend(backend)
+    yield backend
+    clients.use_backend(None)
+
+
+def test_plan_disks_diff():
+    entries = [disk_entry("new"), disk_entry("same"), disk_entry("resized", size=50),
+               disk_entry("new"), disk_entry("new", snapshot="snap-2")]
+    existing = {"us-central1-a/same": existing_disk("same"),
+                "us-central1-a/resized": existing_disk("resized", size=20)}
+
+    plan = plan_disks("target-project", entries, existing=existing)
+
+    actions = [(item.action, item.key) for item in plan.items]
+    assert actions == [
+        (CREATE, "us-central1-a/new"),
+        (SKIP, "us-central1-a/same"),
+        (CONFLICT, "us-central1-a/resized"),
+        (SKIP, "us-central1-a/new"),
+        (CONFLICT, "us-central1-a/new"),
+    ]
+    assert "size is 20 GB" in plan.items[2].reason
+    assert plan.to_create == [disk_entry("new")]
+    assert plan.has_conflicts
+    assert plan.counts() == {CREATE: 1, SKIP: 2, CONFLICT: 2}
+
+
+def test_rerun_is_a_single_list_call(backend):
+    entries = [disk_entry(f"disk-{i}", size=10) for i in range(1000)]
+    backend.add_snapshot("src-project", "snap-1")
+    for entry in entries[:998]:
+        backend.insert_disk("target-project", "us-central1-a", {
+            "name": entry["disk_name"], "type": "pd-ssd",
+            "sourceSnapshot": "projects/src-project/global/snapshots/snap-1"})
+    backend.calls.clear()
+
+    plan = plan_disks("target-project", entries)
+
+    assert [item.key for item in plan.of(CREATE)] == ["us-central1-a/disk-998", "us-central1-a/disk-999"]
+    assert len(plan.of(SKIP)) == 998
+    assert backend.calls == {"disks.aggregatedList": 1}
+
+
+def test_plan_snapshots_checks_source_disk(backend):
+    backend.add_snapshot("target-project", "snap-a", source_disk=(
+        "https://www.googleapis.com/compute/v1/projects/src-project/zones/us-central1-a/disks/disk-a"))
+    backend.add_snapshot("target-project", "snap-b", source_disk=(
+        "https://www.googleapis.com/compute/v1/projects/src-project/zones/us-central1-a/disks/other"))
+    entries = [
+        {"target_zone": "us-central1-a", "disk_name": name, "disk_project_id": "src-project",
+         "src_snapshot_name": snapshot}
+        for name, snapshot in (("disk-a", "snap-a"), ("disk-b", "snap-b"), ("disk-c", "snap-c"))
+    ]
+
+    plan = plan_snapshots("target-project", entries)
+
+    assert {item.key: item.action for item in plan.items} == {
+        "snap-a": SKIP, "snap-b": CONFLICT, "snap-c": CREATE}
+    assert backend.calls == {"snapshots.list": 1}
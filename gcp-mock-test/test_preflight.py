@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+import sys
+import os
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
+from snapshot_create import clients
+from snapshot_create.fake_compute import FakeComputeBackend
+from snapshot_create.preflight import format_problems, preflight_disks, preflight_snapshots
+
+
+@pytest.fixture
+def backend():
+    backend = FakeComputeBackend(ready_after=1.0, time_scale=0.001, seed=1)
+    clients.use_backend(backend)
+    yield backend
+    clients.use_backend(None)
+
+
+def _disk(name, zone="us-central1-a", disk_type="pd-ssd", size=10, src_project="src", snapshot="snap-1"):
+    return {"target_zone": zone, "disk_name": name, "disk_type": disk_type, "disk_size_gb": size,
+            "src_project_id": src_project, "src_snapshot_name": snapshot}
+
+
+def test_shared_lookups_are_made_once(backend):
+    backend.add_snapshot("src", "snap-1")
+    entries = [_disk(f"disk-{i}") for i in range(200)]
+
+    assert preflight_disks("target", entries) == []
+    assert backend.calls["zones.get"] == 1
+    assert backend.calls["diskTypes.get"] == 1
+    assert backend.calls["snapshots.get"] == 1
+
+
+def test_every_disk_problem_is_reported_together(backend):
+    backend.add_snapshot("src", "snap-1", diskSizeGb="50")
+    backend.ready_after = lambda: 10_000.0
+    backend.add_snapshot("src", "snap-2", ready=False)
+    backend.forbidden_projects.add("locked")
+    entries = [
+        _disk("ok", size=50),
+        _disk("in-nowhere", zone="nowhere", size=50),
+        _disk("wrong-type", disk_type="pd-floppy", size=50),
+        _disk("too-small", size=10),
+        _disk("no-source", snapshot="missing"),
+        _disk("not-ready", snapshot="snap-2"),
+        _disk("locked-out", src_project="locked"),
+        _disk("Bad_Name", size=50),
+    ]
+
+    problems = preflight_disks("target", entries)
+
+    assert {(p.key, p.message) for p in problems} == {
+        ("nowhere/in-nowhere", "zone nowhere does not exist"),
+        ("us-central1-a/wrong-type", "disk type pd-floppy in us-central1-a does not exist"),
+        ("us-central1-a/too-small", "disk_size_gb 10 is smaller than snapshot snap-1 (50 GB)"),
+        ("us-central1-a/no-source", "snapshot missing in project src does not exist"),
+        ("us-central1-a/not-ready", "snapshot snap-2 in project src is CREATING"),
+        ("us-central1-a/locked-out", "no access to snapshot snap-1 in project locked"),
+        ("us-central1-a/Bad_Name", "disk name 'Bad_Name' is not a valid resource name "
+                                   "(lowercase letters, digits and hyphens, at most 63 characters)"),
+    }
+    assert backend.calls["disks.insert"] == 0
+    assert format_problems(problems).startswith("Preflight: 7 problem(s), nothing was changed:")
+
+
+def test_snapshot_sources_and_upcoming_snapshots(backend):
+    backend.add_disk("p", "us-central1-a", "disk-1")
+    snapshots = [
+        {"target_zone": "us-central1-a", "disk_name": "disk-1", "disk_type": "pd-ssd", "disk_size_gb": 10,
+         "disk_project_id": "p", "src_snapshot_name": "snap-1"},
+        {"target_zone": "us-central1-a", "disk_name": "gone", "disk_type": "pd-ssd", "disk_size_gb": 10,
+         "disk_project_id": "p", "src_snapshot_name": "snap-2"},
+    ]
+
+    problems = preflight_snapshots("p", snapshots)
+    # snap-1 is created by the same run, so it isn't looked up for the disk
+    disk_problems = preflight_disks("p", [_disk("restored", src_project="p")], upcoming_snapshots=[("p", "snap-1")])
+
+    assert [(p.key, p.message) for p in problems] == [
+        ("snap-2", "source disk gone in us-central1-a of project p does not exist")]
+    assert disk_problems == []
+    assert backend.calls["snapshots.get"] == 0
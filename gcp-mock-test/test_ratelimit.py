@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+import sys
+import os
+from unittest import mock
+import pytest
+import requests
+from google.api_core import exceptions
+from google.cloud import compute_v1
+from requests.adapters import HTTPAdapter
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
+from snapshot_create import clients
+from snapshot_create.fake_compute import FakeComputeBackend
+from snapshot_create.metrics import METRICS
+from snapshot_create.ratelimit import (
+    LIST, MUTATION, OPERATION, READ, CircuitOpenError, Guard, GuardedAdapter, RetryPolicy, TokenBucket,
+    category_of, configure, get_guard, project_of)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture(autouse=True)
+def reset_metrics():
+    METRICS.reset()
+    yield
+    METRICS.reset()
+
+
+def guard(clock, **kwargs):
+    return Guard(sleep=clock.sleep, clock=clock, **kwargs)
+
+
+def test_categories_follow_quota_groups():
+    assert category_of("disks.get") == READ
+    assert category_of("snapshots.list") == LIST
+    assert category_of("disks.aggregatedList") == LIST
+    assert category_of("zoneOperations.wait") == OPERATION
+    assert category_of("globalOperations.get") == OPERATION
+    assert category_of("disks.insert") == MUTATION
+    assert category_of("snapshots.delete") == MUTATION
+    assert project_of("https://compute.googleapis.com/compute/v1/projects/p-1/zones/z/disks?x=1") == "p-1"
+
+
+def test_token_bucket_paces_after_burst(clock):
+    bucket = TokenBucket(rate=2.0, clock=clock)
+
+    assert [bucket.reserve() for _ in range(4)] == [0.0, 0.0, 0.5, 1.0]
+    clock.now = 10.0
+    assert bucket.reserve() == 0.0
+
+
+def test_reads_are_retried_honoring_retry_after(clock):
+    error = exceptions.ServiceUnavailable("busy", response=mock.Mock(headers={"Retry-After": "7"}))
+    fn = mock.Mock(side_effect=[error, error, "disk"])
+
+    assert guard(clock).call("disks.get", "p", fn) == "disk"
+    assert fn.call_count == 3
+    assert all(s >= 7 for s in clock.sleeps)
+    assert METRICS.counter("api_retries_total", method="disks.get") == 2
+
+
+def test_mutations_are_retried_only_when_throttled(clock):
+    g = guard(clock)
+    insert = mock.Mock(side_effect=[exceptions.TooManyRequests("slow down"), "operation"])
+    assert g.call("disks.insert", "p", insert) == "operation"
+
+    insert = mock.Mock(side_effect=exceptions.ServiceUnavailable("maybe applied"))
+    with pytest.raises(exceptions.ServiceUnavailable):
+        g.call("disks.insert", "p", insert)
+    assert insert.call_count == 1
+
+    forbidden = exceptions.Forbidden("quota", errors=[{"reason": "rateLimitExceeded"}])
+    insert = mock.Mock(side_effect=[forbidden, "operation"])
+    assert g.call("disks.insert", "p", insert) == "operation"
+
+
+def test_gives_up_after_max_attempts(clock):
+    fn = mock.Mock(side_effect=exceptions.TooManyRequests("slow down"))
+
+    with pytest.raises(exceptions.TooManyRequests):
+        guard(clock, policy=RetryPolicy(max_attempts=3)).call("disks.get", "p", fn)
+    assert fn.call_count == 3
+
+
+def test_circuit_breaker_opens_per_project_and_recovers(clock):
+    g = guard(clock, failure_threshold=2, reset_timeout=30)
+    failing = mock.Mock(side_effect=exceptions.InternalServerError("down"))
+
+    with pytest.raises(exceptions.InternalServerError):
+        g.call("disks.get", "p", failing)
+    assert failing.call_count == 2
+    assert g.breaker("p").state == "open"
+    with pytest.raises(CircuitOpenError):
+        g.call("disks.get", "p", mock.Mock())
+    # other projects are not affected
+    assert g.call("disks.get", "other", mock.Mock(return_value="ok")) == "ok"
+
+    clock.now += 30
+    assert g.breaker("p").state == "half_open"
+    assert g.call("disks.get", "p", mock.Mock(return_value="ok")) == "ok"
+    assert g.breaker("p").state == "closed"
+    assert METRICS.counter("circuit_open_total", project="p") == 1
+
+
+def test_throttled_probe_leaves_the_circuit_half_open(clock):
+    g = guard(clock, failure_threshold=1, reset_timeout=30, policy=RetryPolicy(max_attempts=1))
+    with pytest.raises(exceptions.InternalServerError):
+        g.call("disks.get", "p", mock.Mock(side_effect=exceptions.InternalServerError("down")))
+
+    clock.now += 30
+    with pytest.raises(exceptions.TooManyRequests):
+        g.call("disks.get", "p", mock.Mock(side_effect=exceptions.TooManyRequests("slow down")))
+    assert g.breaker("p").state == "half_open"
+    assert g.call("disks.get", "p", mock.Mock(return_value="ok")) == "ok"
+    assert g.breaker("p").state == "closed"
+
+
+def test_not_found_is_not_retried(clock):
+    fn = mock.Mock(side_effect=exceptions.NotFound("gone"))
+
+    with pytest.raises(exceptions.NotFound):
+        guard(clock).call("disks.get", "p", fn)
+    assert fn.call_count == 1 and clock.sleeps == []
+
+
+def _response(status, headers=None):
+    response = requests.Response()
+    response.status_code = status
+    response.headers.update(headers or {})
+    response._content = b"{}"
+    return response
+
+
+def test_adapter_retries_rest_requests(clock):
+    request = requests.Request(
+        "GET", "https://compute.googleapis.com/compute/v1/projects/p/zones/z/disks/d").prepare()
+    previous = get_guard()
+    configure(guard(clock))
+    try:
+        with mock.patch.object(HTTPAdapter, "send", autospec=True,
+                               side_effect=[_response(503, {"Retry-After": "2"}), _response(200)]) as send:
+            assert GuardedAdapter().send(request).status_code == 200
+        assert send.call_count == 2
+        assert clock.sleeps[0] >= 2
+
+        with mock.patch.object(HTTPAdapter, "send", autospec=True, return_value=_response(503)):
+            # out of attempts, the client gets the last response to raise on
+            assert GuardedAdapter().send(request).status_code == 503
+    finally:
+        configure(previous)
+
+
+def test_fake_backend_calls_are_retried():
+    backend = FakeComputeBackend(time_scale=0.001, seed=1)
+    clients.use_backend(backend)
+    try:
+        backend.add_disk("p", "us-central1-a", "disk-1")
+        backend.inject_errors("disks.get", 503, 429)
+
+        disk_client = clients.get_client(compute_v1.DisksClient)
+        assert disk_client.get(project="p", zone="us-central1-a", disk="disk-1").name == "disk-1"
+        assert backend.calls["disks.get"] == 3
+    finally:
+        clients.use_backend(None)
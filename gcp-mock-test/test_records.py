@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+import sys
+import os
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
+from snapshot_create import clients
+from snapshot_create.fake_compute import FakeComputeBackend, partial_response
+from snapshot_create.inventory import iter_disks
+from snapshot_create.list_snapshot import iter_snapshots
+from snapshot_create.records import DiskRecord, SnapshotRecord
+
+
+@pytest.fixture
+def backend():
+    backend = FakeComputeBackend(ready_after=1.0, time_scale=0.001, seed=1)
+    clients.use_backend(backend)
+    yield backend
+    clients.use_backend(None)
+
+
+def test_records_read_like_api_dicts_and_messages():
+    item = {"kind": "compute#snapshot", "id": "42", "name": "snap-1", "status": "READY",
+            "sourceDisk": "projects/p/zones/us-central1-a/disks/disk-1", "diskSizeGb": "10",
+            "creationTimestamp": "2025-04-01T10:00:00.000-07:00"}
+
+    record = SnapshotRecord.from_api(item)
+
+    assert record["name"] == "snap-1" and record.status == "READY"
+    assert record.get("labels", {}) == {} and "labels" not in record
+    with pytest.raises(KeyError):
+        record["id"]
+    assert record == {key: value for key, value in item.items() if key not in ("kind", "id")}
+    assert not hasattr(record, "__dict__")
+    assert sys.getsizeof(record) < sys.getsizeof(item)
+    # repeated values are shared between records
+    assert SnapshotRecord.from_api(dict(item)).source_disk is record.source_disk
+
+
+def test_list_reads_request_only_the_record_fields(backend):
+    for i in range(3):
+        backend.add_snapshot("p", f"snap-{i}", labels={"team": "a"})
+        backend.add_disk("p", "us-central1-a", f"disk-{i}")
+
+    snapshots = list(iter_snapshots("p"))
+    disks = list(iter_disks("p"))
+
+    assert [s["name"] for s in snapshots] == ["snap-0", "snap-1", "snap-2"]
+    assert all(isinstance(s, SnapshotRecord) and s["labels"] == {"team": "a"} for s in snapshots)
+    assert [(zone, d.name) for zone, d in disks] == [("us-central1-a", f"disk-{i}") for i in range(3)]
+    assert all(isinstance(d, DiskRecord) for _, d in disks)
+
+
+def test_partial_response_selection():
+    page = {"items": {"zones/a": {"disks": [{"name": "d", "status": "READY", "id": "1"}]},
+                      "zones/b": {"warning": {"code": "NO_RESULTS_ON_PAGE"}}},
+            "nextPageToken": "t", "kind": "compute#diskAggregatedList"}
+
+    assert partial_response(page, "items/*/disks(name,status),nextPageToken") == {
+        "items": {"zones/a": {"disks": [{"name": "d", "status": "READY"}]}, "zones/b": {}},
+        "nextPageToken": "t"}
+    assert partial_response({"status": "READY", "name": "d"}, "status") == {"status": "READY"}
+    assert partial_response(page, None) is page
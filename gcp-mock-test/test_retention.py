@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+import sys
+import os
+from datetime import datetime, timedelta, timezone
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
+from snapshot_create import clients
+from snapshot_create.fake_compute import FakeComputeBackend
+from snapshot_create.retention import Policy, evaluate, prune, read_policies
+
+NOW = datetime(2025, 3, 31, 12, tzinfo=timezone.utc)
+DISK = "https://www.googleapis.com/compute/v1/projects/p/zones/z/disks/disk-1"
+
+
+def _snapshot(name, age_hours, source=DISK, **extra):
+    created = NOW - timedelta(hours=age_hours)
+    return {"name": name, "sourceDisk": source, "status": "READY",
+            "creationTimestamp": created.isoformat(), **extra}
+
+
+def _deleted(decisions):
+    return sorted(d.name for d in decisions if d.delete)
+
+
+def test_keep_last_per_source_disk():
+    snapshots = [_snapshot(f"a-{i}", i) for i in range(5)] + [_snapshot("b-0", 100, source="other")]
+
+    decisions = evaluate(snapshots, [Policy(keep_last=2)], NOW)
+
+    # the only snapshot of the other disk is its newest one
+    assert _deleted(decisions) == ["a-2", "a-3", "a-4"]
+
+
+def test_dailies_weeklies_and_max_age():
+    # four snapshots a day for 60 days
+    snapshots = [_snapshot(f"s-{h:04d}", h) for h in range(0, 24 * 60, 6)]
+    policy = Policy(keep_last=1, keep_daily=7, keep_weekly=4, max_age_days=21)
+
+    kept = [d for d in evaluate(snapshots, [policy], NOW) if not d.delete]
+
+    # 7 dailies; of the 4 weeklies, 2 are those dailies' weeks, the other 2 are younger than 21 days
+    assert len(kept) == 9
+    assert max(NOW - d.created for d in kept) < timedelta(days=21)
+    assert any("last 1" in d.reason for d in kept)
+
+
+def test_keep_last_survives_max_age():
+    snapshots = [_snapshot("old-0", 24 * 400), _snapshot("old-1", 24 * 500)]
+
+    assert _deleted(evaluate(snapshots, [Policy(keep_last=1, max_age_days=30)], NOW)) == ["old-1"]
+
+
+def test_selectors_and_overlapping_policies():
+    snapshots = [
+        _snapshot("dev-old", 24 * 30, labels={"env": "dev"}),
+        _snapshot("prod-old", 24 * 30, labels={"env": "prod"}),
+        _snapshot("nightly-old", 24 * 30, labels={"env": "dev"}),
+        _snapshot("creating", 24 * 30, labels={"env": "dev"}, status="CREATING"),
+    ]
+    policies = [Policy("dev", labels={"env": "dev"}, max_age_days=14),
+                Policy("nightly", name_pattern="nightly-*", keep_last=5)]
+
+    decisions = evaluate(snapshots, policies, NOW)
+
+    # prod is matched by no policy and never considered; nightly-old is kept by the second policy
+    assert [d.name for d in decisions if not d.delete] == ["nightly-old"]
+    assert _deleted(decisions) == ["dev-old"]
+
+
+def test_policy_config_is_validated(tmp_path):
+    with pytest.raises(ValueError):
+        Policy.from_dict({"keep_lats": 3})
+    with pytest.raises(ValueError):
+        Policy.from_dict({"name": "nothing"})
+    path = os.path.join(os.path.dirname(__file__), "../snapshot_create/retention_config.yaml")
+    assert [p.name for p in read_policies(path)] == ["nightly", "scratch"]
+
+
+def test_prune_deletes_in_parallel_against_fake_backend():
+    backend = FakeComputeBackend(ready_after=1.0, time_scale=0.001, seed=1)
+    clients.use_backend(backend)
+    try:
+        for i in range(30):
+            created = (NOW - timedelta(days=i)).isoformat()
+            backend.add_snapshot("p", f"nightly-{i:02d}", source_disk=DISK, creationTimestamp=created)
+
+        decisions, results = prune("p", [Policy(keep_daily=7)], concurrency=8, now=NOW)
+
+        assert sum(d.delete for d in decisions) == 23
+        assert all(r.ok for r in results)
+        assert backend.calls["snapshots.list"] == 1
+        assert backend.calls["snapshots.delete"] == 23
+        assert sorted(s["name"] for s in backend.list_snapshots("p")) == [f"nightly-{i:02d}" for i in range(7)]
+    finally:
+        clients.use_backend(None)
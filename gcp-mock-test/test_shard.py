@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+import sys
+import os
+import pytest
+import yaml
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
+from snapshot_create import clients
+from snapshot_create.config import ConfigError, load_config
+from snapshot_create.fake_compute import FakeComputeBackend
+from snapshot_create import ratelimit
+from snapshot_create.shard import (
+    Shard, ShardOptions, format_report, partition, run_shard, run_sharded, share_quota)
+
+
+@pytest.fixture
+def backend():
+    backend = FakeComputeBackend(ready_after=1.0, time_scale=0.001, seed=1)
+    clients.use_backend(backend)
+    yield backend
+    clients.use_backend(None)
+
+
+def _snapshot(disk, name, source="src-a", zone="us-central1-a", **extra):
+    return {"target_zone": zone, "disk_name": disk, "disk_type": "pd-ssd", "disk_size_gb": 10,
+            "disk_project_id": source, "src_snapshot_name": name, **extra}
+
+
+def test_entries_are_partitioned_by_target_and_source_project():
+    entries = [
+        _snapshot("d1", "s1"),
+        _snapshot("d2", "s2", target_project_id="tgt-b"),
+        _snapshot("d3", "s3", zone="us-east1-b"),
+        _snapshot("d4", "s4", source="src-c", target_project_id="tgt-b"),
+    ]
+
+    shards = partition("snapshots", entries, "tgt-a")
+    by_zone = partition("snapshots", entries, "tgt-a", by_zone=True)
+
+    assert [(s.name, [e["disk_name"] for e in s.entries]) for s in shards] == [
+        ("tgt-a-src-a", ["d1", "d3"]), ("tgt-b-src-a", ["d2"]), ("tgt-b-src-c", ["d4"])]
+    assert [s.name for s in by_zone] == [
+        "tgt-a-src-a-us-central1-a", "tgt-b-src-a-us-central1-a", "tgt-a-src-a-us-east1-b",
+        "tgt-b-src-c-us-central1-a"]
+
+
+def test_projects_called_by_several_shards_share_their_quota():
+    entries = [_snapshot("d1", "s1"), _snapshot("d2", "s2", source="src-b"), _snapshot("d3", "s3", source="src-c"),
+               _snapshot("d4", "s4", target_project_id="tgt-b")]
+    shards = partition("snapshots", entries, "tgt-a")
+
+    share_quota(shards, processes=2)
+
+    # tgt-a is called by three shards, but at most two run at once; src-a by two
+    assert [s.quota_share for s in shards] == [{"src-a": 0.5, "tgt-a": 0.5}, {"tgt-a": 0.5}, {"tgt-a": 0.5},
+                                               {"src-a": 0.5}]
+    guard = ratelimit.Guard().with_share(shards[0].quota_share)
+    assert guard.bucket("tgt-a", ratelimit.MUTATION).rate == ratelimit.QUOTA_PER_SECOND[ratelimit.MUTATION] / 2
+    assert guard.bucket("tgt-b", ratelimit.MUTATION).rate == ratelimit.QUOTA_PER_SECOND[ratelimit.MUTATION]
+
+
+def test_other_target_projects_need_a_sharded_run(tmp_path):
+    path = tmp_path / "config.yaml"
+    path.write_text(yaml.safe_dump({"snapshots": [_snapshot("d1", "s1", target_project_id="tgt-b")]}))
+
+    with pytest.raises(ConfigError, match="need a sharded run"):
+        load_config(str(path), "tgt-a")
+    assert load_config(str(path), "tgt-a", sharded=True)["snapshots"][0]["target_project_id"] == "tgt-b"
+
+
+def test_shard_reports_conflicts_and_created_resources(backend, tmp_path):
+    backend.add_disk("src-a", "us-central1-a", "d1")
+    backend.add_disk("src-a", "us-central1-a", "d2")
+    backend.add_snapshot("tgt-a", "s2", source_disk="projects/src-a/zones/us-central1-a/disks/other")
+    shard = Shard("snapshots", "tgt-a", "src-a", entries=[_snapshot("d1", "s1"), _snapshot("d2", "s2")])
+
+    report = run_shard(shard, ShardOptions(journal=str(tmp_path / "config.yaml.journal")))
+
+    assert report.plan == {"create": 1, "skip": 0, "conflict": 1}
+    assert report.succeeded == ["s1"] and not report.ok
+    assert report.conflicts[0].startswith("s2: exists, but taken from")
+    assert os.path.exists(tmp_path / "config.yaml.journal.tgt-a-src-a")
+    assert "1 created, 0 failed, 1 shard(s) with problems" in format_report("snapshots", [report])
+
+
+def test_shards_run_in_their_own_processes(monkeypatch, tmp_path):
+    # every worker builds its own fake backend, creating missing source disks on first use
+    monkeypatch.setenv("GCP_UTILITIES_FAKE_BACKEND", '{"ready_after": 1, "time_scale": 0.001}')
+    entries = [_snapshot("d1", "s1"), _snapshot("d2", "s2", target_project_id="tgt-b"),
+               _snapshot("d3", "Bad_Name", source="src-c")]
+
+    reports = run_sharded("snapshots", "tgt-a", entries, processes=2,
+                          options=ShardOptions(journal=str(tmp_path / "config.yaml.journal")))
+
+    assert [(r.shard, r.succeeded) for r in reports] == [
+        ("tgt-a-src-a", ["s1"]), ("tgt-b-src-a", ["s2"]), ("tgt-a-src-c", [])]
+    assert reports[2].problems[0].startswith("Bad_Name: snapshot name 'Bad_Name' is not a valid resource name")
+    assert [r.ok for r in reports] == [True, True, False]
+    assert os.getpid() not in {r.pid for r in reports}
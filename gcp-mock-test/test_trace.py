@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+import sys
+import os
+import json
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
+from snapshot_create import clients
+from snapshot_create.create_disk_from_snapshot import create_disk_from_snapshot
+from snapshot_create.create_snapshot import create_snapshot
+from snapshot_create.fake_compute import FakeComputeBackend
+from snapshot_create.trace import TRACER, span
+
+
+@pytest.fixture
+def tracer():
+    TRACER.reset()
+    TRACER.enable()
+    yield TRACER
+    TRACER.enabled = False
+    TRACER.reset()
+
+
+@pytest.fixture
+def backend():
+    backend = FakeComputeBackend(ready_after=1.0, time_scale=0.001)
+    clients.use_backend(backend)
+    yield backend
+    clients.use_backend(None)
+
+
+def test_each_resource_gets_its_own_track(tracer, backend):
+    for i in range(3):
+        backend.add_disk("p", "us-central1-a", f"disk-{i}")
+
+    with ThreadPoolExecutor(2) as pool:
+        list(pool.map(lambda i: create_snapshot("p", f"disk-{i}", f"snap-{i}", "us-central1-a"), range(3)))
+
+    events = tracer.events()
+    tracks = {e["tid"]: e["args"]["name"] for e in events if e["ph"] == "M"}
+    assert sorted(tracks.values()) == ["snapshot snap-0", "snapshot snap-1", "snapshot snap-2"]
+    on_track = [e for e in events if e["ph"] != "M" and tracks.get(e["tid"]) == "snapshot snap-1"]
+    names = [e["name"] for e in on_track]
+    assert names[:2] == ["disks.get", "snapshots.insert"]
+    assert "wait snapshot" in names and "ready" in names and names[-1] == "create_snapshot"
+    whole = on_track[-1]
+    # every phase of the resource lies inside its create_snapshot span
+    assert all(whole["ts"] <= e["ts"] <= whole["ts"] + whole["dur"] for e in on_track)
+
+
+def test_trace_file_is_chrome_trace_json(tracer, backend, tmp_path):
+    backend.add_snapshot("src", "snap-1")
+    with span("config load"):
+        pass
+    create_disk_from_snapshot("src", "us-central1-a", "disk-1", "pd-balanced", 10, "target", "snap-1", wait=True)
+
+    tracer.write(str(tmp_path / "trace.json"))
+
+    trace = json.loads((tmp_path / "trace.json").read_text())
+    phases = {e["name"]: e for e in trace["traceEvents"]}
+    assert phases["config load"]["ph"] == "X"
+    assert phases["disks.insert"]["cat"] == "api"
+    assert phases["wait disk"]["args"]["outcome"] == "ready"
+
+
+def test_nothing_is_recorded_when_disabled(backend):
+    backend.add_disk("p", "us-central1-a", "disk-1")
+
+    create_snapshot("p", "disk-1", "snap-1", "us-central1-a")
+
+    assert TRACER.events() == []
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+import sys
+import os
+import time
+import pytest
+from unittest import mock
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
+from snapshot_create import clients
+from snapshot_create.fake_compute import FakeComputeBackend
+from snapshot_create.utils import (
+    OPERATION_POLLING,
+    wait_for_discovery_operation,
+    wait_for_disk_creation,
+    wait_for_snapshot_creation,
+)
+
+
+def test_wait_for_snapshot_creation_uses_extended_operation():
+    snapshot_client = mock.MagicMock()
+    snapshot_client.get.return_value.status = "READY"
+    operation = mock.MagicMock(error_code=None, warnings=[])
+
+    assert wait_for_snapshot_creation(
+        "test-project", "test-snapshot", snapshot_client=snapshot_client, operation=operation)
+
+    operation.result.assert_called_once_with(timeout=300, polling=OPERATION_POLLING)
+    # one confirming get once the operation is done, no polling loop
+    snapshot_client.get.assert_called_once_with(
+        project="test-project", snapshot="test-snapshot", metadata=[("x-goog-fieldmask", "status")])
+
+
+def test_wait_for_disk_creation_uses_zone_operation_wait():
+    service = mock.MagicMock()
+    zone_operations = service.zoneOperations.return_value
+    zone_operations.wait.return_value.execute.side_effect = [
+        {"name": "op-1", "status": "RUNNING"},
+        {"name": "op-1", "status": "DONE"},
+    ]
+    disk_client = mock.MagicMock()
+    disk_client.get.return_value.status = "READY"
+
+    with mock.patch("snapshot_create.clients.time.sleep") as mock_sleep:
+        assert wait_for_disk_creation(
+            "test-project", "us-central1-a", "test-disk",
+            operation={"name": "op-1", "status": "PENDING"},
+            disk_client=disk_client, service=service)
+
+    zone_operations.wait.assert_called_with(
+        project="test-project", operation="op-1", zone="us-central1-a")
+    assert zone_operations.wait.call_count == 2
+    mock_sleep.assert_not_called()
+    disk_client.get.assert_called_once()
+
+
+def test_wait_for_discovery_operation_raises_on_error():
+    service = mock.MagicMock()
+    service.globalOperations.return_value.wait.return_value.execute.return_value = {
+        "name": "op-2", "status": "DONE", "error": {"errors": [{"code": "QUOTA_EXCEEDED"}]}}
+
+    with pytest.raises(RuntimeError, match="QUOTA_EXCEEDED"):
+        wait_for_discovery_operation({"name": "op-2", "status": "PENDING"}, "test-project", service=service)
+
+
+def test_rejected_insert_is_not_handed_to_the_watcher():
+    watcher = mock.MagicMock()
+    operation = {"name": "op-3", "status": "DONE", "error": {"errors": [{"code": "QUOTA_EXCEEDED"}]}}
+
+    with pytest.raises(RuntimeError, match="QUOTA_EXCEEDED"):
+        wait_for_snapshot_creation("test-project", "test-snapshot", operation=operation, watcher=watcher)
+    watcher.watch_snapshot.assert_not_called()
+
+
+def test_wait_without_operation_backs_off_with_jitter():
+    disk_client = mock.MagicMock()
+    statuses = iter(["CREATING", "CREATING", "CREATING", "READY"])
+    disk_client.get.side_effect = lambda **kwargs: mock.MagicMock(status=next(statuses))
+
+    with mock.patch("snapshot_create.clients.time.sleep") as mock_sleep:
+        assert wait_for_disk_creation(
+            "test-project", "us-central1-a", "test-disk", disk_client=disk_client)
+
+    delays = [c.args[0] for c in mock_sleep.call_args_list]
+    assert len(delays) == 3
+    # first poll well under the old fixed 5 s interval
+    assert 0 <= delays[0] <= 0.5
+    assert all(0 <= d <= 10 for d in delays)
+
+
+def test_wait_reports_failed_status():
+    snapshot_client = mock.MagicMock()
+    snapshot_client.get.return_value.status = "FAILED"
+
+    assert not wait_for_snapshot_creation("test-project", "test-snapshot", snapshot_client=snapshot_client)
+
+
+def test_polling_sleeps_on_the_fake_backend_clock():
+    # 300 simulated seconds of polling a disk that never gets ready take 0.3 s at time_scale 0.001
+    backend = FakeComputeBackend(ready_after=10_000, time_scale=0.001, seed=0)
+    backend.add_disk("test-project", "us-central1-a", "test-disk", ready=False)
+    clients.use_backend(backend)
+    try:
+        start = time.monotonic()
+        assert not wait_for_disk_creation("test-project", "us-central1-a", "test-disk", timeout=300)
+    finally:
+        clients.use_backend(None)
+    assert time.monotonic() - start < 10
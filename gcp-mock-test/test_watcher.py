@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+import sys
+import os
+import pytest
+from unittest import mock
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
+from snapshot_create.watcher import ReadinessWatcher, name_filter
+
+
+def resource(name, status):
+    item = mock.MagicMock(status=status)
+    item.name = name
+    return item
+
+
+def test_one_list_call_per_project_for_many_snapshots():
+    snapshot_client = mock.MagicMock()
+    snapshot_client.list.return_value = [
+        resource("snap-1", "READY"), resource("snap-2", "CREATING"), resource("snap-3", "FAILED")]
+    watcher = ReadinessWatcher(snapshot_client=snapshot_client, autostart=False)
+
+    futures = {name: watcher.watch_snapshot("project-a", name) for name in ("snap-1", "snap-2", "snap-3")}
+    watcher.poll_once()
+
+    snapshot_client.list.assert_called_once()
+    request = snapshot_client.list.call_args.kwargs["request"]
+    assert request.project == "project-a"
+    assert request.filter == name_filter(["snap-1", "snap-2", "snap-3"])
+    assert futures["snap-1"].result(timeout=0).name == "snap-1"
+    assert not futures["snap-2"].done()
+    with pytest.raises(RuntimeError, match="FAILED"):
+        futures["snap-3"].result(timeout=0)
+    assert watcher.pending() == 1
+
+
+def test_disks_resolved_through_aggregated_list():
+    disk_client = mock.MagicMock()
+    disk_client.aggregated_list.return_value = [
+        ("zones/us-central1-a", mock.MagicMock(disks=[resource("disk-1", "READY")])),
+        # same name in another zone is a different disk
+        ("zones/us-central1-b", mock.MagicMock(disks=[resource("disk-1", "CREATING")])),
+    ]
+    watcher = ReadinessWatcher(disk_client=disk_client, autostart=False)
+
+    zone_a = watcher.watch_disk("project-a", "us-central1-a", "disk-1")
+    zone_b = watcher.watch_disk("project-a", "us-central1-b", "disk-1")
+    watcher.poll_once()
+
+    disk_client.aggregated_list.assert_called_once()
+    assert zone_a.done() and not zone_b.done()
+
+
+def test_pending_resources_time_out():
+    snapshot_client = mock.MagicMock()
+    snapshot_client.list.return_value = []
+    watcher = ReadinessWatcher(snapshot_client=snapshot_client, autostart=False)
+
+    future = watcher.watch_snapshot("project-a", "snap-1", timeout=-1)
+    watcher.poll_once()
+
+    with pytest.raises(TimeoutError):
+        future.result(timeout=0)
+
+
+def test_background_thread_resolves_waiters():
+    snapshot_client = mock.MagicMock()
+    snapshot_client.list.return_value = [resource("snap-1", "READY")]
+
+    with ReadinessWatcher(interval=0.01, snapshot_client=snapshot_client) as watcher:
+        assert watcher.watch_snapshot("project-a", "snap-1").result(timeout=5).status == "READY"
@@ -0,0 +1,372 @@
+#! /usr/bin/env python
+from __future__ import annotations
+import asyncio
+import functools
+import logging
+import os
+import time
+import weakref
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Callable
+from google.api_core.retry import exponential_sleep_generator
+from google.cloud import compute_v1
+from . import clients
+from .clients import get_client, get_compute_service
+from .create_disk_from_snapshot import disk_body
+from .list_snapshot import MAX_PAGE_SIZE, creation_time
+from .metrics import METRICS, POLL_BUCKETS, record_ready
+from .records import SNAPSHOT_LIST_FIELDS, STATUS_LIST_FIELDS, DiskRecord, SnapshotRecord, field_mask, get_fields
+from .utils import POLL_INITIAL, POLL_MAXIMUM, POLL_MULTIPLIER
+from .watcher import FILTER_CHUNK_SIZE, name_filter
+
+# asyncio counterparts of the snapshot and disk helpers.
+#
+# The Compute client libraries only speak blocking HTTP, so each single API
+# call runs on one shared, bounded thread pool (IO_THREADS) and is awaited
+# from the event loop. Everything that takes long happens on the loop: polls
+# are asyncio.sleep() with the same jittered backoff as utils.py, and resources
+# are confirmed READY by one AsyncWatcher per loop, which reads every pending
+# resource of a project with one filtered list call per tick. A thread is
+# only ever held for one HTTP round trip, so thousands of operations can be
+# in flight from a single loop.
+#
+# Every coroutine can be cancelled or wrapped in asyncio.wait_for(); a call
+# already sent still completes in its thread, and a cancelled create leaves
+# the resource to finish on the server side.
+
+IO_THREADS = int(os.environ.get("GCP_UTILITIES_AIO_THREADS", "32"))
+
+_executor: ThreadPoolExecutor | None = None
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=IO_THREADS, thread_name_prefix="aio-io")
+    return _executor
+
+
+async def call(fn: Callable, *args, **kwargs) -> Any:
+    """Run one blocking API call on the shared I/O pool."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_executor(), functools.partial(fn, *args, **kwargs))
+
+
+def _record_wait(kind: str, start: float, polls: int, outcome: str) -> None:
+    # same series as metrics.tracked_wait, which is thread-local and can't follow a coroutine
+    METRICS.observe("wait_seconds", time.monotonic() - start, kind=kind, outcome=outcome)
+    METRICS.observe("wait_polls", polls, buckets=POLL_BUCKETS, kind=kind)
+    METRICS.inc("waits_total", kind=kind, outcome=outcome)
+
+
+# ---- shared waiting ------------------------------------------------------------
+
+
+class AsyncWatcher:
+    """Polls every awaited snapshot and disk of one event loop together, like watcher.ReadinessWatcher."""
+
+    def __init__(self, interval: float = 2.0, timeout: float = 300):
+        self.interval = interval
+        self.timeout = timeout
+        # project -> snapshot name / (zone, disk name) -> futures waiting for it
+        self._snapshots: dict[str, dict[str, list[asyncio.Future]]] = defaultdict(lambda: defaultdict(list))
+        self._disks: dict[str, dict[tuple[str, str], list[asyncio.Future]]] = defaultdict(lambda: defaultdict(list))
+        self._task: asyncio.Task | None = None
+
+    async def _watch(self, table: dict, project_id: str, key, timeout: float | None) -> Any:
+        future = asyncio.get_running_loop().create_future()
+        table[project_id][key].append(future)
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        try:
+            return await asyncio.wait_for(future, clients.real_seconds(timeout or self.timeout))
+        except asyncio.TimeoutError:
+            raise TimeoutError(f"{key} in {project_id} did not become ready in time") from None
+        finally:
+            # timed out or cancelled: stop polling for it unless someone else still waits
+            waiters = table[project_id].get(key)
+            if waiters is not None and future in waiters:
+                waiters.remove(future)
+                if not waiters:
+                    del table[project_id][key]
+
+    async def watch_snapshot(self, project_id: str, snapshot_name: str, timeout: float | None = None):
+        return await self._watch(self._snapshots, project_id, snapshot_name, timeout)
+
+    async def watch_disk(self, project_id: str, zone: str, disk_name: str, timeout: float | None = None):
+        return await self._watch(self._disks, project_id, (zone, disk_name), timeout)
+
+    def pending(self) -> int:
+        return sum(len(keys) for table in (self._snapshots, self._disks) for keys in table.values())
+
+    def _resolve(self, table: dict, project_id: str, key, resource) -> None:
+        for future in table[project_id].pop(key, []):
+            if future.done():
+                continue
+            if resource.status == "READY":
+                future.set_result(resource)
+            else:
+                future.set_exception(RuntimeError(f"{key} in {project_id} is {resource.status}"))
+
+    async def _poll_snapshots(self, project_id: str, names: list[str]) -> None:
+        request = compute_v1.ListSnapshotsRequest(project=project_id, filter=name_filter(names))
+        client = get_client(compute_v1.SnapshotsClient)
+        for snapshot in await call(lambda: list(client.list(request=request, metadata=field_mask(STATUS_LIST_FIELDS)))):
+            if snapshot.status in ("READY", "FAILED"):
+                self._resolve(self._snapshots, project_id, snapshot.name, snapshot)
+
+    async def _poll_disks(self, project_id: str, names: list[str]) -> None:
+        request = compute_v1.AggregatedListDisksRequest(
+            project=project_id, filter=name_filter(names), return_partial_success=True)
+        client = get_client(compute_v1.DisksClient)
+        for scope, scoped_list in await call(lambda: list(client.aggregated_list(request=request))):
+            # scope looks like "zones/us-central1-a"
+            zone = scope.rsplit("/", 1)[-1]
+            for disk in scoped_list.disks:
+                if disk.status in ("READY", "FAILED"):
+                    self._resolve(self._disks, project_id, (zone, disk.name), disk)
+
+    async def poll_once(self) -> None:
+        """One tick: a list call per project and name chunk, all in flight at once."""
+        METRICS.inc("watcher_ticks_total")
+        polls = []
+        for project_id, keys in self._snapshots.items():
+            names = sorted(keys)
+            polls += [self._poll_snapshots(project_id, names[i:i + FILTER_CHUNK_SIZE])
+                      for i in range(0, len(names), FILTER_CHUNK_SIZE)]
+        for project_id, keys in self._disks.items():
+            names = sorted({name for _, name in keys})
+            polls += [self._poll_disks(project_id, names[i:i + FILTER_CHUNK_SIZE])
+                      for i in range(0, len(names), FILTER_CHUNK_SIZE)]
+        for result in await asyncio.gather(*polls, return_exceptions=True):
+            if isinstance(result, Exception):
+                # retried next tick; waiters time out on their own
+                logging.warning(f"Readiness poll failed: {result}")
+
+    async def _run(self) -> None:
+        while self.pending():
+            await self.poll_once()
+            if not self.pending():
+                return
+            await asyncio.sleep(clients.real_seconds(self.interval))
+
+
+_watchers: weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, AsyncWatcher] = weakref.WeakKeyDictionary()
+
+
+def get_watcher() -> AsyncWatcher:
+    """The AsyncWatcher of the running event loop."""
+    loop = asyncio.get_running_loop()
+    if loop not in _watchers:
+        _watchers[loop] = AsyncWatcher()
+    return _watchers[loop]
+
+
+# ---- operations ----------------------------------------------------------------
+
+
+def _get_discovery_operation(operation: dict, project_id: str, zone: str | None) -> dict:
+    # built and executed on the same pool thread: discovery services are per thread
+    service = get_compute_service()
+    if zone:
+        return service.zoneOperations().get(project=project_id, zone=zone, operation=operation["name"]).execute()
+    return service.globalOperations().get(project=project_id, operation=operation["name"]).execute()
+
+
+async def wait_for_operation(operation, project_id: str | None = None, zone: str | None = None,
+                             timeout: float = 300) -> int:
+    """Poll an ExtendedOperation or discovery operation dict until DONE; returns the number of polls.
+
+    Raises the operation's error, or TimeoutError.
+    """
+    deadline = clients.monotonic() + timeout
+    delays = exponential_sleep_generator(POLL_INITIAL, POLL_MAXIMUM, POLL_MULTIPLIER)
+    polls = 0
+    while True:
+        polls += 1
+        if isinstance(operation, dict):
+            if operation.get("status") != "DONE":
+                operation = await call(_get_discovery_operation, operation, project_id, zone)
+            done = operation.get("status") == "DONE"
+        else:
+            done = await call(operation.done)
+        if done:
+            break
+        delay = min(next(delays), deadline - clients.monotonic())
+        if delay <= 0:
+            raise TimeoutError(f"Operation {_operation_name(operation)} did not complete in time")
+        await asyncio.sleep(clients.real_seconds(delay))
+    if isinstance(operation, dict):
+        if operation.get("error"):
+            raise RuntimeError(f"Operation {operation['name']} failed: {operation['error']}")
+    elif operation.error_code:
+        raise operation.exception() or RuntimeError(operation.error_message)
+    return polls
+
+
+def _operation_name(operation) -> str:
+    return operation["name"] if isinstance(operation, dict) else operation.name
+
+
+async def wait_for_disk_creation(project_id: str, zone: str, disk_name: str, operation=None,
+                                 timeout: float = 300, watcher: AsyncWatcher | None = None) -> bool:
+    """Wait until a disk is READY: on its insert operation if given, then through the loop's watcher."""
+    start = time.monotonic()
+    deadline = clients.monotonic() + timeout
+    polls = 0
+    try:
+        if operation is not None:
+            polls = await wait_for_operation(operation, project_id, zone, timeout)
+        await (watcher or get_watcher()).watch_disk(
+            project_id, zone, disk_name, timeout=max(0.001, deadline - clients.monotonic()))
+    except (TimeoutError, RuntimeError) as e:
+        logging.error(f"Disk '{disk_name}' did not become ready: {e}")
+        _record_wait("disk", start, polls + 1, "not_ready")
+        return False
+    except BaseException:
+        # cancelled, or an API error
+        _record_wait("disk", start, polls, "error")
+        raise
+    logging.info(f"Disk '{disk_name}' is ready.")
+    _record_wait("disk", start, polls + 1, "ready")
+    return True
+
+
+async def wait_for_snapshot_creation(project_id: str, snapshot_name: str, operation=None,
+                                     timeout: float = 300, watcher: AsyncWatcher | None = None) -> bool:
+    """Wait until a snapshot is READY, the same way wait_for_disk_creation does for disks."""
+    start = time.monotonic()
+    deadline = clients.monotonic() + timeout
+    polls = 0
+    try:
+        if operation is not None:
+            polls = await wait_for_operation(operation, project_id, None, timeout)
+        await (watcher or get_watcher()).watch_snapshot(
+            project_id, snapshot_name, timeout=max(0.001, deadline - clients.monotonic()))
+    except (TimeoutError, RuntimeError) as e:
+        logging.error(f"Snapshot '{snapshot_name}' did not become ready: {e}")
+        _record_wait("snapshot", start, polls + 1, "not_ready")
+        return False
+    except BaseException:
+        _record_wait("snapshot", start, polls, "error")
+        raise
+    logging.info(f"Snapshot '{snapshot_name}' is ready.")
+    _record_wait("snapshot", start, polls + 1, "ready")
+    return True
+
+
+# ---- snapshots and disks ------------------------------------------------------
+
+
+async def create_snapshot(
+    target_project_id: str,
+    disk_name: str,
+    snapshot_name: str,
+    zone: str | None = None,
+    region: str | None = None,
+    location: str | None = None,
+    disk_project_id: str | None = None,
+    timeout: float = 300,
+    watcher: AsyncWatcher | None = None,
+) -> compute_v1.Snapshot:
+    """Async create_snapshot.create_snapshot: errors are raised, never sys.exit()."""
+    if (zone is None) == (region is None):
+        raise RuntimeError("Specify exactly one of `zone` or `region`.")
+    disk_project_id = disk_project_id or target_project_id
+    if zone is not None:
+        disk = await call(get_client(compute_v1.DisksClient).get,
+                          project=disk_project_id, zone=zone, disk=disk_name, metadata=field_mask("selfLink"))
+    else:
+        disk = await call(get_client(compute_v1.RegionDisksClient).get,
+                          project=disk_project_id, region=region, disk=disk_name, metadata=field_mask("selfLink"))
+    snapshot = compute_v1.Snapshot()
+    snapshot.source_disk = disk.self_link
+    snapshot.name = snapshot_name
+    if location:
+        snapshot.storage_locations = [location]
+    snapshot_client = get_client(compute_v1.SnapshotsClient)
+    submitted_at = time.monotonic()
+    operation = await call(snapshot_client.insert, project=target_project_id, snapshot_resource=snapshot)
+    if not await wait_for_snapshot_creation(target_project_id, snapshot_name, operation=operation,
+                                            timeout=timeout, watcher=watcher):
+        raise TimeoutError(f"Snapshot {snapshot_name} did not become ready")
+    record_ready("snapshot", time.monotonic() - submitted_at)
+    return await call(snapshot_client.get, project=target_project_id, snapshot=snapshot_name)
+
+
+async def create_disk_from_snapshot(
+    src_project_id: str,
+    target_zone: str,
+    disk_name: str,
+    disk_type: str,
+    disk_size_gb: int,
+    target_project_id: str,
+    src_snapshot_name: str,
+    wait: bool = True,
+    timeout: float = 300,
+    watcher: AsyncWatcher | None = None,
+) -> dict:
+    """Async create_disk_from_snapshot.create_disk_from_snapshot; returns the disk resource."""
+    body = disk_body(src_project_id, target_zone, disk_name, disk_type, disk_size_gb,
+                     target_project_id, src_snapshot_name)
+
+    def insert() -> dict:
+        return get_compute_service().disks().insert(
+            project=target_project_id, zone=target_zone, body=body).execute()
+
+    def get() -> dict:
+        return get_compute_service().disks().get(
+            project=target_project_id, zone=target_zone, disk=disk_name, fields=get_fields(DiskRecord)).execute()
+
+    submitted_at = time.monotonic()
+    operation = await call(insert)
+    if wait:
+        if not await wait_for_disk_creation(target_project_id, target_zone, disk_name, operation=operation,
+                                            timeout=timeout, watcher=watcher):
+            raise TimeoutError(f"Disk {disk_name} did not become ready")
+        record_ready("disk", time.monotonic() - submitted_at)
+    return await call(get)
+
+
+async def delete_snapshot(project_id: str, snapshot_name: str, timeout: float = 300) -> None:
+    operation = await call(get_client(compute_v1.SnapshotsClient).delete,
+                           project=project_id, snapshot=snapshot_name)
+    await wait_for_operation(operation, project_id, timeout=timeout)
+
+
+async def iter_snapshots(proj: str, filter: str | None = None, order_by: str | None = None,
+                         max_results: int = MAX_PAGE_SIZE) -> AsyncIterator[SnapshotRecord]:
+    """Yield every snapshot in the project, one page request at a time."""
+    kwargs: dict[str, Any] = {"project": proj, "maxResults": max_results, "fields": SNAPSHOT_LIST_FIELDS}
+    if filter:
+        kwargs["filter"] = filter
+    if order_by:
+        kwargs["orderBy"] = order_by
+
+    def page(token: str | None) -> dict:
+        return get_compute_service().snapshots().list(**kwargs, **({"pageToken": token} if token else {})).execute()
+
+    token = None
+    while True:
+        response = await call(page, token)
+        for snapshot in response.get("items", []):
+            yield SnapshotRecord.from_api(snapshot)
+        token = response.get("nextPageToken")
+        if not token:
+            return
+
+
+async def list_snapshots(proj: str, filter: str | None = None) -> SnapshotRecord | None:
+    """Async list_snapshot.list_snapshots: the most recently created matching snapshot."""
+    if not filter:
+        async for snapshot in iter_snapshots(proj, order_by="creationTimestamp desc", max_results=1):
+            return snapshot
+        return None
+    newest = None
+    async for snapshot in iter_snapshots(proj, filter=filter):
+        if newest is None or creation_time(snapshot) > creation_time(newest):
+            newest = snapshot
+    if newest is None:
+        logging.warning(f"No snapshot with in {proj} with filter {filter}")
+    return newest
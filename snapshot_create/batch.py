@@ -0,0 +1,222 @@
+#! /usr/bin/env python
+from __future__ import annotations
+from collections import defaultdict, deque
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from typing import Any, Callable, Iterable
+import logging
+import threading
+import time
+
+
+@dataclass
+class BatchResult:
+    """Outcome of one batch entry: either a value or the error that stopped it."""
+    key: str
+    entry: dict = field(repr=False)
+    value: Any = None
+    error: BaseException | None = None
+    elapsed: float = 0.0
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+class KeyedLimiter:
+    """Caps how many tasks may hold the same key (e.g. a project or zone) at once.
+
+    A limit of None (or 0) means the key is not capped. Slots are taken and
+    given back by KeyedDispatcher.
+    """
+
+    def __init__(self, limit: int | None):
+        self.limit = limit
+        self._lock = threading.Lock()
+        self._held: dict[str, int] = defaultdict(int)
+
+    def _capped(self, key: str | None) -> bool:
+        return bool(self.limit) and key is not None
+
+    def available(self, key: str | None) -> bool:
+        with self._lock:
+            return not self._capped(key) or self._held[key] < self.limit
+
+    def acquire(self, key: str | None) -> None:
+        """Take a slot of `key` without waiting; callers check available() first."""
+        if self._capped(key):
+            with self._lock:
+                self._held[key] += 1
+
+    def release(self, key: str | None) -> None:
+        if self._capped(key):
+            with self._lock:
+                self._held[key] -= 1
+                if not self._held[key]:
+                    del self._held[key]
+
+
+class BoundedExecutor:
+    """ThreadPoolExecutor whose submit() blocks once `max_pending` tasks are queued or running.
+
+    This is what gives a stage backpressure: a fast producer is slowed down to
+    the pace of the consumer instead of queueing an unbounded amount of work.
+    """
+
+    def __init__(self, workers: int, max_pending: int | None = None, name: str = "batch"):
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix=name)
+        self._slots = threading.BoundedSemaphore(max_pending or workers * 2)
+
+    def submit(self, fn: Callable, *args, **kwargs) -> Future:
+        self._slots.acquire()
+        try:
+            future = self._executor.submit(fn, *args, **kwargs)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def shutdown(self, wait: bool = True, cancel_futures: bool = False) -> None:
+        self._executor.shutdown(wait=wait, cancel_futures=cancel_futures)
+
+    def __enter__(self) -> BoundedExecutor:
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.shutdown(wait=True)
+
+
+@dataclass
+class _Task:
+    future: Future
+    limiters: list[tuple[KeyedLimiter, str | None]]
+    fn: Callable
+    args: tuple
+
+
+class KeyedDispatcher:
+    """Hands tasks to a pool of `workers` threads once every key they name has a free slot.
+
+    A task that would go over a KeyedLimiter's cap waits here, in a queue of
+    the key that holds it back, instead of on a worker thread. Workers only
+    ever run tasks that can make progress, and tasks of other keys pass the
+    held-back ones: a zone or project at its limit doesn't stall the rest.
+    """
+
+    def __init__(self, workers: int, name: str = "batch"):
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name)
+        self._lock = threading.Condition()
+        self._waiting: dict[tuple[KeyedLimiter, str | None], deque[_Task]] = {}
+        # submitted and not finished yet, waiting ones included
+        self._outstanding = 0
+
+    def submit(self, limiters: Iterable[tuple[KeyedLimiter, str | None]], fn: Callable, *args) -> Future:
+        task = _Task(Future(), list(limiters), fn, args)
+        with self._lock:
+            self._outstanding += 1
+            ready = self._admit(task)
+        self._start(ready)
+        return task.future
+
+    def _admit(self, task: _Task) -> list[_Task]:
+        # under the lock: take the task's slots, or park it behind the first key that is full
+        for limiter, key in task.limiters:
+            if not limiter.available(key):
+                self._waiting.setdefault((limiter, key), deque()).append(task)
+                return []
+        for limiter, key in task.limiters:
+            limiter.acquire(key)
+        return [task]
+
+    def _start(self, tasks: list[_Task]) -> None:
+        for task in tasks:
+            self._executor.submit(self._run, task)
+
+    def _run(self, task: _Task) -> None:
+        try:
+            if task.future.set_running_or_notify_cancel():
+                try:
+                    task.future.set_result(task.fn(*task.args))
+                except BaseException as e:
+                    task.future.set_exception(e)
+        finally:
+            with self._lock:
+                ready = []
+                for limiter, key in task.limiters:
+                    limiter.release(key)
+                for limiter, key in task.limiters:
+                    queue = self._waiting.get((limiter, key))
+                    while queue and limiter.available(key):
+                        ready += self._admit(queue.popleft())
+                    if queue is not None and not queue:
+                        del self._waiting[(limiter, key)]
+                self._outstanding -= 1
+                self._lock.notify_all()
+            self._start(ready)
+
+    def shutdown(self, wait: bool = True) -> None:
+        if wait:
+            with self._lock:
+                self._lock.wait_for(lambda: not self._outstanding)
+        self._executor.shutdown(wait=wait)
+
+    def __enter__(self) -> KeyedDispatcher:
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.shutdown(wait=True)
+
+
+def run_entry(fn: Callable[[dict], Any], key: str, entry: dict) -> BatchResult:
+    """Run fn(entry) and capture the outcome instead of raising."""
+    start = time.monotonic()
+    try:
+        value = fn(entry)
+        return BatchResult(key, entry, value=value, elapsed=time.monotonic() - start)
+    except (Exception, SystemExit) as e:
+        # SystemExit is caught too: a single entry must never end the whole batch
+        logging.error(f"Batch entry {key} failed: {e!r}")
+        return BatchResult(key, entry, error=e, elapsed=time.monotonic() - start)
+
+
+def run_batch(
+    fn: Callable[[dict], Any],
+    entries: list[dict],
+    key: Callable[[dict], str],
+    concurrency: int = 8,
+    project_of: Callable[[dict], str | None] | None = None,
+    zone_of: Callable[[dict], str | None] | None = None,
+    project_limit: int | None = None,
+    zone_limit: int | None = None,
+) -> list[BatchResult]:
+    """Run fn over every entry through a worker pool and return one BatchResult per entry.
+
+    Results come back in the same order as `entries`. `project_limit` and
+    `zone_limit` cap how many entries of the same project / zone are in
+    flight at once, on top of the overall `concurrency`.
+    """
+    project_limiter = KeyedLimiter(project_limit)
+    zone_limiter = KeyedLimiter(zone_limit)
+    results: list[BatchResult | None] = [None] * len(entries)
+    with KeyedDispatcher(max(1, concurrency), name="batch") as dispatcher:
+        futures = {}
+        for index, entry in enumerate(entries):
+            limiters = [
+                (project_limiter, project_of(entry) if project_of else None),
+                (zone_limiter, zone_of(entry) if zone_of else None),
+            ]
+            future = dispatcher.submit(limiters, run_entry, fn, key(entry), entry)
+            futures[future] = index
+        for future in as_completed(futures):
+            results[futures[future]] = future.result()
+    return results
+
+
+def summarize(results: list[BatchResult]) -> dict[str, list[str]]:
+    # group entry keys by outcome for the end-of-run report
+    summary: dict[str, list[str]] = defaultdict(list)
+    for result in results:
+        summary["succeeded" if result.ok else "failed"].append(result.key)
+    return dict(summary)
@@ -0,0 +1,312 @@
+#! /usr/bin/env python
+from __future__ import annotations
+import argparse
+import itertools
+import json
+import logging
+import math
+import multiprocessing
+import platform
+import resource
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass
+from datetime import datetime, timezone
+from . import clients
+from .batch import run_batch
+from .create_disk_from_snapshot import create_disk_from_snapshot, create_disks_from_snapshots
+from .create_snapshot import create_snapshot
+from .fake_compute import FakeComputeBackend
+from .list_snapshot import list_snapshots
+from .utils import wait_for_disk_creation
+from .watcher import ReadinessWatcher
+
+# Benchmarks for the batch workflows, run against fake_compute.
+#
+# Every case builds a fresh FakeComputeBackend, seeds it, runs one workflow
+# over `size` resources and records wall-clock time, API calls per resource,
+# peak RSS and the p50/p95/p99 time from batch start until each resource was
+# READY. Cases run in their own process by default so peak RSS belongs to the
+# case alone. Results are appended as JSON lines tagged with the git commit,
+# and --compare prints the change against an earlier results file.
+
+SCENARIOS = ("snapshots", "disks", "bulk_disks", "wait", "list")
+PROJECT = "bench-project"
+ZONES = ("us-central1-a", "us-central1-b", "us-central1-c")
+# ReadinessWatcher interval in simulated seconds; the watcher waits on the backend's clock
+WATCH_INTERVAL = 2.0
+
+
+@dataclass(frozen=True)
+class Case:
+    scenario: str
+    size: int
+    concurrency: int = 8
+    latency: float = 0.05
+    ready_after: float = 30.0
+    time_scale: float = 0.01
+    watch: bool = False
+
+
+def percentile(values: list[float], q: float) -> float | None:
+    # nearest-rank percentile; None for an empty sample
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, min(len(ordered), math.ceil(q / 100 * len(ordered))))
+    return ordered[rank - 1]
+
+
+def _disk_name(i: int) -> str:
+    return f"bench-disk-{i:05d}"
+
+
+def _snapshot_name(i: int) -> str:
+    return f"bench-snap-{i:05d}"
+
+
+def _batch_ready_times(fn, entries: list[dict], case: Case, start: float) -> tuple[list[float], int]:
+    ready: list[float] = []
+
+    def timed(entry: dict):
+        value = fn(entry)
+        # seconds from batch start until this resource was READY
+        ready.append(time.monotonic() - start)
+        return value
+
+    results = run_batch(timed, entries, key=lambda entry: entry["name"], concurrency=case.concurrency)
+    return ready, sum(not r.ok for r in results)
+
+
+def _run_snapshots(backend: FakeComputeBackend, case: Case, watcher, start_clock) -> tuple[list[float], int]:
+    for i in range(case.size):
+        backend.add_disk(PROJECT, ZONES[i % len(ZONES)], _disk_name(i))
+    entries = [{"name": _snapshot_name(i), "disk": _disk_name(i), "zone": ZONES[i % len(ZONES)]}
+               for i in range(case.size)]
+
+    def snapshot(entry: dict):
+        return create_snapshot(PROJECT, entry["disk"], entry["name"], zone=entry["zone"],
+                               exit_on_error=False, watcher=watcher)
+
+    return _batch_ready_times(snapshot, entries, case, start_clock())
+
+
+def _run_disks(backend: FakeComputeBackend, case: Case, watcher, start_clock) -> tuple[list[float], int]:
+    for i in range(case.size):
+        backend.add_snapshot(PROJECT, _snapshot_name(i))
+    entries = [{"name": f"bench-clone-{i:05d}", "snapshot": _snapshot_name(i), "zone": ZONES[i % len(ZONES)]}
+               for i in range(case.size)]
+
+    def clone(entry: dict):
+        return create_disk_from_snapshot(PROJECT, entry["zone"], entry["name"], "pd-balanced", None,
+                                         PROJECT, entry["snapshot"], raise_on_error=True, wait=True,
+                                         watcher=watcher)
+
+    return _batch_ready_times(clone, entries, case, start_clock())
+
+
+def _run_bulk_disks(backend: FakeComputeBackend, case: Case, watcher, start_clock) -> tuple[list[float], int]:
+    # the disks scenario through batched HTTP requests; concurrency and watch don't apply
+    for i in range(case.size):
+        backend.add_snapshot(PROJECT, _snapshot_name(i))
+    entries = [{"target_zone": ZONES[i % len(ZONES)], "disk_name": f"bench-clone-{i:05d}",
+                "disk_type": "pd-balanced", "disk_size_gb": None, "src_project_id": PROJECT,
+                "src_snapshot_name": _snapshot_name(i)} for i in range(case.size)]
+    start_clock()
+    results = create_disks_from_snapshots(PROJECT, entries)
+    # the inserts go out right at the start; a disk's elapsed runs until the polling round that saw it READY
+    return [r.elapsed for r in results if r.ok], sum(not r.ok for r in results)
+
+
+def _run_wait(backend: FakeComputeBackend, case: Case, watcher, start_clock) -> tuple[list[float], int]:
+    # resources are already being created; only the waiting is measured
+    entries = []
+    for i in range(case.size):
+        zone = ZONES[i % len(ZONES)]
+        operation = backend.insert_disk(PROJECT, zone, {"name": _disk_name(i)})
+        entries.append({"name": _disk_name(i), "zone": zone, "operation": operation})
+    backend.calls.clear()
+
+    def wait(entry: dict) -> bool:
+        if not wait_for_disk_creation(PROJECT, entry["zone"], entry["name"],
+                                      operation=None if watcher else entry["operation"], watcher=watcher):
+            raise TimeoutError(f"{entry['name']} did not become ready")
+        return True
+
+    return _batch_ready_times(wait, entries, case, start_clock())
+
+
+def _run_list(backend: FakeComputeBackend, case: Case, watcher, start_clock) -> tuple[list[float], int]:
+    for i in range(case.size):
+        backend.add_snapshot(PROJECT, _snapshot_name(i), source_disk=_disk_name(i % 10))
+    start_clock()
+    # a filter the server can't sort for: every page is streamed through
+    found = list_snapshots(PROJECT, f"sourceDisk = \"{_disk_name(0)}\"")
+    return [], 0 if found else 1
+
+
+RUNNERS = {
+    "snapshots": _run_snapshots,
+    "disks": _run_disks,
+    "bulk_disks": _run_bulk_disks,
+    "wait": _run_wait,
+    "list": _run_list,
+}
+
+
+def run_case(case: Case) -> dict:
+    """Run one case against a fresh fake backend and return its result record."""
+    # per-resource debug logging would dominate the timings at 10k resources
+    logging.disable(logging.WARNING)
+    backend = FakeComputeBackend(latency=case.latency, ready_after=case.ready_after,
+                                 time_scale=case.time_scale, seed=0)
+    clients.use_backend(backend)
+    watcher = ReadinessWatcher(interval=WATCH_INTERVAL) if case.watch else None
+    marks: dict[str, float] = {}
+
+    def start_clock() -> float:
+        # seeding is not timed and its calls are not counted
+        backend.calls.clear()
+        marks["start"] = time.monotonic()
+        return marks["start"]
+
+    try:
+        ready, failed = RUNNERS[case.scenario](backend, case, watcher, start_clock)
+        wall = time.monotonic() - marks["start"]
+    finally:
+        if watcher:
+            watcher.stop()
+        clients.use_backend(None)
+        logging.disable(logging.NOTSET)
+
+    calls = sum(backend.calls.values())
+    return {
+        **asdict(case),
+        "wall_s": round(wall, 4),
+        "failed": failed,
+        "api_calls": calls,
+        "calls_per_resource": round(calls / max(case.size, 1), 3),
+        "calls_by_method": dict(sorted(backend.calls.items())),
+        # HTTP requests: a batch is one, however many calls it carries
+        "round_trips": calls - backend.batched_calls,
+        # ru_maxrss is in KiB on Linux
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "ready_p50_s": percentile(ready, 50),
+        "ready_p95_s": percentile(ready, 95),
+        "ready_p99_s": percentile(ready, 99),
+    }
+
+
+def _run_isolated(case: Case) -> dict:
+    # a fresh interpreter per case so peak RSS is not inherited from earlier cases
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as pool:
+        return pool.submit(run_case, case).result()
+
+
+def sweep(scenarios, sizes, concurrencies, latencies, ready_after: float = 30.0, time_scale: float = 0.01,
+          watch: bool = False) -> list[Case]:
+    return [Case(scenario, size, concurrency, latency, ready_after, time_scale, watch)
+            for scenario, size, concurrency, latency in itertools.product(scenarios, sizes, concurrencies, latencies)]
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(cases: list[Case], out: str | None = None, isolate: bool = True) -> list[dict]:
+    """Run every case, appending each record to `out` (JSON lines) as soon as it finishes."""
+    run = {"commit": git_commit(), "python": platform.python_version(),
+           "started_at": datetime.now(timezone.utc).isoformat(timespec="seconds")}
+    records = []
+    for case in cases:
+        record = {**run, **(_run_isolated(case) if isolate else run_case(case))}
+        records.append(record)
+        print(format_record(record), flush=True)
+        if out:
+            with open(out, "a") as f:
+                f.write(json.dumps(record) + "\n")
+    return records
+
+
+def _case_key(record: dict) -> tuple:
+    return tuple(record[name] for name in Case.__dataclass_fields__)
+
+
+def compare(baseline_path: str, records: list[dict]) -> list[str]:
+    """One line per case also present in the baseline file: wall time and calls/resource, old -> new."""
+    baseline = {}
+    with open(baseline_path) as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                # the last run of a case in the file wins
+                baseline[_case_key(record)] = record
+    lines = []
+    for record in records:
+        old = baseline.get(_case_key(record))
+        if old is None:
+            continue
+        change = (record["wall_s"] - old["wall_s"]) / old["wall_s"] * 100 if old["wall_s"] else 0.0
+        lines.append(
+            f"{record['scenario']:<9} n={record['size']:<6} c={record['concurrency']:<3} "
+            f"wall {old['wall_s']:.3f}s -> {record['wall_s']:.3f}s ({change:+.1f}%)  "
+            f"calls/res {old['calls_per_resource']} -> {record['calls_per_resource']}  "
+            f"[{old.get('commit')} -> {record.get('commit')}]")
+    return lines
+
+
+def format_record(record: dict) -> str:
+    p95 = record["ready_p95_s"]
+    return (f"{record['scenario']:<10} n={record['size']:<6} c={record['concurrency']:<3} "
+            f"latency={record['latency']:<5} watch={str(record['watch']):<5} "
+            f"wall={record['wall_s']:.3f}s calls/res={record['calls_per_resource']:<6} "
+            f"requests={record.get('round_trips', record['api_calls'])} "
+            f"rss={record['peak_rss_mb']}MB p95={'-' if p95 is None else f'{p95:.3f}s'} "
+            f"failed={record['failed']}")
+
+
+def _numbers(kind):
+    return lambda value: [kind(v) for v in value.split(",")]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the batch snapshot/disk workflows against the in-process fake backend.")
+    parser.add_argument("--scenarios", type=lambda v: v.split(","), default=list(SCENARIOS),
+                        help=f"Comma-separated subset of {','.join(SCENARIOS)}")
+    parser.add_argument("--sizes", type=_numbers(int), default=[1, 10, 100, 500],
+                        help="Comma-separated batch sizes, e.g. 1,100,10000")
+    parser.add_argument("--concurrency", type=_numbers(int), default=[8, 32],
+                        help="Comma-separated worker counts")
+    parser.add_argument("--latency", type=_numbers(float), default=[0.0, 0.05],
+                        help="Comma-separated per-call backend latencies in simulated seconds")
+    parser.add_argument("--ready_after", type=float, default=30.0,
+                        help="Simulated seconds from insert until a resource is READY")
+    parser.add_argument("--time_scale", type=float, default=0.01,
+                        help="Real seconds per simulated second")
+    parser.add_argument("--watch", action="store_true",
+                        help="Wait through one shared ReadinessWatcher instead of per-resource waits")
+    parser.add_argument("-o", "--out", default="benchmark-results.jsonl",
+                        help="JSON lines file the results are appended to")
+    parser.add_argument("--compare", default=None,
+                        help="Earlier results file to compare this run against")
+    parser.add_argument("--in_process", action="store_true",
+                        help="Run cases in this process (faster, but peak RSS accumulates)")
+    args = parser.parse_args()
+
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+    cases = sweep(args.scenarios, args.sizes, args.concurrency, args.latency,
+                  args.ready_after, args.time_scale, args.watch)
+    records = run_benchmarks(cases, out=args.out, isolate=not args.in_process)
+    if args.compare:
+        for line in compare(args.compare, records):
+            print(line)
+    sys.exit(1 if any(r["failed"] for r in records) else 0)
@@ -0,0 +1,172 @@
+#! /usr/bin/env python
+from __future__ import annotations
+import argparse
+import logging
+import sys
+from collections import defaultdict
+from typing import Iterable
+from google.api_core import exceptions
+from google.cloud import compute_v1
+from .batch import BatchResult, run_batch, summarize
+from .clients import get_client
+from .metrics import export_at_exit
+from .utils import operation_error
+from .config import load_config
+from .watcher import FILTER_CHUNK_SIZE, ReadinessWatcher, name_filter
+
+# Bulk disk cleanup.
+#
+# Targets are (project, zone, name). Whether they exist is resolved with one
+# name-filtered disks.list per chunk of FILTER_CHUNK_SIZE names, or a
+# disks.aggregatedList when a project's targets span several zones, instead
+# of a get per disk. Missing disks and disks still attached to an instance
+# (`users`) are skipped. The rest are deleted by a worker pool, and one
+# ReadinessWatcher waits for all of them, seeing them disappear from its
+# shared list calls.
+
+DELETED = "deleted"
+MISSING = "missing"
+ATTACHED = "attached"
+
+DEFAULT_CONCURRENCY = 16
+
+Target = tuple[str, str, str]
+
+
+def target_key(target: Target) -> str:
+    return "/".join(target)
+
+
+def resolve_disks(targets: Iterable[Target], disk_client=None) -> dict[Target, compute_v1.Disk | None]:
+    """Look every target up with list calls; None for disks that don't exist."""
+    disk_client = disk_client or get_client(compute_v1.DisksClient)
+    targets = list(targets)
+    wanted: dict[str, set[tuple[str, str]]] = defaultdict(set)
+    for project, zone, name in targets:
+        wanted[project].add((zone, name))
+    found: dict[Target, compute_v1.Disk] = {}
+    for project, keys in wanted.items():
+        zones = {zone for zone, _ in keys}
+        names = sorted({name for _, name in keys})
+        for i in range(0, len(names), FILTER_CHUNK_SIZE):
+            chunk = name_filter(names[i:i + FILTER_CHUNK_SIZE])
+            if len(zones) == 1:
+                zone = next(iter(zones))
+                listed = [(zone, disk) for disk in disk_client.list(
+                    request=compute_v1.ListDisksRequest(project=project, zone=zone, filter=chunk))]
+            else:
+                request = compute_v1.AggregatedListDisksRequest(
+                    project=project, filter=chunk, return_partial_success=True)
+                # scope looks like "zones/us-central1-a"
+                listed = [(scope.rsplit("/", 1)[-1], disk)
+                          for scope, scoped_list in disk_client.aggregated_list(request=request)
+                          for disk in scoped_list.disks]
+            for zone, disk in listed:
+                if (zone, disk.name) in keys:
+                    found[(project, zone, disk.name)] = disk
+    return {target: found.get(target) for target in targets}
+
+
+def delete_disks(
+    targets: Iterable[Target],
+    concurrency: int = DEFAULT_CONCURRENCY,
+    disk_client=None,
+    watcher: ReadinessWatcher | None = None,
+    timeout: float = 300,
+    dry_run: bool = False,
+    inventory=None,
+) -> list[BatchResult]:
+    """Delete the target disks that exist and aren't attached; one BatchResult per distinct target.
+
+    A result's value is DELETED, MISSING or ATTACHED (with dry_run, DELETED
+    means it would be deleted); a failed delete carries its error.
+    """
+    targets = list(dict.fromkeys(tuple(t) for t in targets))
+    disk_client = disk_client or get_client(compute_v1.DisksClient)
+    results: dict[str, BatchResult] = {}
+    to_delete = []
+    for target, disk in resolve_disks(targets, disk_client).items():
+        key = target_key(target)
+        entry = {"project": target[0], "zone": target[1], "name": target[2]}
+        if disk is None:
+            logging.debug(f"Disk {key} not found. No action taken.")
+            results[key] = BatchResult(key, entry, value=MISSING)
+        elif disk.users:
+            logging.warning(f"Disk {key} is attached to {', '.join(disk.users)}; not deleting it")
+            results[key] = BatchResult(key, entry, value=ATTACHED)
+        elif dry_run:
+            results[key] = BatchResult(key, entry, value=DELETED)
+        else:
+            to_delete.append(entry)
+
+    own_watcher = watcher is None and bool(to_delete)
+    watcher = watcher or ReadinessWatcher(disk_client=disk_client)
+
+    def delete(entry: dict):
+        try:
+            operation = disk_client.delete(project=entry["project"], zone=entry["zone"], disk=entry["name"])
+        except exceptions.NotFound:
+            # deleted by someone else since it was listed
+            return None
+        # a delete the API rejected outright comes back as a finished, failed operation
+        error = operation_error(operation)
+        if error is not None:
+            raise error
+        # the operation is not polled; the watcher sees the disk go away
+        return operation, watcher.watch_disk_deletion(entry["project"], entry["zone"], entry["name"], timeout=timeout)
+
+    try:
+        for result in run_batch(delete, to_delete, key=lambda e: f"{e['project']}/{e['zone']}/{e['name']}",
+                                concurrency=concurrency):
+            if result.ok and result.value is None:
+                result = BatchResult(result.key, result.entry, value=MISSING, elapsed=result.elapsed)
+            elif result.ok:
+                operation, deleted = result.value
+                try:
+                    deleted.result()
+                    result = BatchResult(result.key, result.entry, value=DELETED, elapsed=result.elapsed)
+                except Exception as e:
+                    # the disk is still there: if its delete operation failed, that is the error to report
+                    error = operation_error(operation, refresh=True) or e
+                    logging.error(f"Deleting disk {result.key} failed: {error}")
+                    result = BatchResult(result.key, result.entry, error=error, elapsed=result.elapsed)
+            if result.ok and inventory is not None:
+                inventory.forget_disk(result.entry["project"], result.entry["zone"], result.entry["name"])
+            results[result.key] = result
+    finally:
+        if own_watcher:
+            watcher.stop()
+    return [results[target_key(target)] for target in targets]
+
+
+def main(args: argparse.Namespace) -> None:
+    """`cleanup`: delete the disks given by --disk or a config."""
+    logging.basicConfig(level=logging.INFO)
+    if args.metrics_out:
+        export_at_exit(args.metrics_out)
+
+    targets = []
+    for disk in args.disk:
+        zone, _, name = disk.partition("/")
+        if not zone or not name or "/" in name:
+            args.error(f"--disk {disk}: expected ZONE/NAME, e.g. us-central1-a/my-disk")
+        targets.append((args.project_id, zone, name))
+    if args.config:
+        # load_config leaves out the sections a config doesn't have
+        disks = load_config(args.config, args.project_id, sections=["disks"]).get("disks")
+        if disks is None:
+            args.error(f"--config {args.config}: config has no disks section")
+        targets += [(args.project_id, d["target_zone"], d["disk_name"]) for d in disks]
+    results = delete_disks(targets, concurrency=args.concurrency or DEFAULT_CONCURRENCY, dry_run=args.dry_run)
+    for result in results:
+        outcome = result.value if result.ok else f"failed: {result.error}"
+        if args.dry_run and result.value == DELETED:
+            outcome = "would be deleted"
+        print(f"  {result.key}: {outcome}")
+    summary = summarize(results)
+    sys.exit(1 if summary.get("failed") else 0)
+
+
+if __name__ == "__main__":
+    from . import cli
+    cli.main(["cleanup", *sys.argv[1:]])
@@ -0,0 +1,165 @@
+#! /usr/bin/env python
+from __future__ import annotations
+import argparse
+import sys
+
+# One command line for the tools: python -m snapshot_create COMMAND ...
+#
+#   snapshot create   create_snapshot.py
+#   snapshot list     list_snapshot.py
+#   disk create       create_disk_from_snapshot.py
+#   cleanup           cleanup.py
+#   validate          check a config file without calling the API
+#
+# Parsing the command line loads nothing but argparse. The module behind a
+# command, and with it google.cloud.compute_v1 and the discovery client, is
+# imported only when that command runs, so --help and `validate` answer in
+# tens of milliseconds. `python -m snapshot_create.create_snapshot ...` and the
+# other module scripts still work; they parse their arguments here too.
+
+
+def _snapshot_create(args: argparse.Namespace) -> None:
+    from .create_snapshot import main
+    main(args)
+
+
+def _snapshot_list(args: argparse.Namespace) -> None:
+    from .list_snapshot import main
+    main(args)
+
+
+def _disk_create(args: argparse.Namespace) -> None:
+    from .create_disk_from_snapshot import main
+    main(args)
+
+
+def _cleanup(args: argparse.Namespace) -> None:
+    if not (args.disk or args.config):
+        args.error("no disks given: use --disk ZONE/NAME or -c CONFIG")
+    from .cleanup import main
+    main(args)
+
+
+def _validate(args: argparse.Namespace) -> None:
+    from .config import DISKS, SNAPSHOTS, ConfigError, read_config, validate_config
+    config = read_config(args.config)
+    try:
+        validate_config(config)
+    except ConfigError as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
+    counts = [f"{section}: {len(config[section])}" for section in (SNAPSHOTS, DISKS) if section in config]
+    print(f"{args.config}: valid ({', '.join(counts) or 'no entries'})")
+
+
+def _add_run_arguments(parser: argparse.ArgumentParser, resources: str) -> None:
+    # shared by `snapshot create` and `disk create`
+    parser.add_argument("-c", "--config", required=True,
+                        help="Path to the config.yaml file")
+    parser.add_argument("-p", "--project_id",
+                        required=True, help="GCP Project ID")
+    parser.add_argument("-d", "--dry_run", action="store_true",
+                        help="Print the plan and the preflight report without creating anything.")
+    parser.add_argument("--journal", default=None,
+                        help="Journal file of this run (default: CONFIG.journal)")
+    parser.add_argument("--resume", action="store_true",
+                        help=f"Continue the run recorded in the journal: skip finished {resources}, "
+                             "re-attach to pending ones.")
+    parser.add_argument("--metrics_out", default=None,
+                        help="Write API/wait metrics here at exit (*.prom: Prometheus text, else JSON)")
+    parser.add_argument("--skip_preflight", action="store_true",
+                        help="Don't check zones, disk types and sources of every entry before creating anything")
+    parser.add_argument("--trace_out", default=None,
+                        help="Write a Chrome trace-event timeline of the run here at exit")
+    parser.add_argument("--profile", default=None,
+                        help="Write a cProfile dump here at exit, and the timeline to PROFILE.trace.json")
+    parser.add_argument("--processes", type=int, default=None,
+                        help="Split the entries into shards by target and source project and run each shard "
+                             "in its own worker process, N at a time; entries may set target_project_id")
+    parser.add_argument("--shard_by_zone", action="store_true",
+                        help="With --processes, also split the shards by zone")
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="python -m snapshot_create",
+        description="Create, list and clean up Compute Engine snapshots and disks.")
+    commands = parser.add_subparsers(dest="command", metavar="COMMAND", required=True)
+
+    snapshot = commands.add_parser("snapshot", help="Create or list snapshots").add_subparsers(
+        dest="action", metavar="ACTION", required=True)
+    create = snapshot.add_parser(
+        "create", help="Create the snapshots of a config",
+        description="Create snapshots of the disks in a create_snapshot_config.yaml.")
+    _add_run_arguments(create, "snapshots")
+    create.add_argument("--concurrency", type=int, default=None,
+                        help="Create up to N snapshots at once instead of one by one.")
+    create.add_argument("--project_concurrency", type=int, default=None,
+                        help="Max snapshots in flight per disk project (with --concurrency).")
+    create.add_argument("--zone_concurrency", type=int, default=None,
+                        help="Max snapshots in flight per zone (with --concurrency).")
+    create.add_argument("--watch", action="store_true",
+                        help="Poll all pending snapshots with one list call per tick (with --concurrency).")
+    create.set_defaults(run=_snapshot_create)
+
+    # Reference gcloud command
+    # gcloud compute snapshots list --project PROJECT_ID --filter "name=snapshot-*"
+    listing = snapshot.add_parser(
+        "list", help="Show the most recent snapshots",
+        description="Show the most recently created snapshots.")
+    listing.add_argument("-p", "--project_id",
+                         required=True, help="GCP Project ID")
+    listing.add_argument("-f", "--filter", default=None,
+                         help="snapshots.list filter expression (default: every snapshot)")
+    listing.add_argument("-k", "--top", type=int, default=1,
+                         help="Number of most recent snapshots to show")
+    listing.add_argument("--inventory", nargs="?", const=True, default=None, metavar="PATH",
+                         help="Answer name=/sourceDisk=/status= filters from the local inventory "
+                              "(refreshed incrementally; default path ~/.cache/gcp-utilities/inventory.sqlite3)")
+    listing.set_defaults(run=_snapshot_list)
+
+    disk = commands.add_parser("disk", help="Create disks from snapshots").add_subparsers(
+        dest="action", metavar="ACTION", required=True)
+    create = disk.add_parser(
+        "create", help="Create the disks of a config",
+        description="Create disks from the snapshots in a create_disk_config.yaml.")
+    _add_run_arguments(create, "disks")
+    create.add_argument("--bulk", action="store_true",
+                        help="Insert and poll the disks with batched HTTP requests instead of one call per disk")
+    create.add_argument("--batch_size", type=int, default=None,
+                        help="Calls per batched HTTP request with --bulk (default 100, at most 1000)")
+    create.set_defaults(run=_disk_create)
+
+    cleanup = commands.add_parser(
+        "cleanup", help="Delete disks",
+        description="Delete many disks at once, skipping missing and attached ones.")
+    cleanup.add_argument("-p", "--project_id", required=True,
+                         help="GCP Project ID the disks are in")
+    cleanup.add_argument("-c", "--config", default=None,
+                         help="create_disk_config.yaml whose disks are deleted")
+    cleanup.add_argument("--disk", action="append", default=[],
+                         help="ZONE/NAME of a disk to delete; repeatable")
+    cleanup.add_argument("-d", "--dry_run", action="store_true",
+                         help="Only show what would be deleted")
+    cleanup.add_argument("-n", "--concurrency", type=int, default=None,
+                         help="Disks deleted in parallel (default 16)")
+    cleanup.add_argument("--metrics_out", default=None,
+                         help="Write API metrics here at exit (*.prom: Prometheus text, else JSON)")
+    cleanup.set_defaults(run=_cleanup, error=cleanup.error)
+
+    validate = commands.add_parser(
+        "validate", help="Check a config file without calling the API",
+        description="Check every entry of a config file against the schema. Selectors are not expanded.")
+    validate.add_argument("-c", "--config", required=True,
+                          help="Path to a create_disk_config.yaml or create_snapshot_config.yaml file")
+    validate.set_defaults(run=_validate)
+    return parser
+
+
+def main(argv: list[str] | None = None) -> None:
+    args = build_parser().parse_args(argv)
+    args.run(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+#! /usr/bin/env python
+from __future__ import annotations
+from typing import Any
+from googleapiclient.discovery import build_from_document
+from googleapiclient.http import HttpRequest
+import logging
+import os
+import threading
+import time
+from .discovery import load_document
+from .metrics import response_hook, timed_call
+from .ratelimit import GuardedAdapter, guarded_call, project_of
+from .trace import span, trace_credential_refresh
+
+# Shared Compute clients.
+#
+# Creating a client repeats credential discovery and sets up a new HTTP
+# session, so every helper asks this module for its client instead. compute_v1
+# clients are safe to share between threads and are cached per
+# (client class, credentials, quota project). Discovery `service` objects sit
+# on httplib2, which is not thread-safe, so those are cached per thread and
+# built from the locally cached discovery document rather than a download.
+#
+# use_backend() (or GCP_UTILITIES_FAKE_BACKEND) swaps both kinds for the
+# in-process fake from fake_compute.py, for offline runs and load tests.
+
+# connections kept alive per compute_v1 client, sized for batch concurrency
+POOL_SIZE = 32
+
+_lock = threading.Lock()
+_clients: dict[tuple, Any] = {}
+_local = threading.local()
+# bumped by clear_cache() so other threads drop their services too
+_generation = 0
+# fake_compute.FakeComputeBackend in use instead of the real API, if any
+_backend: Any = None
+_backend_checked = False
+
+
+def _widen_connection_pool(client: Any) -> None:
+    # the REST transport keeps a requests session with a pool of 10 by default;
+    # with more workers than that, connections get dropped and re-handshaked.
+    # The adapter also rate limits and retries every request, see ratelimit.py
+    session = getattr(getattr(client, "_transport", None), "_session", None)
+    if session is not None and hasattr(session, "mount"):
+        session.mount("https://", GuardedAdapter(pool_connections=POOL_SIZE,
+                                                 pool_maxsize=POOL_SIZE))
+
+
+def use_backend(backend: Any) -> None:
+    """Serve every client and service from a fake_compute backend; None goes back to the real API."""
+    global _backend, _backend_checked
+    _backend = backend
+    _backend_checked = True
+    clear_cache()
+
+
+def get_backend() -> Any:
+    global _backend, _backend_checked
+    if not _backend_checked:
+        with _lock:
+            spec = os.environ.get("GCP_UTILITIES_FAKE_BACKEND")
+            if not _backend_checked and spec:
+                from .fake_compute import backend_from_spec
+                logging.info("Using the in-process fake Compute backend")
+                _backend = backend_from_spec(spec)
+            _backend_checked = True
+    return _backend
+
+
+def sleep(seconds: float) -> None:
+    """time.sleep, or the fake backend's scaled sleep while one is in use (so benchmarks don't wait in real time)."""
+    backend = get_backend()
+    if backend is not None:
+        backend.sleep(seconds)
+    else:
+        time.sleep(seconds)
+
+
+def real_seconds(seconds: float) -> float:
+    """How long `seconds` on the backend's clock last in real time; for waits that can't go through sleep()."""
+    backend = get_backend()
+    return seconds * backend.time_scale if backend is not None else seconds
+
+
+def monotonic() -> float:
+    """time.monotonic, or the fake backend's simulated clock; poll deadlines are kept on the same clock as sleep()."""
+    backend = get_backend()
+    return backend.now() if backend is not None else time.monotonic()
+
+
+def _instrument_transport(client: Any) -> None:
+    # every REST request of the client, operation polling included, is timed by metrics.py
+    session = getattr(getattr(client, "_transport", None), "_session", None)
+    hooks = getattr(session, "hooks", None)
+    if isinstance(hooks, dict):
+        hooks.setdefault("response", []).append(response_hook)
+    trace_credential_refresh(getattr(getattr(client, "_transport", None), "_credentials", None))
+
+
+class InstrumentedRequest(HttpRequest):
+    """HttpRequest that reports its latency and HTTP errors to metrics.py and runs under ratelimit.py."""
+
+    def execute(self, http=None, num_retries=0):
+        method = self.methodId.removeprefix("compute.")
+
+        def attempt():
+            with timed_call(method):
+                return super(InstrumentedRequest, self).execute(http=http, num_retries=num_retries)
+
+        return guarded_call(method, project_of(self.uri), attempt)
+
+
+def get_client(client_class: type, credentials: Any = None, quota_project_id: str | None = None) -> Any:
+    """Return the shared instance of a compute_v1 client class, e.g. get_client(compute_v1.DisksClient)."""
+    key = (client_class, credentials, quota_project_id)
+    client = _clients.get(key)
+    if client is not None:
+        return client
+    backend = get_backend()
+    with _lock:
+        if key not in _clients and backend is not None:
+            _clients[key] = backend.client(client_class.__name__)
+        if key not in _clients:
+            kwargs = {}
+            if credentials is not None:
+                kwargs["credentials"] = credentials
+            if quota_project_id is not None:
+                kwargs["client_options"] = {
+                    "quota_project_id": quota_project_id}
+            logging.debug(
+                f"Creating shared {getattr(client_class, '__name__', client_class)}")
+            with span("client init", "setup", client=getattr(client_class, "__name__", str(client_class))):
+                client = client_class(**kwargs)
+            _widen_connection_pool(client)
+            _instrument_transport(client)
+            _clients[key] = client
+        return _clients[key]
+
+
+def get_compute_service(credentials: Any = None) -> Any:
+    """Return this thread's discovery-based compute v1 service, building it on first use."""
+    services = getattr(_local, "services", None)
+    if services is None or _local.generation != _generation:
+        services = _local.services = {}
+        _local.generation = _generation
+    if credentials not in services and get_backend() is not None:
+        services[credentials] = get_backend().service()
+    if credentials not in services:
+        kwargs = {}
+        if credentials is not None:
+            kwargs["credentials"] = credentials
+        # the discovery document is cached on disk and parsed once per process, see discovery.py
+        with span("discovery build", "setup"):
+            services[credentials] = build_from_document(
+                load_document(), requestBuilder=InstrumentedRequest, **kwargs)
+        trace_credential_refresh(getattr(getattr(services[credentials], "_http", None), "credentials", None))
+    return services[credentials]
+
+
+def clear_cache() -> None:
+    # drop every cached client, e.g. after credentials change or between tests
+    global _generation
+    with _lock:
+        _clients.clear()
+        _generation += 1
@@ -0,0 +1,277 @@
+#! /usr/bin/env python
+from __future__ import annotations
+import argparse
+import fnmatch
+import logging
+import re
+import string
+import sys
+from collections import defaultdict
+from typing import Any, Iterable
+import yaml
+
+# Config files with selectors instead of one hand-written entry per disk.
+#
+# Next to the usual entries, `snapshots` and `disks` may hold selector
+# entries that pick the disks to work on:
+#   snapshots:
+#     - select:
+#         project: nodal-spot-453817-i7   # default: -p (snapshots), src_project_id (disks)
+#         zone: "us-*"                    # fnmatch pattern
+#         labels: {tier: prod}            # "*" matches any value of the label
+#         name_regex: "^web-\\d+$"        # re.search on the disk name
+#         disk_type: pd-ssd
+#       src_snapshot_name: "{disk_name}-nightly"
+# Fields of a selector entry are templates over the selected disk: {disk_name},
+# {zone}, {disk_type}, {disk_size_gb} and {project}. A disk selector entry needs
+# src_project_id and src_snapshot_name; disk_name defaults to "{disk_name}",
+# target_zone to "{zone}", and type and size to the source disk's.
+#
+# The whole file is validated before anything is listed, with every problem
+# reported at once. Selectors are then expanded with one paginated
+# disks.aggregatedList per project, however many selectors name that project.
+# YAML is parsed with the libyaml C loader when PyYAML has it. Reading and
+# validating a config loads no Google library; the API stack is imported when a
+# selector is expanded.
+
+SNAPSHOTS = "snapshots"
+DISKS = "disks"
+
+# the fields of a plain entry, all required, and their types
+ENTRY_FIELDS: dict[str, dict[str, type]] = {
+    SNAPSHOTS: {"target_zone": str, "disk_name": str, "disk_type": str, "disk_size_gb": int,
+                "disk_project_id": str, "src_snapshot_name": str},
+    DISKS: {"target_zone": str, "disk_name": str, "disk_type": str, "disk_size_gb": int,
+            "src_project_id": str, "src_snapshot_name": str},
+}
+# optional in both sections: the project the snapshot or disk is created in,
+# -p when left out; entries for several projects run sharded (shard.py)
+TARGET_PROJECT = "target_project_id"
+OPTIONAL_FIELDS: dict[str, type] = {TARGET_PROJECT: str}
+# fields a selector entry can't do without
+SELECTOR_REQUIRED = {
+    SNAPSHOTS: ("src_snapshot_name",),
+    DISKS: ("src_project_id", "src_snapshot_name"),
+}
+SELECT_FIELDS: dict[str, type] = {"project": str, "zone": str, "labels": dict, "name_regex": str, "disk_type": str}
+
+# what selector entries default to, per section
+_DEFAULTS = {
+    SNAPSHOTS: {"target_zone": "{zone}", "disk_name": "{disk_name}", "disk_type": "{disk_type}",
+                "disk_size_gb": "{disk_size_gb}", "disk_project_id": "{project}"},
+    DISKS: {"target_zone": "{zone}", "disk_name": "{disk_name}", "disk_type": "{disk_type}",
+            "disk_size_gb": "{disk_size_gb}"},
+}
+_PLACEHOLDERS = {"disk_name", "zone", "disk_type", "disk_size_gb", "project"}
+
+
+# libyaml's loader parses large configs many times faster than the pure-Python one
+_YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+
+def read_config(file_path: str) -> dict:
+    # Read configuration from config.yaml
+    with open(file_path, 'r') as file:
+        return yaml.load(file, Loader=_YAML_LOADER)
+
+
+class ConfigError(ValueError):
+    """The config file doesn't match the schema; `problems` lists every issue found."""
+
+    def __init__(self, problems: list[str]):
+        super().__init__("Invalid config:\n  " + "\n  ".join(problems))
+        self.problems = problems
+
+
+def _check_type(where: str, value: Any, expected: type, problems: list[str]) -> None:
+    # bool is an int to isinstance, but never a disk size
+    if not isinstance(value, expected) or (expected is int and isinstance(value, bool)):
+        problems.append(f"{where}: expected {expected.__name__}, got {type(value).__name__}")
+
+
+def _check_template(where: str, value: str, problems: list[str]) -> None:
+    try:
+        unknown = {name for _, name, _, _ in string.Formatter().parse(value) if name} - _PLACEHOLDERS
+    except ValueError as e:
+        problems.append(f"{where}: {e}")
+        return
+    if unknown:
+        problems.append(f"{where}: unknown placeholder(s) {', '.join(sorted(unknown))}")
+
+
+def _check_selector_entry(section: str, where: str, entry: dict, problems: list[str]) -> None:
+    select = entry["select"]
+    if not isinstance(select, dict):
+        problems.append(f"{where}.select: expected dict, got {type(select).__name__}")
+        return
+    for key, value in select.items():
+        if key not in SELECT_FIELDS:
+            problems.append(f"{where}.select: unknown field {key}")
+            continue
+        _check_type(f"{where}.select.{key}", value, SELECT_FIELDS[key], problems)
+    if isinstance(select.get("labels"), dict):
+        for key, value in select["labels"].items():
+            if not isinstance(value, str):
+                problems.append(f"{where}.select.labels.{key}: expected str, got {type(value).__name__}")
+    if isinstance(select.get("name_regex"), str):
+        try:
+            re.compile(select["name_regex"])
+        except re.error as e:
+            problems.append(f"{where}.select.name_regex: {e}")
+    fields = {**ENTRY_FIELDS[section], **OPTIONAL_FIELDS}
+    for key, value in entry.items():
+        if key == "select":
+            continue
+        if key not in fields:
+            problems.append(f"{where}: unknown field {key}")
+        elif isinstance(value, str):
+            _check_template(f"{where}.{key}", value, problems)
+        else:
+            _check_type(f"{where}.{key}", value, fields[key], problems)
+    for key in SELECTOR_REQUIRED[section]:
+        if key not in entry:
+            problems.append(f"{where}: missing {key}")
+
+
+def _check_entry(section: str, where: str, entry: dict, problems: list[str]) -> None:
+    fields = ENTRY_FIELDS[section]
+    for key in entry.keys() - fields.keys() - OPTIONAL_FIELDS.keys():
+        problems.append(f"{where}: unknown field {key}")
+    for key, expected in fields.items():
+        if key not in entry:
+            problems.append(f"{where}: missing {key}")
+        else:
+            _check_type(f"{where}.{key}", entry[key], expected, problems)
+    for key, expected in OPTIONAL_FIELDS.items():
+        if key in entry:
+            _check_type(f"{where}.{key}", entry[key], expected, problems)
+
+
+def validate_config(config: Any, sections: Iterable[str] = (SNAPSHOTS, DISKS), project_id: str | None = None) -> None:
+    """Check the `snapshots` / `disks` sections present in the config; raises ConfigError.
+
+    With `project_id`, every entry must be created in that project: a
+    target_project_id naming another one is only allowed in a sharded run.
+    """
+    if not isinstance(config, dict):
+        raise ConfigError([f"expected a mapping at the top level, got {type(config).__name__}"])
+    problems: list[str] = []
+    for section in sections:
+        if section not in config:
+            continue
+        entries = config[section]
+        if not isinstance(entries, list):
+            problems.append(f"{section}: expected list, got {type(entries).__name__}")
+            continue
+        for i, entry in enumerate(entries):
+            where = f"{section}[{i}]"
+            if not isinstance(entry, dict):
+                problems.append(f"{where}: expected dict, got {type(entry).__name__}")
+            elif "select" in entry:
+                _check_selector_entry(section, where, entry, problems)
+            else:
+                _check_entry(section, where, entry, problems)
+            if project_id and isinstance(entry, dict) and entry.get(TARGET_PROJECT, project_id) != project_id:
+                problems.append(f"{where}: target_project_id {entry[TARGET_PROJECT]} is not {project_id}; "
+                                "entries for other projects need a sharded run (--processes)")
+    if problems:
+        raise ConfigError(problems)
+
+
+def selects(select: dict, zone: str, disk: dict) -> bool:
+    if "zone" in select and not fnmatch.fnmatchcase(zone, select["zone"]):
+        return False
+    if "name_regex" in select and not re.search(select["name_regex"], disk["name"]):
+        return False
+    if "disk_type" in select and disk.get("type", "").rsplit("/", 1)[-1] != select["disk_type"]:
+        return False
+    labels = disk.get("labels") or {}
+    return all(key in labels and value in ("*", labels[key]) for key, value in select.get("labels", {}).items())
+
+
+def _expand_one(section: str, entry: dict, project: str, zone: str, disk: dict) -> dict:
+    values = {
+        "disk_name": disk["name"],
+        "zone": zone,
+        "disk_type": disk.get("type", "").rsplit("/", 1)[-1],
+        "disk_size_gb": disk.get("sizeGb", ""),
+        "project": project,
+    }
+    expanded = {}
+    for key, value in {**_DEFAULTS[section], **entry}.items():
+        if key == "select":
+            continue
+        if isinstance(value, str):
+            value = value.format(**values)
+        expanded[key] = int(value) if ENTRY_FIELDS[section].get(key) is int else value
+    return expanded
+
+
+def expand_entries(section: str, entries: list[dict], default_project: str | None = None,
+                   service=None) -> list[dict]:
+    """Replace every selector entry with one plain entry per disk it selects, in listing order.
+
+    The config must have been validated. Disks are listed once per project.
+    """
+    selectors: dict[str, list[int]] = defaultdict(list)
+    for i, entry in enumerate(entries):
+        if "select" in entry:
+            select = entry["select"]
+            # a disk config restores disks from snapshots, which live next to their source disks
+            project = select.get("project") or (entry.get("src_project_id") if section == DISKS else None) \
+                or default_project
+            if not project:
+                raise ConfigError([f"{section}[{i}].select: no project to select disks in"])
+            selectors[project].append(i)
+    if not selectors:
+        return list(entries)
+    from .inventory import iter_disks
+
+    matched: dict[int, list[dict]] = defaultdict(list)
+    for project, indexes in selectors.items():
+        for zone, disk in iter_disks(project, service=service):
+            for i in indexes:
+                if selects(entries[i]["select"], zone, disk):
+                    matched[i].append(_expand_one(section, entries[i], project, zone, disk))
+    expanded = []
+    for i, entry in enumerate(entries):
+        if "select" not in entry:
+            expanded.append(entry)
+            continue
+        if not matched[i]:
+            logging.warning(f"{section}[{i}]: selector {entry['select']} matches no disk")
+        expanded.extend(matched[i])
+    logging.info(f"{section}: {len(entries)} config entries expanded to {len(expanded)}")
+    return expanded
+
+
+def load_config(path: str, project_id: str | None = None, sections: Iterable[str] = (SNAPSHOTS, DISKS),
+                service=None, sharded: bool = False) -> dict:
+    """read_config() + validate_config() + expand_entries() for every section present.
+
+    `project_id` is the default project of snapshot selectors, and the only
+    project entries may be created in unless the run is `sharded`.
+    """
+    config = read_config(path)
+    sections = [section for section in sections if section in (config or {})]
+    validate_config(config, sections, None if sharded else project_id)
+    for section in sections:
+        config[section] = expand_entries(section, config[section], project_id, service=service)
+    return config
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(
+        description="Validate a config file and print it with its selectors expanded.")
+    parser.add_argument("-c", "--config", required=True,
+                        help="Path to a create_disk_config.yaml or create_snapshot_config.yaml file")
+    parser.add_argument("-p", "--project_id", default=None,
+                        help="Default project of snapshot selectors")
+    args = parser.parse_args()
+    try:
+        config = load_config(args.config, args.project_id)
+    except ConfigError as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
+    yaml.dump(config, sys.stdout, Dumper=getattr(yaml, "CSafeDumper", yaml.SafeDumper), sort_keys=False)
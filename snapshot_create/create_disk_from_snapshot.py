@@ -1,8 +1,22 @@
 #! /usr/bin/env python
 from __future__ import annotations
 import argparse
-from googleapiclient.discovery import build
-from utils import wait_for_disk_creation, read_config
+import sys
+import time
+from google.api_core.retry import exponential_sleep_generator
+from .utils import POLL_INITIAL, POLL_MAXIMUM, POLL_MULTIPLIER, wait_for_disk_creation
+from .batch import BatchResult
+from . import clients
+from .clients import get_compute_service
+from .config import load_config
+from .http_batch import BATCH_SIZE, BatchCall, execute_batched
+from .journal import DISKS, FAILED, OPERATION, READY, SUBMITTED, Journal, entries_to_run
+from .metrics import export_at_exit, record_ready
+from .trace import on_track, span, trace_at_exit
+from .preflight import format_problems, preflight_disks
+from .plan import disk_key, plan_disks
+from .records import DiskRecord, get_fields
+from googleapiclient.errors import HttpError
 import logging
 
 #  By default, the logging module in Python logs
@@ -10,6 +24,19 @@ import logging
 logging.basicConfig(level=logging.DEBUG)
 
 
+def disk_body(src_project_id: str, target_zone: str, disk_name: str, disk_type: str, disk_size_gb: int,
+              target_project_id: str, src_snapshot_name: str) -> dict:
+    # Specify sourceSnapshot url to create disk from snapshot
+    return {
+        "name": disk_name,
+        "sizeGb": disk_size_gb,
+        "zone": target_zone,
+        "sourceSnapshot": f"projects/{src_project_id}/global/snapshots/{src_snapshot_name}",
+        "type": f"projects/{target_project_id}/zones/{target_zone}/diskTypes/{disk_type}",
+    }
+
+
+@on_track("disk", "disk_name")
 def create_disk_from_snapshot(
     src_project_id: str,
     target_zone: str,
@@ -18,55 +45,242 @@ def create_disk_from_snapshot(
     disk_size_gb: int,
     target_project_id: str,
     src_snapshot_name: str,
+    raise_on_error: bool = False,
+    service=None,
+    wait: bool = False,
+    watcher=None,
+    journal: Journal | None = None,
 ):
     # Code using compute v1 service
     try:
-        service = build('compute', 'v1', cache_discovery=False)
-        # Specify sourceSnapshot url to create disk from snapshot
-        disk_body = {
-            "name": disk_name,
-            "sizeGb": disk_size_gb,
-            "zone": target_zone,
-            "sourceSnapshot": f"projects/{src_project_id}/global/snapshots/{src_snapshot_name}",
-            "type": f"projects/{target_project_id}/zones/{target_zone}/diskTypes/{disk_type}",
-        }
+        # shared per-thread discovery service unless one is injected
+        service = service or get_compute_service()
+        body = disk_body(src_project_id, target_zone, disk_name, disk_type, disk_size_gb,
+                         target_project_id, src_snapshot_name)
         logging.debug(
             f"Creating disk {disk_name} in {target_zone} from snapshot {src_snapshot_name} in project {src_project_id} 🟨 "
         )
-        # Create disk
-        request = service.disks().insert(project=target_project_id,
-                                         zone=target_zone, body=disk_body)
-        # Execute operation
-        request.execute()
+        key = f"{target_zone}/{disk_name}"
+        # a resumed run re-attaches to the zone operation of a disk inserted before the interruption
+        pending = journal.pending(DISKS, key) if journal else None
+        if pending and _disk_exists(service, target_project_id, target_zone, disk_name):
+            logging.info(f"Resuming disk {disk_name} from the journal")
+            operation = {"name": pending["operation"]} if pending.get("operation") else None
+            submitted_at = None
+        else:
+            if journal:
+                journal.record(DISKS, key, SUBMITTED, project=target_project_id)
+            # Create disk
+            request = service.disks().insert(project=target_project_id,
+                                             zone=target_zone, body=body)
+            # Execute operation
+            submitted_at = time.monotonic()
+            operation = request.execute()
+            if journal:
+                journal.record(DISKS, key, OPERATION, operation=operation["name"])
+        # wait=True blocks on the returned zone operation until the disk is READY
+        if wait and not wait_for_disk_creation(
+                project_id=target_project_id,
+                zone=target_zone,
+                disk_name=disk_name,
+                operation=operation,
+                service=service,
+                watcher=watcher):
+            raise TimeoutError(f"Disk {disk_name} did not become ready")
         logging.debug(
             f"Disk {disk_name} created in {target_zone} from snapshot {src_snapshot_name} in project {src_project_id} ✅"
         )
+        # without wait the disk is only submitted; the journal keeps it pending
+        if wait and submitted_at is not None:
+            record_ready("disk", time.monotonic() - submitted_at)
+        if journal and wait:
+            journal.record(DISKS, key, READY)
         return service.disks().get(project=target_project_id, zone=target_zone, disk=disk_name)
 
     except Exception as e:
         logging.error(f"Error creating disk: {e}")
+        if journal:
+            journal.record(DISKS, f"{target_zone}/{disk_name}", FAILED, error=str(e))
+        if raise_on_error:
+            raise
 
 
-if __name__ == "__main__":
-    # Parse command-line arguments
-    parser = argparse.ArgumentParser(
-        description="Create a disk from a snapshot.")
-    parser.add_argument("-c", "--config", required=True,
-                        help="Path to the config.yaml file")
-    parser.add_argument("-p", "--project_id",
-                        required=True, help="GCP Project ID")
-    parser.add_argument("-d", "--dry_run", action="store_true",
-
-                        help="Perform a dry run without creating the disk.")
-    args = parser.parse_args()
+def _not_found(error: BaseException) -> bool:
+    return isinstance(error, HttpError) and error.resp.status == 404
+
+
+def _disk_exists(service, project_id: str, zone: str, disk_name: str) -> bool:
+    try:
+        service.disks().get(project=project_id, zone=zone, disk=disk_name, fields="name").execute()
+        return True
+    except HttpError as e:
+        if _not_found(e):
+            return False
+        raise
+
+
+def create_disks_from_snapshots(
+    target_project_id: str,
+    entries: list[dict],
+    service=None,
+    wait: bool = True,
+    batch_size: int = BATCH_SIZE,
+    timeout: int = 300,
+    journal: Journal | None = None,
+) -> list[BatchResult]:
+    """Create the disks of many config entries with batched HTTP requests.
+
+    The disks.insert calls go out `batch_size` per request; with `wait` the
+    new disks are then polled with batched disks.get until each one is READY
+    or FAILED, or `timeout` runs out. Returns one BatchResult per entry, in
+    order; its value is the disk (with wait) or the insert operation. The
+    elapsed time of a disk inserted and seen READY by this call runs from
+    its insert until the polling round that found it READY.
+    """
+    service = service or get_compute_service()
+    results = {disk_key(entry): BatchResult(disk_key(entry), entry) for entry in entries}
+    submitted_at: dict[str, float] = {}
+
+    def get_calls(keys):
+        return [BatchCall(key, "disks.get", target_project_id,
+                          service.disks().get(project=target_project_id, zone=results[key].entry["target_zone"],
+                                              disk=results[key].entry["disk_name"], fields=get_fields(DiskRecord)),
+                          results[key].entry)
+                for key in keys]
+
+    # a resumed run only inserts the pending disks that never got created
+    pending = [key for key in results if journal and journal.pending(DISKS, key)]
+    to_insert = [key for key in results if key not in pending]
+    for result in execute_batched(service, get_calls(pending), batch_size):
+        if result.ok:
+            logging.info(f"Resuming disk {result.key} from the journal")
+        elif _not_found(result.error):
+            to_insert.append(result.key)
+        else:
+            results[result.key] = result
+            if journal:
+                journal.record(DISKS, result.key, FAILED, error=str(result.error))
+
+    calls = []
+    for key in to_insert:
+        entry = results[key].entry
+        if journal:
+            journal.record(DISKS, key, SUBMITTED, project=target_project_id)
+        body = disk_body(entry["src_project_id"], entry["target_zone"], entry["disk_name"], entry["disk_type"],
+                         entry["disk_size_gb"], target_project_id, entry["src_snapshot_name"])
+        calls.append(BatchCall(key, "disks.insert", target_project_id,
+                               service.disks().insert(project=target_project_id, zone=entry["target_zone"],
+                                                      body=body), entry))
+    start = time.monotonic()
+    for result in execute_batched(service, calls, batch_size):
+        results[result.key] = result
+        if not result.ok:
+            logging.error(f"Error creating disk {result.key}: {result.error}")
+            if journal:
+                journal.record(DISKS, result.key, FAILED, error=str(result.error))
+            continue
+        submitted_at[result.key] = start
+        if journal:
+            journal.record(DISKS, result.key, OPERATION, operation=result.value["name"])
+
+    if wait:
+        _wait_for_disks(service, results, get_calls, batch_size, timeout, submitted_at, journal)
+    return [results[disk_key(entry)] for entry in entries]
+
+
+def _wait_for_disks(service, results: dict[str, BatchResult], get_calls, batch_size: int, timeout: int,
+                    submitted_at: dict[str, float], journal: Journal | None) -> None:
+    # poll every disk still in flight with one batched disks.get round per interval
+    deadline = clients.monotonic() + timeout
+    delays = exponential_sleep_generator(POLL_INITIAL, POLL_MAXIMUM, POLL_MULTIPLIER)
+    waiting = [key for key, result in results.items() if result.ok]
+    while waiting:
+        still_waiting = []
+        for result in execute_batched(service, get_calls(waiting), batch_size):
+            status = result.value["status"] if result.ok else None
+            if status == "READY":
+                if result.key in submitted_at:
+                    elapsed = time.monotonic() - submitted_at[result.key]
+                    record_ready("disk", elapsed)
+                    result = BatchResult(result.key, result.entry, value=result.value, elapsed=elapsed)
+                results[result.key] = result
+                if journal:
+                    journal.record(DISKS, result.key, READY)
+            elif status == "FAILED" or (not result.ok and not _not_found(result.error)):
+                # right after the insert a disk may not be visible yet; any other error is final
+                error = result.error or RuntimeError(f"Disk {result.key} failed")
+                results[result.key] = BatchResult(result.key, result.entry, error=error)
+                logging.error(f"Disk {result.key} did not become ready: {error}")
+                if journal:
+                    journal.record(DISKS, result.key, FAILED, error=str(error))
+            else:
+                still_waiting.append(result.key)
+        waiting = still_waiting
+        if not waiting:
+            break
+        delay = min(next(delays), deadline - clients.monotonic())
+        if delay <= 0:
+            break
+        logging.info(f"Waiting for {len(waiting)} disks to be ready...")
+        clients.sleep(delay)
+    for key in waiting:
+        error = TimeoutError(f"Disk {key} did not become ready")
+        results[key] = BatchResult(key, results[key].entry, error=error)
+        logging.error(str(error))
+        if journal:
+            journal.record(DISKS, key, FAILED, error=str(error))
+
+
+def main(args: argparse.Namespace) -> None:
+    """`disk create`: plan, preflight and create the disks of a config."""
+    if args.metrics_out:
+        export_at_exit(args.metrics_out)
+    if args.trace_out or args.profile:
+        trace_at_exit(args.trace_out, args.profile)
 
     dry_run = args.dry_run
     target_project_id = args.project_id
     configs = args.config
 
     # Example usage
-    configs = read_config(configs)
-    for disk in configs["disks"]:
+    with span("config load"):
+        configs = load_config(configs, target_project_id, sharded=bool(args.processes))
+    if args.processes:
+        # every project shard plans, checks and creates (batched) in a worker process of its own
+        from .shard import ShardOptions, format_report, run_sharded
+        reports = run_sharded("disks", target_project_id, configs["disks"], args.processes, args.shard_by_zone,
+                              ShardOptions(dry_run=dry_run, skip_preflight=args.skip_preflight,
+                                           journal=args.journal or f"{args.config}.journal", resume=args.resume,
+                                           batch_size=args.batch_size))
+        print(format_report("disks", reports))
+        sys.exit(0 if all(report.ok for report in reports) else 1)
+    # compare the config with the disks that already exist; only missing ones are created
+    with span("plan"):
+        plan = plan_disks(target_project_id, configs["disks"])
+    print(plan.format())
+    # every entry is checked before the first disk is created
+    if not args.skip_preflight:
+        with span("preflight"):
+            problems = preflight_disks(target_project_id, plan.to_create)
+        print(format_problems(problems))
+        if problems:
+            sys.exit(1)
+    # a dry run only reads the journal (when resuming) and never starts a new one
+    journal = Journal(args.journal or f"{args.config}.journal",
+                      resume=args.resume) if args.resume or not dry_run else None
+    entries = entries_to_run(plan, journal)
+    failed = 0
+    if args.bulk and not dry_run:
+        for result in create_disks_from_snapshots(target_project_id, entries,
+                                                  batch_size=args.batch_size or BATCH_SIZE, journal=journal):
+            if result.ok:
+                print(f"Disk: {result.entry['disk_name']} created from snapshot "
+                      f"{result.entry['src_snapshot_name']} in project {target_project_id}.")
+            else:
+                failed += 1
+        # everything went out in batches; nothing is left for the one-by-one loop
+        entries = []
+    for disk in entries:
         target_zone = disk["target_zone"]
         disk_name = disk["disk_name"]
         disk_type = disk["disk_type"]
@@ -74,30 +288,32 @@ if __name__ == "__main__":
         src_project_id = disk["src_project_id"]
         src_snapshot_name = disk["src_snapshot_name"]
         if dry_run:
-            print(
-                f"Disk: {disk_name} created from snapshot {src_snapshot_name} in project {target_project_id}.")
-        else:
             print(
                 f"Disk: {disk_name} would be created from snapshot {src_snapshot_name} in project {target_project_id}.")
-            # delete_disk_if_exists(
-            #     project_id=src_project_id,
-            #     zone=target_zone,
-            #     disk_name=disk_name
-            # )
-            create_disk_from_snapshot(
-                src_project_id=src_project_id,
-                target_zone=target_zone,
-                disk_name=disk_name,
-                disk_type=disk_type,
-                disk_size_gb=disk_size_gb,
-                target_project_id=target_project_id,
-                src_snapshot_name=src_snapshot_name
-            )
-
-            # wait for disk creation
-            wait_for_disk_creation(
-                project_id=target_project_id,
-                zone=target_zone,
-                disk_name=disk_name,
-                operation=None
-            )
+            continue
+        created = create_disk_from_snapshot(
+            src_project_id=src_project_id,
+            target_zone=target_zone,
+            disk_name=disk_name,
+            disk_type=disk_type,
+            disk_size_gb=disk_size_gb,
+            target_project_id=target_project_id,
+            src_snapshot_name=src_snapshot_name,
+            # wait for disk creation on the insert operation
+            wait=True,
+            journal=journal
+        )
+        # errors are logged (and journaled) by create_disk_from_snapshot; go on with the next disk
+        if created is None:
+            failed += 1
+            continue
+        print(
+            f"Disk: {disk_name} created from snapshot {src_snapshot_name} in project {target_project_id}.")
+    # conflicting entries are never touched, but the run is not a success either
+    if failed or plan.has_conflicts:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    from . import cli
+    cli.main(["disk", "create", *sys.argv[1:]])
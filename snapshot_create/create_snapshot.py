@@ -3,10 +3,21 @@ from __future__ import annotations
 import argparse
 import logging
 import sys
-from .utils import wait_for_snapshot_creation, read_config
+import time
+from .config import load_config
+from .utils import wait_for_snapshot_creation
+from .batch import BatchResult, run_batch, summarize
+from .clients import get_client
+from .journal import FAILED, OPERATION, READY, SNAPSHOTS, SUBMITTED, Journal, entries_to_run
+from .metrics import export_at_exit, record_ready
+from .trace import on_track, span, trace_at_exit
+from .preflight import format_problems, preflight_snapshots
+from .plan import plan_snapshots
+from .records import field_mask
+from .watcher import ReadinessWatcher
+from google.api_core.exceptions import NotFound
 from google.api_core.extended_operation import ExtendedOperation
 from google.cloud import compute_v1
-from pprint import pprint as pp
 # 1. first find the disk's source project
 # 2. create a snapshot object, link .sourcedisk the it with the disk
 # 3. then use snapshotclient.insert the disk in
@@ -15,6 +26,7 @@ from pprint import pprint as pp
 logging.basicConfig(level=logging.DEBUG)
 
 
+@on_track("snapshot", "snapshot_name")
 def create_snapshot(
     target_project_id: str,
     disk_name: str,
@@ -23,6 +35,12 @@ def create_snapshot(
     region: str | None = None,
     location: str | None = None,
     disk_project_id: str | None = None,
+    exit_on_error: bool = True,
+    disk_client: compute_v1.DisksClient | None = None,
+    region_disk_client: compute_v1.RegionDisksClient | None = None,
+    snapshot_client: compute_v1.SnapshotsClient | None = None,
+    watcher: ReadinessWatcher | None = None,
+    journal: Journal | None = None,
 ) -> compute_v1.Snapshot:
 
     if zone is None and region is None:
@@ -37,44 +55,124 @@ def create_snapshot(
     if disk_project_id is None:
         disk_project_id = target_project_id
     try:
-        # get zonal disk
-        if zone is not None:
-            # disk client to query the disk client
-            disk_client = compute_v1.DisksClient()
-            disk = disk_client.get(project=disk_project_id,
-                                   zone=zone, disk=disk_name)
+        snapshot_client = snapshot_client or get_client(
+            compute_v1.SnapshotsClient)
+        # a resumed run re-attaches to a snapshot whose insert went through before the interruption
+        pending = journal.pending(SNAPSHOTS, snapshot_name) if journal else None
+        if pending and _snapshot_exists(snapshot_client, target_project_id, snapshot_name):
+            logging.info(f"Resuming snapshot {snapshot_name} from the journal")
+            operation = None
+            submitted_at = None
         else:
-            # get regional disk
-            regio_disk_client = compute_v1.RegionDisksClient()
-            disk = regio_disk_client.get(
-                project=disk_project_id, region=region, disk=disk_name
-            )
-        # construct snapshot resource
-        snapshot = compute_v1.Snapshot()
-        # attach src to disk
-        snapshot.source_disk = disk.self_link
-        snapshot.name = snapshot_name
-        # Note:  default as US
-        if location:
-            snapshot.storage_locations = [location]
-
-        snapshot_client = compute_v1.SnapshotsClient()
-        logging.debug(f"Creating Snapshot to project {target_project_id}")
-        # create snapshot
-        snapshot_client.insert(
-            project=target_project_id, snapshot_resource=snapshot)
-        wait_for_snapshot_creation(target_project_id, snapshot_name)
+            # get zonal disk
+            if zone is not None:
+                # disk client to query the disk client
+                disk_client = disk_client or get_client(compute_v1.DisksClient)
+                disk = disk_client.get(project=disk_project_id,
+                                       zone=zone, disk=disk_name, metadata=field_mask("selfLink"))
+            else:
+                # get regional disk
+                regio_disk_client = region_disk_client or get_client(
+                    compute_v1.RegionDisksClient)
+                disk = regio_disk_client.get(
+                    project=disk_project_id, region=region, disk=disk_name, metadata=field_mask("selfLink")
+                )
+            # construct snapshot resource
+            snapshot = compute_v1.Snapshot()
+            # attach src to disk
+            snapshot.source_disk = disk.self_link
+            snapshot.name = snapshot_name
+            # Note:  default as US
+            if location:
+                snapshot.storage_locations = [location]
+
+            logging.debug(f"Creating Snapshot to project {target_project_id}")
+            if journal:
+                journal.record(SNAPSHOTS, snapshot_name, SUBMITTED, project=target_project_id)
+            # create snapshot
+            submitted_at = time.monotonic()
+            operation = snapshot_client.insert(
+                project=target_project_id, snapshot_resource=snapshot)
+            if journal:
+                journal.record(SNAPSHOTS, snapshot_name, OPERATION, operation=operation.name)
+        # wait on the insert operation itself rather than polling the snapshot
+        if not wait_for_snapshot_creation(
+                target_project_id, snapshot_name, snapshot_client=snapshot_client, operation=operation,
+                watcher=watcher):
+            raise TimeoutError(
+                f"Snapshot {snapshot_name} did not become ready")
         logging.debug(
             f"Snapshot {snapshot_name} created in {target_project_id} from disk {disk_name} in project {disk_project_id} ✅"
         )
+        if submitted_at is not None:
+            record_ready("snapshot", time.monotonic() - submitted_at)
+        if journal:
+            journal.record(SNAPSHOTS, snapshot_name, READY)
         return snapshot_client.get(project=target_project_id, snapshot=snapshot_name)
 
     except Exception as e:
         logging.error(f"Error creating snapshot: {e}")
+        if journal:
+            journal.record(SNAPSHOTS, snapshot_name, FAILED, error=str(e))
+        # batch callers want the error back so one entry can't end the whole run
+        if not exit_on_error:
+            raise
         sys.exit(1)
+
+
+def _snapshot_exists(snapshot_client: compute_v1.SnapshotsClient, project_id: str, snapshot_name: str) -> bool:
+    try:
+        snapshot_client.get(project=project_id, snapshot=snapshot_name, metadata=field_mask("name"))
+        return True
+    except NotFound:
+        return False
+
+
 # TODO need a mechanism to ensure the program exit after snapshot resources is created properly
 
 
+def create_snapshots(
+    target_project_id: str,
+    entries: list[dict],
+    concurrency: int = 8,
+    project_limit: int | None = None,
+    zone_limit: int | None = None,
+    watcher: ReadinessWatcher | None = None,
+    journal: Journal | None = None,
+) -> list[BatchResult]:
+    """Create a snapshot for every `snapshots` config entry through a worker pool.
+
+    Each entry runs independently: failures are collected in the returned
+    BatchResult list instead of exiting. `project_limit` / `zone_limit` cap
+    in-flight entries per source disk project / zone. With a `watcher`, all
+    entries share one readiness poll instead of waiting one by one. With a
+    `journal`, every state change is recorded so the run can be resumed.
+    """
+    def snapshot_entry(entry: dict) -> compute_v1.Snapshot:
+        return create_snapshot(
+            target_project_id=target_project_id,
+            disk_name=entry["disk_name"],
+            snapshot_name=entry["src_snapshot_name"],
+            zone=entry["target_zone"],
+            disk_project_id=entry.get("disk_project_id"),
+            exit_on_error=False,
+            watcher=watcher,
+            journal=journal,
+        )
+
+    return run_batch(
+        snapshot_entry,
+        entries,
+        key=lambda entry: entry["src_snapshot_name"],
+        concurrency=concurrency,
+        project_of=lambda entry: entry.get(
+            "disk_project_id") or target_project_id,
+        zone_of=lambda entry: entry["target_zone"],
+        project_limit=project_limit,
+        zone_limit=zone_limit,
+    )
+
+
 """
   Kubernetes-practice gcloud compute snapshots create snapshot-1 \
     --project=apt-gear-446423-v0 \
@@ -87,25 +185,69 @@ NAME        DISK_SIZE_GB  SRC_DISK                                       STATUS
 snapshot-1  10            us-central1-b/disks/my-vm-with-startup-script  READY
 """
 
-if (__name__ == "__main__"):
-    parser = argparse.ArgumentParser(
-        description="Create a disk from a snapshot.")
-    parser.add_argument("-c", "--config", required=True,
-                        help="Path to the config.yaml file")
-    parser.add_argument("-p", "--project_id",
-                        required=True, help="GCP Project ID")
-    parser.add_argument("-d", "--dry_run", action="store_true",
-
-                        help="Perform a dry run without creating the disk.")
-    args = parser.parse_args()
+def main(args: argparse.Namespace) -> None:
+    """`snapshot create`: plan, preflight and create the snapshots of a config."""
+    if args.metrics_out:
+        export_at_exit(args.metrics_out)
+    if args.trace_out or args.profile:
+        trace_at_exit(args.trace_out, args.profile)
     target_project_id = args.project_id
     configs = args.config
     dry_run = args.dry_run
     try:
-        configs = read_config(configs)
+        with span("config load"):
+            configs = load_config(configs, target_project_id, sharded=bool(args.processes))
+        if args.processes:
+            # every project shard plans, checks and creates in a worker process of its own
+            from .shard import ShardOptions, format_report, run_sharded
+            reports = run_sharded("snapshots", target_project_id, configs["snapshots"], args.processes,
+                                  args.shard_by_zone, ShardOptions(
+                                      dry_run=dry_run, skip_preflight=args.skip_preflight,
+                                      journal=args.journal or f"{args.config}.journal", resume=args.resume,
+                                      concurrency=args.concurrency or 8, project_limit=args.project_concurrency,
+                                      zone_limit=args.zone_concurrency, watch=args.watch))
+            print(format_report("snapshots", reports))
+            sys.exit(0 if all(report.ok for report in reports) else 1)
+        # compare the config with the snapshots that already exist; only missing ones are created
+        with span("plan"):
+            plan = plan_snapshots(target_project_id, configs["snapshots"])
+        print(plan.format())
+        # every entry is checked before the first snapshot is created
+        if not args.skip_preflight:
+            with span("preflight"):
+                problems = preflight_snapshots(target_project_id, plan.to_create)
+            print(format_problems(problems))
+            if problems:
+                sys.exit(1)
         if dry_run:
-            pp(configs)
-        for snapshots in configs["snapshots"]:
+            sys.exit(1 if plan.has_conflicts else 0)
+        journal = Journal(args.journal or f"{args.config}.journal", resume=args.resume)
+        entries = entries_to_run(plan, journal)
+        if args.concurrency:
+            watcher = ReadinessWatcher() if args.watch else None
+            results = create_snapshots(
+                target_project_id,
+                entries,
+                concurrency=args.concurrency,
+                project_limit=args.project_concurrency,
+                zone_limit=args.zone_concurrency,
+                watcher=watcher,
+                journal=journal,
+            )
+            if watcher:
+                watcher.stop()
+            summary = summarize(results)
+            for result in results:
+                if not result.ok:
+                    logging.error(
+                        f"Snapshot {result.key} failed: {result.error}")
+            logging.info(
+                f"Snapshots created: {len(summary.get('succeeded', []))}, failed: {len(summary.get('failed', []))}")
+            if summary.get("failed") or plan.has_conflicts:
+                sys.exit(1)
+            sys.exit(0)
+        failed = 0
+        for snapshots in entries:
             disk_project_id = snapshots["disk_project_id"]
             target_zone = snapshots["target_zone"]
             disk_name = snapshots["disk_name"]
@@ -113,9 +255,20 @@ if (__name__ == "__main__"):
             disk_size_gb = snapshots["disk_size_gb"]
             src_snapshot_name = snapshots["src_snapshot_name"]
             logging.debug(f"Creating Snapshot to project {target_project_id}")
-            # create snapshot
-            create_snapshot(target_project_id=target_project_id, disk_name=disk_name,
-                            snapshot_name=src_snapshot_name, zone=target_zone, disk_project_id=disk_project_id)
+            # create snapshot; a failure is in the journal and the run goes on with the next entry
+            try:
+                create_snapshot(target_project_id=target_project_id, disk_name=disk_name,
+                                snapshot_name=src_snapshot_name, zone=target_zone, disk_project_id=disk_project_id,
+                                exit_on_error=False, journal=journal)
+            except Exception:
+                failed += 1
+        if failed or plan.has_conflicts:
+            sys.exit(1)
     except Exception as e:
         logging.error(f"Error creating snapshot: {e}", exc_info=True)
         sys.exit(1)
+
+
+if __name__ == "__main__":
+    from . import cli
+    cli.main(["snapshot", "create", *sys.argv[1:]])
@@ -0,0 +1,363 @@
+#! /usr/bin/env python
+from __future__ import annotations
+import argparse
+import json
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any
+from google.cloud import compute_v1
+from .batch import BatchResult, KeyedDispatcher, KeyedLimiter, run_entry
+from .clients import get_client, get_compute_service
+from .config import DISKS, SNAPSHOTS, ConfigError, expand_entries, read_config, validate_config
+from .create_disk_from_snapshot import create_disk_from_snapshot
+from .create_snapshot import create_snapshot
+from .journal import Journal, entries_to_run
+from .metrics import METRICS, export_at_exit
+from .plan import disk_key, plan_disks, plan_snapshots, snapshot_key
+from .preflight import preflight_disks, preflight_snapshots
+from .watcher import ReadinessWatcher
+
+# Long-running worker that takes snapshot/disk jobs from a spool directory.
+#
+# A one-off run pays for imports, credential discovery and the discovery
+# document every time. The daemon pays once: its clients and services stay
+# warm, and one worker pool and one ReadinessWatcher are shared by every job,
+# whoever submitted it. Jobs are JSON lines in files dropped into the spool:
+#   SPOOL/incoming/*.jsonl   new; submit() writes them atomically
+#   SPOOL/processing/        claimed by the daemon (rename), still running
+#   SPOOL/done/              every job of the file has finished
+#   SPOOL/status/ID.json     per-job state, rewritten as it progresses
+#   SPOOL/journals/ID.journal  resource journal of the job
+# A job is {"id", "kind": "snapshots" | "disks", "project_id", "entries": [...]},
+# where entries are config entries, selectors included. Each job goes through
+# the usual steps: validate, expand, plan, preflight (unless "preflight":
+# false), then create. Files left in processing/ by a stopped daemon are
+# picked up again at start and resume from their journals.
+
+INCOMING = "incoming"
+PROCESSING = "processing"
+DONE = "done"
+STATUS = "status"
+JOURNALS = "journals"
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+DEFAULT_WORKERS = 16
+POLL_INTERVAL = 0.2
+# a running job's status file is rewritten at most this often
+STATUS_INTERVAL = 1.0
+
+
+def _write_json(path: str, data: Any) -> None:
+    # readers never see a half-written file
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=1)
+    os.replace(tmp, path)
+
+
+def _dirs(spool: str) -> dict[str, str]:
+    dirs = {name: os.path.join(spool, name) for name in (INCOMING, PROCESSING, DONE, STATUS, JOURNALS)}
+    for path in dirs.values():
+        os.makedirs(path, exist_ok=True)
+    return dirs
+
+
+def submit(spool: str, kind: str, project_id: str, entries: list[dict], job_id: str | None = None,
+           preflight: bool = True) -> str:
+    """Queue one job; returns its id. Invalid entries are rejected here, before the daemon sees them."""
+    if kind not in (SNAPSHOTS, DISKS):
+        raise ValueError(f"kind must be {SNAPSHOTS} or {DISKS}, got {kind!r}")
+    validate_config({kind: entries}, [kind], project_id)
+    job_id = job_id or f"{kind}-{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+    dirs = _dirs(spool)
+    job = {"id": job_id, "kind": kind, "project_id": project_id, "entries": entries, "preflight": preflight}
+    _write_json(os.path.join(dirs[STATUS], f"{job_id}.json"),
+                {"id": job_id, "state": QUEUED, "submitted_at": time.time()})
+    # written outside incoming/ and renamed in, so the daemon only ever sees whole files
+    tmp = os.path.join(spool, f".{job_id}.jsonl")
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(json.dumps(job) + "\n")
+    os.replace(tmp, os.path.join(dirs[INCOMING], f"{job_id}.jsonl"))
+    return job_id
+
+
+def read_status(spool: str, job_id: str) -> dict | None:
+    try:
+        with open(os.path.join(spool, STATUS, f"{job_id}.json"), encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+class _Job:
+    """Progress of one job; its status file is the outside view of it."""
+
+    def __init__(self, daemon: Daemon, job: dict, source: str):
+        self.daemon = daemon
+        self.id = job["id"]
+        self.job = job
+        self.source = source
+        self.lock = threading.Lock()
+        self.status: dict[str, Any] = {"id": self.id, "kind": job.get("kind"), "project_id": job.get("project_id"),
+                                       "state": RUNNING, "started_at": time.time(), "results": {}}
+        self.remaining = 0
+        self.journal: Journal | None = None
+        self._written = 0.0
+
+    def write(self, force: bool = False) -> None:
+        with self.lock:
+            if not force and time.monotonic() - self._written < STATUS_INTERVAL:
+                return
+            self._written = time.monotonic()
+            status = json.loads(json.dumps(self.status))
+        _write_json(os.path.join(self.daemon.dirs[STATUS], f"{self.id}.json"), status)
+
+    def finish(self, state: str, **fields: Any) -> None:
+        with self.lock:
+            self.status.update(state=state, finished_at=time.time(), **fields)
+        if self.journal:
+            self.journal.close()
+        # the job file moves to done/ before the status says finished, so a reader never sees it in between
+        self.daemon._job_finished(self)
+        self.write(force=True)
+        METRICS.inc("daemon_jobs_total", kind=self.status["kind"], state=state)
+        logging.info(f"Job {self.id}: {state}")
+
+    def entry_done(self, result: BatchResult) -> None:
+        with self.lock:
+            self.status["results"][result.key] = {"state": "ready"} if result.ok else \
+                {"state": "failed", "error": str(result.error)}
+            self.remaining -= 1
+            last = self.remaining == 0
+        if last:
+            failed = sum(r["state"] == "failed" for r in self.status["results"].values())
+            self.finish(FAILED if failed else SUCCEEDED, failed=failed)
+        else:
+            self.write()
+
+
+class Daemon:
+    def __init__(self, spool: str, workers: int = DEFAULT_WORKERS, project_limit: int | None = None,
+                 poll_interval: float = POLL_INTERVAL, watcher: ReadinessWatcher | None = None):
+        self.spool = spool
+        self.dirs = _dirs(spool)
+        self.poll_interval = poll_interval
+        self.watcher = watcher or ReadinessWatcher()
+        # entries of a project at its limit queue up in the dispatcher, not on a worker,
+        # so no team can take every worker of the pool
+        self._dispatcher = KeyedDispatcher(workers, name="daemon")
+        # planning and preflight of new jobs, so a big job doesn't hold up the spool loop
+        self._setup = ThreadPoolExecutor(max_workers=4, thread_name_prefix="daemon-setup")
+        self._project_limiter = KeyedLimiter(project_limit)
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        # source file -> ids of its jobs still running
+        self._open: dict[str, set[str]] = {}
+        self._futures: list[Future] = []
+
+    # ---- lifecycle ---------------------------------------------------------
+
+    def warm_up(self) -> None:
+        """Build the clients and this thread's service now, not in the first job."""
+        for client_class in (compute_v1.DisksClient, compute_v1.SnapshotsClient, compute_v1.ZonesClient,
+                             compute_v1.DiskTypesClient, compute_v1.ZoneOperationsClient,
+                             compute_v1.GlobalOperationsClient):
+            get_client(client_class)
+        get_compute_service()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def run(self) -> None:
+        """Serve the spool until stop(); jobs already claimed are finished before it returns."""
+        self.warm_up()
+        # files of a daemon that stopped mid-job; their journals say where they got to
+        for name in sorted(os.listdir(self.dirs[PROCESSING])):
+            self._claim(os.path.join(self.dirs[PROCESSING], name), resume=True)
+        while not self._stop.is_set():
+            self.poll_once()
+            self._stop.wait(self.poll_interval)
+        self.drain()
+
+    def drain(self) -> None:
+        self._setup.shutdown(wait=True)
+        with self._lock:
+            futures = list(self._futures)
+        for future in futures:
+            future.result()
+        self._dispatcher.shutdown(wait=True)
+        self.watcher.stop()
+
+    def poll_once(self) -> int:
+        """Claim every file in incoming/; returns how many jobs were started."""
+        started = 0
+        for name in sorted(os.listdir(self.dirs[INCOMING])):
+            if not name.endswith(".jsonl"):
+                continue
+            claimed = os.path.join(self.dirs[PROCESSING], name)
+            try:
+                os.replace(os.path.join(self.dirs[INCOMING], name), claimed)
+            except FileNotFoundError:
+                # another daemon on the same spool was faster
+                continue
+            started += self._claim(claimed)
+        return started
+
+    # ---- jobs --------------------------------------------------------------
+
+    def _claim(self, path: str, resume: bool = False) -> int:
+        jobs = []
+        with open(path, encoding="utf-8") as f:
+            for number, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    jobs.append(json.loads(line))
+                except ValueError:
+                    logging.error(f"Ignoring unreadable job on line {number} of {path}")
+        if resume:
+            # jobs that finished before the daemon stopped are not run again
+            jobs = [job for job in jobs
+                    if (read_status(self.spool, job.get("id", "")) or {}).get("state") not in (SUCCEEDED, FAILED)]
+        with self._lock:
+            self._open[path] = {job.get("id") for job in jobs}
+        if not jobs:
+            self._close_source(path)
+        for job in jobs:
+            METRICS.inc("daemon_jobs_started_total")
+            self._setup.submit(self._start, _Job(self, job, path), resume)
+        return len(jobs)
+
+    def _start(self, job: _Job, resume: bool) -> None:
+        try:
+            kind, project_id = job.job.get("kind"), job.job.get("project_id")
+            if kind not in (SNAPSHOTS, DISKS) or not project_id:
+                raise ConfigError([f"job needs kind {SNAPSHOTS} or {DISKS} and a project_id"])
+            validate_config({kind: job.job.get("entries")}, [kind], project_id)
+            entries = expand_entries(kind, job.job["entries"], project_id)
+            plan = (plan_snapshots if kind == SNAPSHOTS else plan_disks)(project_id, entries)
+            job.status["plan"] = plan.counts()
+            if job.job.get("preflight", True):
+                check = preflight_snapshots if kind == SNAPSHOTS else preflight_disks
+                problems = check(project_id, plan.to_create)
+                if problems:
+                    job.finish(FAILED, problems=[f"{p.key}: {p.message}" for p in problems])
+                    return
+            job.journal = Journal(os.path.join(self.dirs[JOURNALS], f"{job.id}.journal"), resume=resume)
+            to_run = entries_to_run(plan, job.journal)
+        except Exception as e:
+            logging.error(f"Job {job.id} could not start: {e}")
+            job.finish(FAILED, error=str(e))
+            return
+        if plan.has_conflicts:
+            job.status["conflicts"] = [f"{item.key}: {item.reason}" for item in plan.of("conflict")]
+        if not to_run:
+            job.finish(FAILED if plan.has_conflicts else SUCCEEDED)
+            return
+        job.remaining = len(to_run)
+        job.write(force=True)
+        run = self._snapshot_entry if kind == SNAPSHOTS else self._disk_entry
+        key = snapshot_key if kind == SNAPSHOTS else disk_key
+        for entry in to_run:
+            future = self._dispatcher.submit([(self._project_limiter, project_id)],
+                                             run_entry, lambda entry: run(job, entry), key(entry), entry)
+            future.add_done_callback(lambda f, job=job: job.entry_done(f.result()))
+            with self._lock:
+                self._futures.append(future)
+
+    def _snapshot_entry(self, job: _Job, entry: dict) -> Any:
+        return create_snapshot(
+            target_project_id=job.job["project_id"],
+            disk_name=entry["disk_name"],
+            snapshot_name=entry["src_snapshot_name"],
+            zone=entry["target_zone"],
+            disk_project_id=entry.get("disk_project_id"),
+            exit_on_error=False,
+            watcher=self.watcher,
+            journal=job.journal,
+        )
+
+    def _disk_entry(self, job: _Job, entry: dict) -> Any:
+        return create_disk_from_snapshot(
+            src_project_id=entry["src_project_id"],
+            target_zone=entry["target_zone"],
+            disk_name=entry["disk_name"],
+            disk_type=entry["disk_type"],
+            disk_size_gb=entry["disk_size_gb"],
+            target_project_id=job.job["project_id"],
+            src_snapshot_name=entry["src_snapshot_name"],
+            raise_on_error=True,
+            wait=True,
+            watcher=self.watcher,
+            journal=job.journal,
+        )
+
+    def _job_finished(self, job: _Job) -> None:
+        with self._lock:
+            remaining = self._open.get(job.source)
+            if remaining is None:
+                return
+            remaining.discard(job.id)
+            if remaining:
+                return
+        self._close_source(job.source)
+
+    def _close_source(self, path: str) -> None:
+        with self._lock:
+            self._open.pop(path, None)
+            # finished futures are dropped so a long-lived daemon doesn't hold every result
+            self._futures = [f for f in self._futures if not f.done()]
+        os.replace(path, os.path.join(self.dirs[DONE], os.path.basename(path)))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(
+        description="Run snapshot/disk jobs from a spool directory with warm clients, or submit one.")
+    parser.add_argument("-s", "--spool", required=True,
+                        help="Spool directory shared by the daemon and submitters")
+    parser.add_argument("--submit", default=None, metavar="CONFIG",
+                        help="Instead of serving, queue a job for the `snapshots` or `disks` of this config")
+    parser.add_argument("-p", "--project_id", default=None,
+                        help="GCP Project ID of the submitted job")
+    parser.add_argument("-k", "--kind", choices=(SNAPSHOTS, DISKS), default=None,
+                        help="Section of the config to submit (default: the only one it has)")
+    parser.add_argument("-n", "--workers", type=int, default=DEFAULT_WORKERS,
+                        help=f"Entries run at once across all jobs (default {DEFAULT_WORKERS})")
+    parser.add_argument("--project_concurrency", type=int, default=None,
+                        help="Max entries in flight per job project")
+    parser.add_argument("--metrics_out", default=None,
+                        help="Write API/wait metrics here at exit (*.prom: Prometheus text, else JSON)")
+    args = parser.parse_args()
+
+    if args.submit:
+        if not args.project_id:
+            parser.error("--submit needs -p/--project_id")
+        config = read_config(args.submit)
+        kinds = [args.kind] if args.kind else [k for k in (SNAPSHOTS, DISKS) if k in config]
+        if len(kinds) != 1:
+            parser.error("use -k/--kind to pick the section to submit")
+        try:
+            print(submit(args.spool, kinds[0], args.project_id, config[kinds[0]]))
+        except ConfigError as e:
+            print(e, file=sys.stderr)
+            sys.exit(1)
+        sys.exit(0)
+
+    if args.metrics_out:
+        export_at_exit(args.metrics_out)
+    daemon = Daemon(args.spool, workers=args.workers, project_limit=args.project_concurrency)
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(sig, lambda *_: daemon.stop())
+    logging.info(f"Serving jobs from {args.spool}")
+    daemon.run()
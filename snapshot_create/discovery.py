@@ -0,0 +1,108 @@
+#! /usr/bin/env python
+from __future__ import annotations
+import argparse
+import json
+import logging
+import os
+import threading
+from pathlib import Path
+from typing import Any
+import requests
+from googleapiclient import discovery_cache
+
+# The compute v1 discovery document, without the network.
+#
+# build('compute', 'v1') downloads and parses a ~4 MB document before the
+# first call. Here it is read from a versioned on-disk cache
+# (compute.v1.<revision>.json, newest revision wins) or, failing that, from
+# the copy bundled with google-api-python-client, and parsed once per
+# process. Only refresh_document() touches the network.
+
+API = "compute"
+VERSION = "v1"
+DISCOVERY_URL = f"https://{API}.googleapis.com/$discovery/rest?version={VERSION}"
+CACHE_DIR = Path(os.environ.get("GCP_UTILITIES_DISCOVERY_CACHE",
+                                "~/.cache/gcp-utilities/discovery")).expanduser()
+# older revisions kept around after a refresh
+KEEP_REVISIONS = 2
+
+_lock = threading.Lock()
+_document: dict | None = None
+
+
+def cached_files(cache_dir: Path | None = None) -> list[Path]:
+    # revisions are YYYYMMDD, so name order is revision order
+    return sorted((cache_dir or CACHE_DIR).glob(f"{API}.{VERSION}.*.json"))
+
+
+def _read_document(cache_dir: Path | None) -> dict:
+    for path in reversed(cached_files(cache_dir)):
+        try:
+            document = json.loads(path.read_text())
+            logging.debug(f"Using discovery document {path}")
+            return document
+        except (OSError, ValueError) as e:
+            logging.warning(f"Skipping unreadable discovery document {path}: {e}")
+    content = discovery_cache.get_static_doc(API, VERSION)
+    if content is None:
+        raise RuntimeError(
+            f"No {API} {VERSION} discovery document cached or bundled; "
+            f"run `python -m snapshot_create.discovery --refresh`")
+    logging.debug(f"Using bundled {API} {VERSION} discovery document")
+    return json.loads(content)
+
+
+def load_document(cache_dir: Path | None = None) -> dict:
+    """Return the parsed discovery document, reading and parsing it only on the first call."""
+    global _document
+    if _document is None:
+        with _lock:
+            if _document is None:
+                _document = _read_document(cache_dir)
+    return _document
+
+
+def refresh_document(cache_dir: Path | None = None, timeout: float = 30) -> Path:
+    """Download the current document into the cache and use it from now on."""
+    global _document
+    cache_dir = cache_dir or CACHE_DIR
+    response = requests.get(DISCOVERY_URL, timeout=timeout)
+    response.raise_for_status()
+    document = response.json()
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    path = cache_dir / f"{API}.{VERSION}.{document['revision']}.json"
+    # write then rename, so a concurrent reader never sees half a document
+    tmp = path.with_suffix(f".tmp{os.getpid()}")
+    tmp.write_text(json.dumps(document))
+    os.replace(tmp, path)
+    for old in cached_files(cache_dir)[:-(KEEP_REVISIONS + 1)]:
+        old.unlink(missing_ok=True)
+    with _lock:
+        _document = document
+    # services built from the previous document are dropped too
+    from .clients import clear_cache
+    clear_cache()
+    logging.info(f"Cached discovery document revision {document['revision']} at {path}")
+    return path
+
+
+def reset() -> None:
+    # forget the parsed document; the next load_document() reads it again
+    global _document
+    with _lock:
+        _document = None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Show or refresh the cached compute v1 discovery document.")
+    parser.add_argument("--refresh", action="store_true",
+                        help="Download the current document into the cache")
+    parser.add_argument("--cache_dir", type=Path, default=None,
+                        help=f"Cache directory (default {CACHE_DIR})")
+    args = parser.parse_args()
+    if args.refresh:
+        print(refresh_document(args.cache_dir))
+    document: Any = load_document(args.cache_dir)
+    files = cached_files(args.cache_dir)
+    print(f"revision {document['revision']} from {files[-1] if files else 'bundled copy'}")
@@ -0,0 +1,1052 @@
+#! /usr/bin/env python
+from __future__ import annotations
+import copy
+import itertools
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Iterable
+import httplib2
+from google.api_core import exceptions
+from google.api_core.future import polling as api_core_polling
+from google.cloud import compute_v1
+from googleapiclient.errors import HttpError
+from .metrics import timed_call
+from .ratelimit import get_guard
+
+# In-process stand-in for the slice of Compute Engine these tools use.
+#
+# One FakeComputeBackend holds disks, snapshots and operations and serves them
+# through both surfaces the scripts use: compute_v1-style clients
+# (backend.client("DisksClient")) and a discovery-style `service`
+# (backend.service()). Resources move PENDING -> READY after a configurable
+# delay, every call can take a configurable latency, and 429/5xx errors or a
+# per-project quota can be injected. clients.use_backend(backend) (or the
+# GCP_UTILITIES_FAKE_BACKEND environment variable) points every script at it.
+
+API_BASE = "https://www.googleapis.com/compute/v1"
+# GCE reports timestamps in Pacific time
+GCE_TZ = timezone(timedelta(hours=-7))
+# zones.get answers for any well-formed zone name, diskTypes.get for these types
+ZONE_PATTERN = re.compile(r"[a-z]+-[a-z]+\d+-[a-z]")
+DISK_TYPES = ("pd-standard", "pd-balanced", "pd-ssd", "pd-extreme", "hyperdisk-balanced", "hyperdisk-extreme")
+
+Latency = Callable[[], float]
+
+
+def fixed(seconds: float) -> Latency:
+    return lambda: seconds
+
+
+def uniform(low: float, high: float) -> Latency:
+    return lambda: random.uniform(low, high)
+
+
+def lognormal(median: float, sigma: float = 0.5) -> Latency:
+    # long-tailed, like real API latencies
+    import math
+    return lambda: random.lognormvariate(math.log(median), sigma)
+
+
+def _as_latency(value: float | Latency | None) -> Latency:
+    if value is None:
+        return fixed(0.0)
+    if callable(value):
+        return value
+    return fixed(float(value))
+
+
+class FakeApiError(Exception):
+    """Raised inside the backend; each surface converts it to its own error type."""
+
+    def __init__(self, code: int, reason: str, message: str):
+        super().__init__(message)
+        self.code = code
+        self.reason = reason
+        self.message = message
+
+
+# ---- filters ------------------------------------------------------------
+
+_CLAUSE = re.compile(
+    r'\(?\s*([\w.]+)\s*(>=|<=|!=|=|>|<|\beq\b|\bne\b)\s*("[^"]*"|\'[^\']*\'|[^\s)]+)\s*\)?')
+
+
+def _field(resource: dict, path: str) -> Any:
+    value: Any = resource
+    for part in path.split("."):
+        value = value.get(part) if isinstance(value, dict) else None
+    return value
+
+
+def _compare(actual: Any, op: str, expected: str, field: str) -> bool:
+    if actual is None:
+        return op in ("!=", "ne")
+    if op in ("eq", "ne"):
+        # legacy syntax: RE2 full match
+        matched = re.fullmatch(expected, str(actual)) is not None
+        return matched if op == "eq" else not matched
+    if field == "creationTimestamp":
+        actual_v, expected_v = datetime.fromisoformat(
+            actual), datetime.fromisoformat(expected)
+    else:
+        actual_v, expected_v = str(actual), expected
+    if op == "=":
+        if isinstance(actual_v, str) and "*" in expected_v:
+            return re.fullmatch(re.escape(expected_v).replace(r"\*", ".*"), actual_v) is not None
+        return actual_v == expected_v
+    return {
+        "!=": actual_v != expected_v,
+        ">": actual_v > expected_v,
+        ">=": actual_v >= expected_v,
+        "<": actual_v < expected_v,
+        "<=": actual_v <= expected_v,
+    }[op]
+
+
+def matches_filter(resource: dict, filter: str | None) -> bool:
+    """Evaluate the subset of the list filter syntax the tools use.
+
+    Terms are joined with OR; inside a term, clauses (`field op value`,
+    optionally parenthesized) are ANDed. `*` works as a wildcard with `=`.
+    """
+    if not filter:
+        return True
+    for term in re.split(r"\s+OR\s+", filter.strip()):
+        clauses = _CLAUSE.findall(term)
+        if clauses and all(
+            _compare(_field(resource, field), op,
+                     value.strip("\"'"), field)
+            for field, op, value in clauses
+        ):
+            return True
+    return False
+
+
+def _order(items: list[dict], order_by: str | None) -> list[dict]:
+    if not order_by:
+        return sorted(items, key=lambda r: r["name"])
+    field, _, direction = order_by.partition(" ")
+    key = (lambda r: datetime.fromisoformat(r[field])) if field == "creationTimestamp" else (
+        lambda r: r.get(field, ""))
+    return sorted(items, key=key, reverse=direction.strip() == "desc")
+
+
+class _Resource:
+    __slots__ = ("body", "ready_at", "failed")
+
+    def __init__(self, body: dict, ready_at: float, failed: bool = False):
+        self.body = body
+        self.ready_at = ready_at
+        self.failed = failed
+
+
+class FakeComputeBackend:
+    """Holds the simulated project state and the knobs for latency and failures.
+
+    latency        seconds each API call takes (number or callable, e.g. lognormal(0.1))
+    ready_after    seconds from insert until a disk/snapshot is READY and its operation DONE
+    error_rate     probability that any call fails with one of `error_codes`
+    quota_per_second  per-project request rate above which calls fail with 429
+    autocreate_sources  create missing disks and snapshots on get and missing sources on insert,
+                   so a config can be run against an empty backend
+    forbidden_projects  projects whose every call fails with 403 forbidden
+    time_scale     multiplies every simulated delay (0.01 runs a 5 s wait in 50 ms)
+    """
+
+    def __init__(
+        self,
+        latency: float | Latency | None = None,
+        ready_after: float | Latency | None = 1.0,
+        error_rate: float = 0.0,
+        error_codes: tuple[int, ...] = (429, 503),
+        quota_per_second: float | None = None,
+        autocreate_sources: bool = False,
+        forbidden_projects: Iterable[str] = (),
+        time_scale: float = 1.0,
+        seed: int | None = None,
+    ):
+        self.latency = _as_latency(latency)
+        self.ready_after = _as_latency(ready_after)
+        self.error_rate = error_rate
+        self.error_codes = error_codes
+        self.quota_per_second = quota_per_second
+        self.autocreate_sources = autocreate_sources
+        self.forbidden_projects: set[str] = set(forbidden_projects)
+        self.time_scale = time_scale
+        self.calls: Counter[str] = Counter()
+        self._random = random.Random(seed)
+        self._lock = threading.RLock()
+        self._ids = itertools.count(1)
+        self._disks: dict[tuple[str, str, str], _Resource] = {}
+        self._snapshots: dict[tuple[str, str], _Resource] = {}
+        self._operations: dict[str, _Resource] = {}
+        self._injected: dict[str, list[int]] = defaultdict(list)
+        self._rejected: Counter[str] = Counter()
+        self._window: dict[str, list[float]] = defaultdict(list)
+        # the process-wide rate limits and retry policy, on the simulated clock
+        self.guard = get_guard().on_clock(self.sleep, self.now)
+        # set while the calls of one batch request run; they share its round trip
+        self._batch = threading.local()
+        # calls that went out inside a batch request, also counted in `calls`
+        self.batched_calls = 0
+
+    # ---- knobs -------------------------------------------------------------
+
+    def inject_errors(self, method: str, *codes: int) -> None:
+        """Make the next len(codes) calls of `method` (e.g. "disks.insert") fail with these codes."""
+        with self._lock:
+            self._injected[method].extend(codes)
+
+    def reject_operations(self, method: str, count: int = 1) -> None:
+        """Make the next `count` calls of `method` ("disks.delete", "snapshots.insert") return an
+        operation that is already DONE with an error, and change nothing."""
+        with self._lock:
+            self._rejected[method] += count
+
+    def _take_rejection(self, method: str) -> bool:
+        # called with the lock held
+        if self._rejected[method] > 0:
+            self._rejected[method] -= 1
+            return True
+        return False
+
+    def sleep(self, seconds: float) -> None:
+        if seconds > 0:
+            time.sleep(seconds * self.time_scale)
+
+    def now(self) -> float:
+        # simulated clock: real time stretched back by time_scale
+        return time.monotonic() / self.time_scale if self.time_scale else time.monotonic()
+
+    def _call(self, method: str, project: str) -> None:
+        # every API call: count it, take its latency, then maybe fail
+        with self._lock:
+            self.calls[method] += 1
+            injected = self._injected.get(method)
+            code = injected.pop(0) if injected else None
+            if code is None and self.quota_per_second:
+                # a one second window on the simulated clock, like every other delay here
+                now = self.now()
+                window = [t for t in self._window[project] if now - t < 1.0]
+                window.append(now)
+                self._window[project] = window
+                if len(window) > self.quota_per_second:
+                    code = 429
+            if code is None and self.error_rate and self._random.random() < self.error_rate:
+                code = self._random.choice(self.error_codes)
+        if not getattr(self._batch, "active", False):
+            self.sleep(self.latency())
+        if project in self.forbidden_projects:
+            raise FakeApiError(403, "forbidden", f"Required permission for {method} in project {project} is missing")
+        if code is not None:
+            reason = {429: "rateLimitExceeded", 403: "quotaExceeded",
+                      500: "backendError", 503: "backendError"}.get(code, "error")
+            raise FakeApiError(code, reason, f"Injected {code} for {method}")
+
+    def run_batch(self, project: str, fns: list[Callable[[], Any]]) -> list[tuple[Any, FakeApiError | None]]:
+        """One batch request: a single round trip ("batch" in calls), then every call on its own."""
+        self._call("batch", project)
+        with self._lock:
+            self.batched_calls += len(fns)
+        self._batch.active = True
+        try:
+            outcomes = []
+            for fn in fns:
+                try:
+                    outcomes.append((fn(), None))
+                except FakeApiError as e:
+                    outcomes.append((None, e))
+            return outcomes
+        finally:
+            self._batch.active = False
+
+    # ---- state -------------------------------------------------------------
+
+    def _timestamp(self) -> str:
+        return datetime.now(GCE_TZ).isoformat(timespec="milliseconds")
+
+    def _status(self, resource: _Resource, pending: str) -> str:
+        if resource.failed:
+            return "FAILED"
+        return "READY" if self.now() >= resource.ready_at else pending
+
+    def _snapshot_view(self, resource: _Resource) -> dict:
+        body = copy.deepcopy(resource.body)
+        body["status"] = self._status(resource, "CREATING")
+        return body
+
+    def _disk_view(self, resource: _Resource) -> dict:
+        body = copy.deepcopy(resource.body)
+        body["status"] = self._status(resource, "CREATING")
+        return body
+
+    def _operation_view(self, operation: _Resource) -> dict:
+        body = copy.deepcopy(operation.body)
+        done = self.now() >= operation.ready_at
+        body["status"] = "DONE" if done else "RUNNING"
+        if done and operation.failed:
+            body["error"] = {"errors": [
+                {"code": "RESOURCE_OPERATION_FAILED", "message": "simulated failure"}]}
+        return body
+
+    def _new_operation(self, project: str, zone: str | None, kind: str, target: str, delay: float,
+                       failed: bool = False) -> dict:
+        name = f"operation-{next(self._ids)}"
+        scope = f"zones/{zone}" if zone else "global"
+        body = {
+            "kind": "compute#operation",
+            "name": name,
+            "operationType": kind,
+            "targetLink": target,
+            "selfLink": f"{API_BASE}/projects/{project}/{scope}/operations/{name}",
+            "insertTime": self._timestamp(),
+        }
+        if zone:
+            body["zone"] = f"{API_BASE}/projects/{project}/zones/{zone}"
+        operation = _Resource(body, self.now() + delay, failed)
+        self._operations[name] = operation
+        return self._operation_view(operation)
+
+    def add_disk(self, project: str, zone: str, name: str, size_gb: int = 10, disk_type: str = "pd-balanced",
+                 ready: bool = True, **extra) -> dict:
+        """Seed a disk directly (no latency, no call counted)."""
+        with self._lock:
+            body = {
+                "kind": "compute#disk",
+                "name": name,
+                "sizeGb": str(size_gb),
+                "zone": f"{API_BASE}/projects/{project}/zones/{zone}",
+                "type": f"{API_BASE}/projects/{project}/zones/{zone}/diskTypes/{disk_type}",
+                "selfLink": f"{API_BASE}/projects/{project}/zones/{zone}/disks/{name}",
+                "creationTimestamp": self._timestamp(),
+                "id": str(next(self._ids)),
+                **extra,
+            }
+            ready_at = self.now() if ready else self.now() + self.ready_after()
+            self._disks[(project, zone, name)] = _Resource(body, ready_at)
+            return self._disk_view(self._disks[(project, zone, name)])
+
+    def add_snapshot(self, project: str, name: str, source_disk: str | None = None, ready: bool = True,
+                     **extra) -> dict:
+        """Seed a snapshot directly (no latency, no call counted)."""
+        with self._lock:
+            body = {
+                "kind": "compute#snapshot",
+                "name": name,
+                "sourceDisk": source_disk,
+                "selfLink": f"{API_BASE}/projects/{project}/global/snapshots/{name}",
+                "creationTimestamp": self._timestamp(),
+                "id": str(next(self._ids)),
+                "diskSizeGb": "10",
+                **extra,
+            }
+            ready_at = self.now() if ready else self.now() + self.ready_after()
+            self._snapshots[(project, name)] = _Resource(body, ready_at)
+            return self._snapshot_view(self._snapshots[(project, name)])
+
+    @staticmethod
+    def _parse_disk_url(url: str) -> tuple[str, str, str]:
+        match = re.search(r"projects/([^/]+)/zones/([^/]+)/disks/([^/]+)$", url)
+        if not match:
+            raise FakeApiError(400, "invalid", f"Invalid disk reference {url}")
+        return match.group(1), match.group(2), match.group(3)
+
+    @staticmethod
+    def _parse_snapshot_url(url: str) -> tuple[str, str]:
+        match = re.search(r"projects/([^/]+)/global/snapshots/([^/]+)$", url)
+        if not match:
+            raise FakeApiError(
+                400, "invalid", f"Invalid snapshot reference {url}")
+        return match.group(1), match.group(2)
+
+    # ---- API: snapshots ------------------------------------------------------
+
+    def get_snapshot(self, project: str, name: str) -> dict:
+        self._call("snapshots.get", project)
+        with self._lock:
+            if (project, name) not in self._snapshots and self.autocreate_sources:
+                self.add_snapshot(project, name)
+            resource = self._snapshots.get((project, name))
+            if resource is None:
+                raise FakeApiError(
+                    404, "notFound", f"The resource 'projects/{project}/global/snapshots/{name}' was not found")
+            return self._snapshot_view(resource)
+
+    def list_snapshots(self, project: str, filter: str | None = None, order_by: str | None = None) -> list[dict]:
+        self._call("snapshots.list", project)
+        with self._lock:
+            items = [self._snapshot_view(r) for (p, _), r in self._snapshots.items() if p == project]
+        return _order([s for s in items if matches_filter(s, filter)], order_by)
+
+    def insert_snapshot(self, project: str, body: dict) -> dict:
+        self._call("snapshots.insert", project)
+        name = body["name"]
+        source = body.get("sourceDisk")
+        with self._lock:
+            if (project, name) in self._snapshots:
+                raise FakeApiError(
+                    409, "alreadyExists", f"The resource 'projects/{project}/global/snapshots/{name}' already exists")
+            if self._take_rejection("snapshots.insert"):
+                return self._new_operation(project, None, "insert",
+                                           f"{API_BASE}/projects/{project}/global/snapshots/{name}", 0.0, failed=True)
+            size_gb = "10"
+            if source:
+                key = self._parse_disk_url(source)
+                if key not in self._disks:
+                    if not self.autocreate_sources:
+                        raise FakeApiError(
+                            404, "notFound", f"The resource '{source}' was not found")
+                    self.add_disk(*key)
+                source = self._disks[key].body["selfLink"]
+                size_gb = self._disks[key].body["sizeGb"]
+            delay = self.ready_after()
+            resource = _Resource(
+                {
+                    "kind": "compute#snapshot",
+                    "name": name,
+                    "sourceDisk": source,
+                    "storageLocations": body.get("storageLocations", ["us"]),
+                    "labels": body.get("labels", {}),
+                    "selfLink": f"{API_BASE}/projects/{project}/global/snapshots/{name}",
+                    "creationTimestamp": self._timestamp(),
+                    "id": str(next(self._ids)),
+                    "diskSizeGb": size_gb,
+                },
+                self.now() + delay,
+            )
+            self._snapshots[(project, name)] = resource
+            return self._new_operation(project, None, "insert", resource.body["selfLink"], delay)
+
+    def delete_snapshot(self, project: str, name: str) -> dict:
+        self._call("snapshots.delete", project)
+        with self._lock:
+            resource = self._snapshots.pop((project, name), None)
+            if resource is None:
+                raise FakeApiError(
+                    404, "notFound", f"The resource 'projects/{project}/global/snapshots/{name}' was not found")
+            return self._new_operation(project, None, "delete", resource.body["selfLink"], self.ready_after() / 2)
+
+    # ---- API: disks ----------------------------------------------------------
+
+    def get_disk(self, project: str, zone: str, name: str) -> dict:
+        self._call("disks.get", project)
+        with self._lock:
+            if (project, zone, name) not in self._disks and self.autocreate_sources:
+                # create_snapshot looks its source disk up before inserting
+                self.add_disk(project, zone, name)
+            resource = self._disks.get((project, zone, name))
+            if resource is None:
+                raise FakeApiError(
+                    404, "notFound", f"The resource 'projects/{project}/zones/{zone}/disks/{name}' was not found")
+            return self._disk_view(resource)
+
+    def list_disks(self, project: str, zone: str, filter: str | None = None, order_by: str | None = None) -> list[dict]:
+        self._call("disks.list", project)
+        with self._lock:
+            items = [self._disk_view(r) for (p, z, _), r in self._disks.items() if p == project and z == zone]
+        return _order([d for d in items if matches_filter(d, filter)], order_by)
+
+    def aggregated_list_disks(self, project: str, filter: str | None = None) -> dict[str, list[dict]]:
+        self._call("disks.aggregatedList", project)
+        scopes: dict[str, list[dict]] = defaultdict(list)
+        with self._lock:
+            for (p, zone, _), resource in self._disks.items():
+                if p == project:
+                    disk = self._disk_view(resource)
+                    if matches_filter(disk, filter):
+                        scopes[f"zones/{zone}"].append(disk)
+        return dict(scopes)
+
+    def insert_disk(self, project: str, zone: str, body: dict) -> dict:
+        self._call("disks.insert", project)
+        name = body["name"]
+        with self._lock:
+            if (project, zone, name) in self._disks:
+                raise FakeApiError(
+                    409, "alreadyExists", f"The resource 'projects/{project}/zones/{zone}/disks/{name}' already exists")
+            size_gb = body.get("sizeGb")
+            source = body.get("sourceSnapshot")
+            if source:
+                key = self._parse_snapshot_url(source)
+                if key not in self._snapshots:
+                    if not self.autocreate_sources:
+                        raise FakeApiError(
+                            404, "notFound", f"The resource '{source}' was not found")
+                    self.add_snapshot(*key)
+                size_gb = size_gb or self._snapshots[key].body.get("diskSizeGb")
+            disk_type = (body.get("type") or "pd-balanced").rsplit("/", 1)[-1]
+            delay = self.ready_after()
+            resource = _Resource(
+                {
+                    "kind": "compute#disk",
+                    "name": name,
+                    "sizeGb": str(size_gb or 10),
+                    "zone": f"{API_BASE}/projects/{project}/zones/{zone}",
+                    "type": f"{API_BASE}/projects/{project}/zones/{zone}/diskTypes/{disk_type}",
+                    "sourceSnapshot": f"{API_BASE}/{source}" if source and not source.startswith("http") else source,
+                    "labels": body.get("labels", {}),
+                    "selfLink": f"{API_BASE}/projects/{project}/zones/{zone}/disks/{name}",
+                    "creationTimestamp": self._timestamp(),
+                    "id": str(next(self._ids)),
+                },
+                self.now() + delay,
+            )
+            self._disks[(project, zone, name)] = resource
+            return self._new_operation(project, zone, "insert", resource.body["selfLink"], delay)
+
+    def delete_disk(self, project: str, zone: str, name: str) -> dict:
+        self._call("disks.delete", project)
+        with self._lock:
+            resource = self._disks.get((project, zone, name))
+            if resource is None:
+                raise FakeApiError(
+                    404, "notFound", f"The resource 'projects/{project}/zones/{zone}/disks/{name}' was not found")
+            if resource.body.get("users"):
+                raise FakeApiError(
+                    400, "resourceInUseByAnotherResource",
+                    f"The disk resource '{name}' is already being used by '{resource.body['users'][0]}'")
+            if self._take_rejection("disks.delete"):
+                return self._new_operation(project, zone, "delete", resource.body["selfLink"], 0.0, failed=True)
+            del self._disks[(project, zone, name)]
+            return self._new_operation(project, zone, "delete", resource.body["selfLink"], self.ready_after() / 2)
+
+    # ---- API: operations -----------------------------------------------------
+
+    def get_operation(self, project: str, name: str, method: str = "zoneOperations.get") -> dict:
+        self._call(method, project)
+        with self._lock:
+            operation = self._operations.get(name)
+            if operation is None:
+                raise FakeApiError(
+                    404, "notFound", f"Operation {name} not found")
+            return self._operation_view(operation)
+
+    def wait_operation(self, project: str, name: str, method: str = "zoneOperations.wait") -> dict:
+        # long-poll: returns once DONE or after the 2 minute server-side limit
+        self._call(method, project)
+        with self._lock:
+            operation = self._operations.get(name)
+            if operation is None:
+                raise FakeApiError(
+                    404, "notFound", f"Operation {name} not found")
+            remaining = operation.ready_at - self.now()
+        self.sleep(min(max(remaining, 0.0), 120.0))
+        with self._lock:
+            return self._operation_view(operation)
+
+    # ---- API: zones and disk types --------------------------------------------
+
+    def get_zone(self, project: str, zone: str) -> dict:
+        self._call("zones.get", project)
+        if not ZONE_PATTERN.fullmatch(zone or ""):
+            raise FakeApiError(404, "notFound", f"The resource 'projects/{project}/zones/{zone}' was not found")
+        return {"kind": "compute#zone", "name": zone, "status": "UP",
+                "selfLink": f"{API_BASE}/projects/{project}/zones/{zone}"}
+
+    def get_disk_type(self, project: str, zone: str, disk_type: str) -> dict:
+        self._call("diskTypes.get", project)
+        if not ZONE_PATTERN.fullmatch(zone or "") or disk_type not in DISK_TYPES:
+            raise FakeApiError(
+                404, "notFound", f"The resource 'projects/{project}/zones/{zone}/diskTypes/{disk_type}' was not found")
+        return {"kind": "compute#diskType", "name": disk_type, "zone": f"{API_BASE}/projects/{project}/zones/{zone}",
+                "selfLink": f"{API_BASE}/projects/{project}/zones/{zone}/diskTypes/{disk_type}"}
+
+    # ---- surfaces --------------------------------------------------------------
+
+    def client(self, name: str) -> Any:
+        """compute_v1-style client by class name, e.g. backend.client("DisksClient")."""
+        return CLIENT_CLASSES[name](self)
+
+    def service(self) -> Any:
+        """Discovery-style compute v1 service."""
+        return FakeService(self)
+
+
+def http_error(error: FakeApiError) -> HttpError:
+    content = json.dumps({"error": {"code": error.code, "message": error.message,
+                                    "errors": [{"reason": error.reason, "message": error.message}]}})
+    return HttpError(httplib2.Response({"status": error.code}), content.encode())
+
+
+def api_core_error(error: FakeApiError) -> exceptions.GoogleAPICallError:
+    return exceptions.from_http_status(error.code, error.message, errors=[{"reason": error.reason}])
+
+
+def to_proto(message_class: type, body: dict) -> Any:
+    return message_class.from_json(json.dumps(body), ignore_unknown_fields=True)
+
+
+def from_proto(message: Any) -> dict:
+    return json.loads(type(message).to_json(message))
+
+
+def _parse_fields(fields: str) -> dict:
+    # "items(name,status),nextPageToken" -> {"items": {"name": {}, "status": {}}, "nextPageToken": {}};
+    # an empty subtree keeps the whole value
+    parts, depth, start = [], 0, 0
+    for i, c in enumerate(fields):
+        depth += {"(": 1, ")": -1}.get(c, 0)
+        if c == "," and depth == 0:
+            parts.append(fields[start:i])
+            start = i + 1
+    parts.append(fields[start:])
+    tree: dict = {}
+    for part in filter(None, (p.strip() for p in parts)):
+        path, _, nested = part.partition("(")
+        node = tree
+        keys = path.split("/")
+        for key in keys[:-1]:
+            node = node.setdefault(key, {})
+        node.setdefault(keys[-1], {}).update(_parse_fields(nested[:-1]) if nested else {})
+    return tree
+
+
+def _select(value: Any, tree: dict) -> Any:
+    if not tree:
+        return value
+    if isinstance(value, list):
+        return [_select(item, tree) for item in value]
+    if not isinstance(value, dict):
+        return value
+    if "*" in tree:
+        # map keys, as in aggregated lists: items/*/disks(name)
+        return {key: _select(item, tree["*"]) for key, item in value.items()}
+    return {key: _select(value[key], subtree) for key, subtree in tree.items() if key in value}
+
+
+def partial_response(body: Any, fields: str | None) -> Any:
+    """Keep only `fields` of a response, as the API does for fields= and x-goog-fieldmask."""
+    return _select(body, _parse_fields(fields)) if fields else body
+
+
+def backend_from_spec(spec: str) -> FakeComputeBackend:
+    """Build a backend from GCP_UTILITIES_FAKE_BACKEND: "1" for defaults, or JSON keyword arguments,
+    e.g. '{"latency": 0.05, "ready_after": 3, "error_rate": 0.01}'."""
+    options = {"autocreate_sources": True}
+    if spec.strip() not in ("", "1", "true"):
+        options.update(json.loads(spec))
+    return FakeComputeBackend(**options)
+
+
+# ---- compute_v1 surface -----------------------------------------------------
+
+
+def _request_args(request: Any, kwargs: dict, *names: str) -> list:
+    # compute_v1 methods take either request=Message(...) or flattened keyword arguments
+    if request is None:
+        return [kwargs.get(name) for name in names]
+    if isinstance(request, dict):
+        return [request.get(name) for name in names]
+    return [getattr(request, name, None) for name in names]
+
+
+def _field_mask(kwargs: dict) -> str | None:
+    # records.field_mask() sends the partial response as call metadata
+    return dict(kwargs.get("metadata") or ()).get("x-goog-fieldmask")
+
+
+def _masked_items(items: list[dict], kwargs: dict) -> list[dict]:
+    return partial_response({"items": items}, _field_mask(kwargs)).get("items", [])
+
+
+class FakeExtendedOperation:
+    """Quacks like google.api_core.extended_operation.ExtendedOperation."""
+
+    def __init__(self, backend: FakeComputeBackend, project: str, body: dict, zone: str | None = None):
+        self._backend = backend
+        self._project = project
+        self._zone = zone
+        self._body = body
+
+    @property
+    def name(self) -> str:
+        return self._body["name"]
+
+    @property
+    def status(self) -> str:
+        return self._body["status"]
+
+    @property
+    def error_code(self) -> str | None:
+        errors = self._body.get("error", {}).get("errors", [])
+        return errors[0]["code"] if errors else None
+
+    @property
+    def error_message(self) -> str | None:
+        errors = self._body.get("error", {}).get("errors", [])
+        return errors[0]["message"] if errors else None
+
+    @property
+    def warnings(self) -> list:
+        return []
+
+    def _refresh(self) -> None:
+        method = "zoneOperations.get" if self._zone else "globalOperations.get"
+
+        def attempt() -> dict:
+            with timed_call(method):
+                try:
+                    return self._backend.get_operation(self._project, self.name, method)
+                except FakeApiError as e:
+                    raise api_core_error(e) from None
+
+        self._body = self._backend.guard.call(method, self._project, attempt)
+
+    def done(self, retry=None) -> bool:
+        if self._body["status"] != "DONE":
+            self._refresh()
+        return self._body["status"] == "DONE"
+
+    def exception(self, timeout=None):
+        return exceptions.from_http_status(400, self.error_message) if self.error_code else None
+
+    def result(self, timeout=None, retry=None, polling=None):
+        # same polling shape as api_core: jittered exponential backoff on operations.get
+        initial = getattr(polling, "_initial", 1.0)
+        maximum = getattr(polling, "_maximum", 20.0)
+        multiplier = getattr(polling, "_multiplier", 1.5)
+        # the polling predicate sees every "not complete yet", as under api_core
+        predicate = getattr(polling, "_predicate", None)
+        deadline = self._backend.now() + (timeout if timeout is not None else 900)
+        delay = initial
+        while not self.done():
+            if predicate is not None:
+                predicate(api_core_polling._OperationNotComplete())
+            if self._backend.now() >= deadline:
+                raise TimeoutError(
+                    f"Operation {self.name} did not complete within the designated timeout")
+            self._backend.sleep(random.uniform(0.0, delay))
+            delay = min(delay * multiplier, maximum)
+        if self.error_code:
+            raise self.exception()
+        return None
+
+
+class _FakeClient:
+    def __init__(self, backend: FakeComputeBackend):
+        self._backend = backend
+
+    def _run(self, method: str, fn: Callable, *args) -> Any:
+        # timed and guarded here like the REST transport does for real calls; args[0] is the project
+        def attempt() -> Any:
+            with timed_call(method):
+                try:
+                    return fn(*args)
+                except FakeApiError as e:
+                    raise api_core_error(e) from None
+
+        return self._backend.guard.call(method, args[0], attempt)
+
+
+class FakeDisksClient(_FakeClient):
+    def get(self, request=None, **kwargs) -> compute_v1.Disk:
+        project, zone, disk = _request_args(request, kwargs, "project", "zone", "disk")
+        return to_proto(compute_v1.Disk, partial_response(
+            self._run("disks.get", self._backend.get_disk, project, zone, disk), _field_mask(kwargs)))
+
+    def insert(self, request=None, **kwargs) -> FakeExtendedOperation:
+        project, zone, disk_resource = _request_args(
+            request, kwargs, "project", "zone", "disk_resource")
+        body = disk_resource if isinstance(disk_resource, dict) else from_proto(disk_resource)
+        operation = self._run("disks.insert", self._backend.insert_disk, project, zone, body)
+        return FakeExtendedOperation(self._backend, project, operation, zone)
+
+    def delete(self, request=None, **kwargs) -> FakeExtendedOperation:
+        project, zone, disk = _request_args(request, kwargs, "project", "zone", "disk")
+        operation = self._run("disks.delete", self._backend.delete_disk, project, zone, disk)
+        return FakeExtendedOperation(self._backend, project, operation, zone)
+
+    def list(self, request=None, **kwargs) -> list[compute_v1.Disk]:
+        project, zone, filter, order_by = _request_args(
+            request, kwargs, "project", "zone", "filter", "order_by")
+        disks = self._run("disks.list", self._backend.list_disks, project, zone, filter or None, order_by or None)
+        return [to_proto(compute_v1.Disk, d) for d in _masked_items(disks, kwargs)]
+
+    def aggregated_list(self, request=None, **kwargs) -> list[tuple[str, compute_v1.DisksScopedList]]:
+        project, filter = _request_args(request, kwargs, "project", "filter")
+        scopes = self._run("disks.aggregatedList", self._backend.aggregated_list_disks, project, filter or None)
+        return [(scope, compute_v1.DisksScopedList(disks=[to_proto(compute_v1.Disk, d) for d in disks]))
+                for scope, disks in scopes.items()]
+
+
+class FakeRegionDisksClient(_FakeClient):
+    # regional disks live in the same table, keyed by region instead of zone
+    def get(self, request=None, **kwargs) -> compute_v1.Disk:
+        project, region, disk = _request_args(request, kwargs, "project", "region", "disk")
+        return to_proto(compute_v1.Disk, partial_response(
+            self._run("regionDisks.get", self._backend.get_disk, project, region, disk), _field_mask(kwargs)))
+
+
+class FakeSnapshotsClient(_FakeClient):
+    def get(self, request=None, **kwargs) -> compute_v1.Snapshot:
+        project, snapshot = _request_args(request, kwargs, "project", "snapshot")
+        return to_proto(compute_v1.Snapshot, partial_response(
+            self._run("snapshots.get", self._backend.get_snapshot, project, snapshot), _field_mask(kwargs)))
+
+    def insert(self, request=None, **kwargs) -> FakeExtendedOperation:
+        project, snapshot_resource = _request_args(request, kwargs, "project", "snapshot_resource")
+        body = snapshot_resource if isinstance(snapshot_resource, dict) else from_proto(snapshot_resource)
+        operation = self._run("snapshots.insert", self._backend.insert_snapshot, project, body)
+        return FakeExtendedOperation(self._backend, project, operation)
+
+    def delete(self, request=None, **kwargs) -> FakeExtendedOperation:
+        project, snapshot = _request_args(request, kwargs, "project", "snapshot")
+        operation = self._run("snapshots.delete", self._backend.delete_snapshot, project, snapshot)
+        return FakeExtendedOperation(self._backend, project, operation)
+
+    def list(self, request=None, **kwargs) -> list[compute_v1.Snapshot]:
+        project, filter, order_by = _request_args(request, kwargs, "project", "filter", "order_by")
+        snapshots = self._run("snapshots.list", self._backend.list_snapshots, project, filter or None, order_by or None)
+        return [to_proto(compute_v1.Snapshot, s) for s in _masked_items(snapshots, kwargs)]
+
+
+class FakeZoneOperationsClient(_FakeClient):
+    def get(self, request=None, **kwargs) -> compute_v1.Operation:
+        project, operation = _request_args(request, kwargs, "project", "operation")
+        return to_proto(compute_v1.Operation, self._run("zoneOperations.get", self._backend.get_operation, project, operation))
+
+    def wait(self, request=None, **kwargs) -> compute_v1.Operation:
+        project, operation = _request_args(request, kwargs, "project", "operation")
+        return to_proto(compute_v1.Operation, self._run("zoneOperations.wait", self._backend.wait_operation, project, operation))
+
+
+class FakeGlobalOperationsClient(_FakeClient):
+    def get(self, request=None, **kwargs) -> compute_v1.Operation:
+        project, operation = _request_args(request, kwargs, "project", "operation")
+        return to_proto(compute_v1.Operation, self._run(
+            "globalOperations.get",
+            self._backend.get_operation, project, operation, "globalOperations.get"))
+
+    def wait(self, request=None, **kwargs) -> compute_v1.Operation:
+        project, operation = _request_args(request, kwargs, "project", "operation")
+        return to_proto(compute_v1.Operation, self._run(
+            "globalOperations.wait",
+            self._backend.wait_operation, project, operation, "globalOperations.wait"))
+
+
+class FakeZonesClient(_FakeClient):
+    def get(self, request=None, **kwargs) -> compute_v1.Zone:
+        project, zone = _request_args(request, kwargs, "project", "zone")
+        return to_proto(compute_v1.Zone, partial_response(
+            self._run("zones.get", self._backend.get_zone, project, zone), _field_mask(kwargs)))
+
+
+class FakeDiskTypesClient(_FakeClient):
+    def get(self, request=None, **kwargs) -> compute_v1.DiskType:
+        project, zone, disk_type = _request_args(request, kwargs, "project", "zone", "disk_type")
+        return to_proto(compute_v1.DiskType, partial_response(self._run(
+            "diskTypes.get", self._backend.get_disk_type, project, zone, disk_type), _field_mask(kwargs)))
+
+
+CLIENT_CLASSES = {
+    "DisksClient": FakeDisksClient,
+    "RegionDisksClient": FakeRegionDisksClient,
+    "SnapshotsClient": FakeSnapshotsClient,
+    "ZoneOperationsClient": FakeZoneOperationsClient,
+    "GlobalOperationsClient": FakeGlobalOperationsClient,
+    "ZonesClient": FakeZonesClient,
+    "DiskTypesClient": FakeDiskTypesClient,
+}
+
+
+# ---- discovery surface --------------------------------------------------------
+
+
+class FakeRequest:
+    """Quacks like googleapiclient.http.HttpRequest: nothing happens until execute()."""
+
+    def __init__(self, backend: FakeComputeBackend, method_id: str, project: str, fn: Callable,
+                 page: dict | None = None):
+        self.methodId = method_id
+        self._backend = backend
+        self._project = project
+        self._fn = fn
+        # pagination arguments, kept so *_next() can ask for the following page
+        self._page = page
+
+    def execute(self, http=None, num_retries: int = 0) -> Any:
+        method = self.methodId.removeprefix("compute.")
+
+        def attempt() -> Any:
+            with timed_call(method):
+                try:
+                    return self._fn()
+                except FakeApiError as e:
+                    raise http_error(e) from None
+
+        return self._backend.guard.call(method, self._project, attempt)
+
+
+def _paged(backend: FakeComputeBackend, method_id: str, fetch: Callable[[], list], max_results: int | None,
+           page_token: str | None, list_args: dict, fields: str | None = None) -> FakeRequest:
+    # items are fetched when the page is executed; the page token is simply the offset
+    size = min(max_results or 500, 500)
+    start = int(page_token or 0)
+
+    def run() -> dict:
+        items = fetch()
+        response: dict = {"items": items[start:start + size]}
+        if start + size < len(items):
+            response["nextPageToken"] = str(start + size)
+        return partial_response(response, fields)
+
+    return FakeRequest(backend, method_id, list_args["project"], run,
+                       {"maxResults": size, "fields": fields, **list_args})
+
+
+def _next_page(collection_method: Callable, previous_request: FakeRequest,
+               previous_response: dict) -> FakeRequest | None:
+    token = previous_response.get("nextPageToken")
+    if not token:
+        return None
+    return collection_method(pageToken=token, **previous_request._page)
+
+
+class FakeDisks:
+    def __init__(self, backend: FakeComputeBackend):
+        self._backend = backend
+
+    def get(self, project, zone, disk, **kwargs) -> FakeRequest:
+        return FakeRequest(self._backend, "compute.disks.get", project,
+                           lambda: partial_response(self._backend.get_disk(project, zone, disk), kwargs.get("fields")))
+
+    def insert(self, project, zone, body, **kwargs) -> FakeRequest:
+        return FakeRequest(self._backend, "compute.disks.insert", project,
+                           lambda: self._backend.insert_disk(project, zone, body))
+
+    def delete(self, project, zone, disk, **kwargs) -> FakeRequest:
+        return FakeRequest(self._backend, "compute.disks.delete", project,
+                           lambda: self._backend.delete_disk(project, zone, disk))
+
+    def list(self, project, zone, filter=None, orderBy=None, maxResults=None, pageToken=None, **kwargs):
+        return _paged(self._backend, "compute.disks.list",
+                      lambda: self._backend.list_disks(project, zone, filter, orderBy),
+                      maxResults, pageToken,
+                      {"project": project, "zone": zone, "filter": filter, "orderBy": orderBy}, kwargs.get("fields"))
+
+    def list_next(self, previous_request, previous_response):
+        return _next_page(self.list, previous_request, previous_response)
+
+    def aggregatedList(self, project, filter=None, maxResults=None, pageToken=None, **kwargs):
+        # the whole aggregated view comes back as one page keyed by "zones/<zone>"
+        def run() -> dict:
+            scopes = self._backend.aggregated_list_disks(project, filter)
+            return partial_response({"items": {scope: {"disks": disks} for scope, disks in scopes.items()}},
+                                    kwargs.get("fields"))
+        return FakeRequest(self._backend, "compute.disks.aggregatedList", project, run)
+
+    def aggregatedList_next(self, previous_request, previous_response):
+        return None
+
+
+class FakeSnapshots:
+    def __init__(self, backend: FakeComputeBackend):
+        self._backend = backend
+
+    def get(self, project, snapshot, **kwargs) -> FakeRequest:
+        return FakeRequest(self._backend, "compute.snapshots.get", project,
+                           lambda: partial_response(self._backend.get_snapshot(project, snapshot), kwargs.get("fields")))
+
+    def insert(self, project, body, **kwargs) -> FakeRequest:
+        return FakeRequest(self._backend, "compute.snapshots.insert", project,
+                           lambda: self._backend.insert_snapshot(project, body))
+
+    def delete(self, project, snapshot, **kwargs) -> FakeRequest:
+        return FakeRequest(self._backend, "compute.snapshots.delete", project,
+                           lambda: self._backend.delete_snapshot(project, snapshot))
+
+    def list(self, project, filter=None, orderBy=None, maxResults=None, pageToken=None, **kwargs):
+        return _paged(self._backend, "compute.snapshots.list",
+                      lambda: self._backend.list_snapshots(project, filter, orderBy),
+                      maxResults, pageToken, {"project": project, "filter": filter, "orderBy": orderBy},
+                      kwargs.get("fields"))
+
+    def list_next(self, previous_request, previous_response):
+        return _next_page(self.list, previous_request, previous_response)
+
+
+class FakeZoneOperations:
+    def __init__(self, backend: FakeComputeBackend):
+        self._backend = backend
+
+    def get(self, project, zone, operation, **kwargs) -> FakeRequest:
+        return FakeRequest(self._backend, "compute.zoneOperations.get", project,
+                           lambda: self._backend.get_operation(project, operation))
+
+    def wait(self, project, zone, operation, **kwargs) -> FakeRequest:
+        return FakeRequest(self._backend, "compute.zoneOperations.wait", project,
+                           lambda: self._backend.wait_operation(project, operation))
+
+
+class FakeGlobalOperations:
+    def __init__(self, backend: FakeComputeBackend):
+        self._backend = backend
+
+    def get(self, project, operation, **kwargs) -> FakeRequest:
+        return FakeRequest(self._backend, "compute.globalOperations.get", project,
+                           lambda: self._backend.get_operation(project, operation, "globalOperations.get"))
+
+    def wait(self, project, operation, **kwargs) -> FakeRequest:
+        return FakeRequest(self._backend, "compute.globalOperations.wait", project,
+                           lambda: self._backend.wait_operation(project, operation, "globalOperations.wait"))
+
+
+class FakeBatchRequest:
+    """Quacks like googleapiclient.http.BatchHttpRequest."""
+
+    def __init__(self, backend: FakeComputeBackend, callback: Callable | None = None):
+        self._backend = backend
+        self._callback = callback
+        self._requests: dict[str, tuple[FakeRequest, Callable | None]] = {}
+
+    def add(self, request: FakeRequest, callback: Callable | None = None, request_id: str | None = None) -> None:
+        request_id = request_id or str(len(self._requests) + 1)
+        if request_id in self._requests:
+            raise KeyError(f"A request with this ID already exists: {request_id}")
+        self._requests[request_id] = (request, callback)
+
+    def execute(self, http=None) -> None:
+        if not self._requests:
+            return
+        project = next(iter(self._requests.values()))[0]._project
+        try:
+            outcomes = self._backend.run_batch(project, [request._fn for request, _ in self._requests.values()])
+        except FakeApiError as e:
+            raise http_error(e) from None
+        for (request_id, (_, callback)), (response, error) in zip(self._requests.items(), outcomes):
+            exception = http_error(error) if error else None
+            for fn in (callback, self._callback):
+                if fn is not None:
+                    fn(request_id, response, exception)
+
+
+class FakeService:
+    """Quacks like build('compute', 'v1') for the collections the scripts use."""
+
+    def __init__(self, backend: FakeComputeBackend):
+        self._backend = backend
+
+    @property
+    def guard(self):
+        # rate limits and retries on the backend's simulated clock, see http_batch.py
+        return self._backend.guard
+
+    def new_batch_http_request(self, callback: Callable | None = None) -> FakeBatchRequest:
+        return FakeBatchRequest(self._backend, callback)
+
+    def disks(self) -> FakeDisks:
+        return FakeDisks(self._backend)
+
+    def snapshots(self) -> FakeSnapshots:
+        return FakeSnapshots(self._backend)
+
+    def zoneOperations(self) -> FakeZoneOperations:
+        return FakeZoneOperations(self._backend)
+
+    def globalOperations(self) -> FakeGlobalOperations:
+        return FakeGlobalOperations(self._backend)
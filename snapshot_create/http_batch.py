@@ -0,0 +1,138 @@
+#! /usr/bin/env python
+from __future__ import annotations
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Any
+from googleapiclient.http import MAX_BATCH_LIMIT
+from .batch import BatchResult
+from .metrics import METRICS, error_code, record_call
+from .ratelimit import MUTATION, CircuitOpenError, Guard, category_of, get_guard
+
+# Many discovery calls per HTTP round trip.
+#
+# service.new_batch_http_request() packs up to MAX_BATCH_LIMIT (1000) calls
+# into one multipart request to the compute batch endpoint. execute_batched()
+# chunks a list of calls into such batches and gives every call its own
+# result or error, so one failed item doesn't fail its neighbours. Items that
+# failed transiently (throttled, or a 5xx on a read) are sent again in a later
+# batch with the backoff of ratelimit.py. A failure of the batch request
+# itself counts once against the circuit breaker, and its calls are retried
+# together. Every item still counts against the project's quota, so each one
+# is charged a token before its batch goes out.
+
+# calls per batch request; the API takes at most MAX_BATCH_LIMIT
+BATCH_SIZE = 100
+
+
+@dataclass
+class BatchCall:
+    """One call of a batch: the unexecuted discovery request plus what it is for."""
+    key: str
+    # "disks.insert", for rate limits, retries and metrics
+    method: str
+    project: str
+    request: Any = field(repr=False)
+    entry: dict = field(default_factory=dict, repr=False)
+
+
+def _chunks(calls: list[BatchCall], size: int) -> list[list[BatchCall]]:
+    return [calls[i:i + size] for i in range(0, len(calls), size)]
+
+
+def _execute_chunk(service, calls: list[BatchCall]
+                   ) -> tuple[dict[str, tuple[Any, BaseException | None]], BaseException | None, float]:
+    """Send one batch; the per-call outcomes, or the error of the batch request itself."""
+    outcomes: dict[str, tuple[Any, BaseException | None]] = {}
+
+    def callback(request_id: str, response: Any, exception: BaseException | None) -> None:
+        outcomes[request_id] = (response, exception)
+
+    batch = service.new_batch_http_request(callback=callback)
+    for call in calls:
+        batch.add(call.request, request_id=call.key)
+    start = time.monotonic()
+    envelope_error = None
+    try:
+        batch.execute()
+    except Exception as e:
+        # the batch itself failed (connection, auth, 5xx on the envelope)
+        logging.warning(f"Batch of {len(calls)} calls failed: {e}")
+        envelope_error = e
+    elapsed = time.monotonic() - start
+    METRICS.inc("batch_requests_total")
+    for call in calls:
+        if envelope_error is None:
+            outcomes.setdefault(call.key, (None, RuntimeError(f"No response for {call.key} in its batch")))
+        error = envelope_error or outcomes[call.key][1]
+        record_call(call.method, elapsed, error_code(error) if error else None)
+    return outcomes, envelope_error, elapsed
+
+
+def _envelope_method(calls: list[BatchCall]) -> str:
+    # a failed batch request is retried only as far as its least retryable call allows
+    return next((call.method for call in calls if category_of(call.method) == MUTATION), calls[0].method)
+
+
+def execute_batched(service, calls: list[BatchCall], batch_size: int = BATCH_SIZE,
+                    guard: Guard | None = None) -> list[BatchResult]:
+    """Execute calls in batches of `batch_size` and return one BatchResult per call, in order.
+
+    Keys must be unique; they are the batch request ids.
+    """
+    # the fake backend's service brings a guard on its simulated clock
+    guard = guard or getattr(service, "guard", None) or get_guard()
+    batch_size = max(1, min(batch_size, MAX_BATCH_LIMIT))
+    results: dict[str, BatchResult] = {}
+    elapsed: dict[str, float] = {}
+    pending = list(calls)
+    attempt = 0
+    while pending:
+        attempt += 1
+        retry: list[BatchCall] = []
+        delays = []
+        for chunk in _chunks(pending, batch_size):
+            runnable = []
+            for call in chunk:
+                try:
+                    guard.admit(call.method, call.project)
+                    runnable.append(call)
+                except CircuitOpenError as e:
+                    results[call.key] = BatchResult(call.key, call.entry, error=e)
+            if not runnable:
+                continue
+            outcomes, envelope_error, seconds = _execute_chunk(service, runnable)
+            for call in runnable:
+                elapsed[call.key] = elapsed.get(call.key, 0.0) + seconds
+            if envelope_error is not None:
+                # one failure of one round trip: charged once per project, and the chunk retried as a unit
+                method = _envelope_method(runnable)
+                chunk_delays = [guard.failed(method, project, envelope_error, attempt)
+                                for project in dict.fromkeys(call.project for call in runnable)]
+                if None in chunk_delays:
+                    for call in runnable:
+                        results[call.key] = BatchResult(call.key, call.entry, error=envelope_error,
+                                                        elapsed=elapsed[call.key])
+                else:
+                    retry.extend(runnable)
+                    delays.append(max(chunk_delays))
+                continue
+            for call in runnable:
+                response, error = outcomes[call.key]
+                if error is None:
+                    guard.succeeded(call.project)
+                    results[call.key] = BatchResult(call.key, call.entry, value=response, elapsed=elapsed[call.key])
+                    continue
+                delay = guard.failed(call.method, call.project, error, attempt)
+                if delay is None:
+                    results[call.key] = BatchResult(call.key, call.entry, error=error, elapsed=elapsed[call.key])
+                else:
+                    retry.append(call)
+                    delays.append(delay)
+        if retry:
+            # one pause for the whole next round, as long as its slowest item asks for
+            delay = max(delays)
+            logging.warning(f"{len(retry)} batched calls failed transiently; retry {attempt} in {delay:.1f}s")
+            guard.sleep(delay)
+        pending = retry
+    return [results[call.key] for call in calls]
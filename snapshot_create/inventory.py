@@ -0,0 +1,358 @@
+#! /usr/bin/env python
+from __future__ import annotations
+import argparse
+import json
+import logging
+import os
+import pprint as pp
+import sqlite3
+import sys
+import threading
+import time
+from datetime import datetime
+from .clients import get_compute_service
+from .list_snapshot import iter_snapshots
+from .records import DiskRecord, SnapshotRecord
+
+# Local SQLite cache of snapshot and disk metadata.
+#
+# A project's listing is refreshed incrementally: only resources created since
+# the newest one already cached (or since the oldest one still not READY) are
+# fetched. Every `ttl` seconds the project is fully re-listed instead, which is
+# how deletions and status changes of older resources get picked up.
+
+DEFAULT_PATH = os.environ.get(
+    "GCP_UTILITIES_INVENTORY",
+    os.path.join(os.path.expanduser("~"), ".cache",
+                 "gcp-utilities", "inventory.sqlite3"),
+)
+DEFAULT_TTL = 3600  # seconds before a project is fully re-listed
+DEFAULT_REFRESH_INTERVAL = 60  # seconds an incremental refresh stays fresh
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS snapshots (
+    project TEXT NOT NULL,
+    name TEXT NOT NULL,
+    source_disk TEXT,
+    status TEXT,
+    disk_size_gb INTEGER,
+    storage_bytes INTEGER,
+    labels TEXT,
+    self_link TEXT,
+    creation_timestamp TEXT,
+    created_at REAL,
+    fetched_at REAL NOT NULL,
+    PRIMARY KEY (project, name)
+);
+CREATE INDEX IF NOT EXISTS snapshots_by_name ON snapshots (name);
+CREATE INDEX IF NOT EXISTS snapshots_by_source_disk ON snapshots (source_disk, created_at);
+CREATE INDEX IF NOT EXISTS snapshots_by_created ON snapshots (project, created_at);
+
+CREATE TABLE IF NOT EXISTS disks (
+    project TEXT NOT NULL,
+    zone TEXT NOT NULL,
+    name TEXT NOT NULL,
+    status TEXT,
+    type TEXT,
+    size_gb INTEGER,
+    source_snapshot TEXT,
+    users TEXT,
+    labels TEXT,
+    self_link TEXT,
+    creation_timestamp TEXT,
+    created_at REAL,
+    fetched_at REAL NOT NULL,
+    PRIMARY KEY (project, zone, name)
+);
+CREATE INDEX IF NOT EXISTS disks_by_name ON disks (name);
+CREATE INDEX IF NOT EXISTS disks_by_zone ON disks (project, zone);
+CREATE INDEX IF NOT EXISTS disks_by_created ON disks (project, created_at);
+
+CREATE TABLE IF NOT EXISTS sync_state (
+    kind TEXT NOT NULL,
+    project TEXT NOT NULL,
+    last_creation_timestamp TEXT,
+    synced_at REAL NOT NULL,
+    full_synced_at REAL NOT NULL,
+    PRIMARY KEY (kind, project)
+);
+"""
+
+
+def _epoch(timestamp: str | None) -> float | None:
+    return datetime.fromisoformat(timestamp).timestamp() if timestamp else None
+
+
+def _last_segment(url: str | None) -> str | None:
+    # ".../zones/us-central1-a/diskTypes/pd-ssd" -> "pd-ssd"
+    return url.rsplit("/", 1)[-1] if url else None
+
+
+def _snapshot_record(row: dict) -> SnapshotRecord:
+    # back to the shape snapshots.list returns: int64 fields as strings, no labels when there are none
+    return SnapshotRecord.from_api({
+        "name": row["name"],
+        "status": row["status"],
+        "creationTimestamp": row["creation_timestamp"],
+        "sourceDisk": row["source_disk"],
+        "diskSizeGb": None if row["disk_size_gb"] is None else str(row["disk_size_gb"]),
+        "storageBytes": None if row["storage_bytes"] is None else str(row["storage_bytes"]),
+        "labels": json.loads(row["labels"]) if row["labels"] else None,
+        "selfLink": row["self_link"],
+    })
+
+
+def iter_disks(proj: str, filter: str | None = None, service=None):
+    """Yield (zone, DiskRecord) for every disk in the project through paginated disks.aggregatedList."""
+    service = service or get_compute_service()
+    disks = service.disks()
+    kwargs = {"project": proj, "returnPartialSuccess": True}
+    if filter:
+        kwargs["filter"] = filter
+    request = disks.aggregatedList(**kwargs)
+    while request is not None:
+        page = request.execute()
+        for scope, scoped in page.get("items", {}).items():
+            # scope looks like "zones/us-central1-a"
+            zone = sys.intern(scope.rsplit("/", 1)[-1])
+            for disk in scoped.get("disks", []):
+                yield zone, DiskRecord.from_api(disk)
+        request = disks.aggregatedList_next(
+            previous_request=request, previous_response=page)
+
+
+class Inventory:
+    """SQLite-backed snapshot/disk metadata with incremental refresh and TTL expiry."""
+
+    def __init__(
+        self,
+        path: str = DEFAULT_PATH,
+        ttl: float = DEFAULT_TTL,
+        refresh_interval: float = DEFAULT_REFRESH_INTERVAL,
+        service=None,
+    ):
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.ttl = ttl
+        self.refresh_interval = refresh_interval
+        self._service = service
+        self._lock = threading.RLock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        if path != ":memory:":
+            self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(SCHEMA)
+
+    def close(self) -> None:
+        self._db.close()
+
+    def __enter__(self) -> Inventory:
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    # ---- sync -------------------------------------------------------------
+
+    def _state(self, table: str, project: str) -> sqlite3.Row | None:
+        return self._db.execute(
+            "SELECT * FROM sync_state WHERE kind = ? AND project = ?", (table, project)).fetchone()
+
+    def _since(self, table: str, project: str, state: sqlite3.Row) -> tuple[str, str] | None:
+        # re-fetch from the oldest resource still in flight, else from the newest one cached
+        row = self._db.execute(
+            f"SELECT creation_timestamp FROM {table} WHERE project = ? AND status != 'READY' "
+            "ORDER BY created_at LIMIT 1", (project,)).fetchone()
+        if row and row["creation_timestamp"]:
+            return ">=", row["creation_timestamp"]
+        if state["last_creation_timestamp"]:
+            return ">", state["last_creation_timestamp"]
+        return None
+
+    def _refresh(self, table: str, project: str, fetch, upsert, timestamp_of, force_full: bool) -> int:
+        now = time.time()
+        with self._lock:
+            state = self._state(table, project)
+            if state is not None and not force_full and now - state["synced_at"] < self.refresh_interval:
+                return 0
+            full = force_full or state is None or now - \
+                state["full_synced_at"] >= self.ttl
+            filter = None
+            if not full:
+                since = self._since(table, project, state)
+                if since:
+                    filter = f'creationTimestamp {since[0]} "{since[1]}"'
+            last = None if full else state["last_creation_timestamp"]
+            last_epoch = _epoch(last) or 0.0
+            count = 0
+            with self._db:
+                if full:
+                    self._db.execute(
+                        f"DELETE FROM {table} WHERE project = ?", (project,))
+                for item in fetch(filter):
+                    upsert(project, item, now)
+                    count += 1
+                    created = timestamp_of(item)
+                    if (_epoch(created) or 0.0) > last_epoch:
+                        last, last_epoch = created, _epoch(created)
+                self._db.execute(
+                    "INSERT OR REPLACE INTO sync_state VALUES (?, ?, ?, ?, ?)",
+                    (table, project, last, now,
+                     now if full else state["full_synced_at"]),
+                )
+            logging.debug(
+                f"Inventory {'full' if full else 'incremental'} refresh of {table} in {project}: {count} item(s)")
+            return count
+
+    def refresh_snapshots(self, project: str, force_full: bool = False) -> int:
+        return self._refresh(
+            "snapshots", project,
+            lambda filter: iter_snapshots(
+                project, filter=filter, service=self._service),
+            self.put_snapshot,
+            lambda snapshot: snapshot.get("creationTimestamp"),
+            force_full)
+
+    def refresh_disks(self, project: str, force_full: bool = False) -> int:
+        return self._refresh(
+            "disks", project,
+            lambda filter: iter_disks(
+                project, filter=filter, service=self._service),
+            lambda project, item, now: self.put_disk(
+                project, item[0], item[1], now),
+            lambda item: item[1].get("creationTimestamp"),
+            force_full)
+
+    def expire(self) -> None:
+        # drop rows nobody has re-listed within the TTL
+        cutoff = time.time() - self.ttl
+        with self._lock, self._db:
+            self._db.execute(
+                "DELETE FROM snapshots WHERE fetched_at < ?", (cutoff,))
+            self._db.execute("DELETE FROM disks WHERE fetched_at < ?", (cutoff,))
+            self._db.execute(
+                "DELETE FROM sync_state WHERE full_synced_at < ?", (cutoff,))
+
+    # ---- writes -----------------------------------------------------------
+
+    def put_snapshot(self, project: str, snapshot: dict, fetched_at: float | None = None) -> None:
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO snapshots VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    project,
+                    snapshot["name"],
+                    snapshot.get("sourceDisk"),
+                    snapshot.get("status"),
+                    int(snapshot["diskSizeGb"]) if snapshot.get(
+                        "diskSizeGb") else None,
+                    int(snapshot["storageBytes"]) if snapshot.get(
+                        "storageBytes") else None,
+                    json.dumps(snapshot.get("labels", {})),
+                    snapshot.get("selfLink"),
+                    snapshot.get("creationTimestamp"),
+                    _epoch(snapshot.get("creationTimestamp")),
+                    fetched_at or time.time(),
+                ),
+            )
+
+    def put_disk(self, project: str, zone: str, disk: dict, fetched_at: float | None = None) -> None:
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO disks VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    project,
+                    zone,
+                    disk["name"],
+                    disk.get("status"),
+                    _last_segment(disk.get("type")),
+                    int(disk["sizeGb"]) if disk.get("sizeGb") else None,
+                    disk.get("sourceSnapshot"),
+                    json.dumps(disk.get("users", [])),
+                    json.dumps(disk.get("labels", {})),
+                    disk.get("selfLink"),
+                    disk.get("creationTimestamp"),
+                    _epoch(disk.get("creationTimestamp")),
+                    fetched_at or time.time(),
+                ),
+            )
+
+    def forget_snapshot(self, project: str, name: str) -> None:
+        with self._lock, self._db:
+            self._db.execute(
+                "DELETE FROM snapshots WHERE project = ? AND name = ?", (project, name))
+
+    def forget_disk(self, project: str, zone: str, name: str) -> None:
+        with self._lock, self._db:
+            self._db.execute(
+                "DELETE FROM disks WHERE project = ? AND zone = ? AND name = ?", (project, zone, name))
+
+    # ---- lookups ----------------------------------------------------------
+
+    def _rows(self, sql: str, params: tuple) -> list[dict]:
+        with self._lock:
+            return [dict(row) for row in self._db.execute(sql, params)]
+
+    def find_snapshots(self, project: str, name: str | None = None, source_disk: str | None = None,
+                       status: str | None = None, limit: int | None = None) -> list[SnapshotRecord]:
+        """Snapshots of a project, newest first, as the same SnapshotRecords a listing returns.
+        `name` may use * as a wildcard; `source_disk` matches a full URL or a trailing
+        '.../zones/ZONE/disks/NAME' part."""
+        self.refresh_snapshots(project)
+        sql = "SELECT * FROM snapshots WHERE project = ?"
+        params: list = [project]
+        if name:
+            sql += " AND name GLOB ?"
+            params.append(name)
+        if source_disk:
+            sql += " AND (source_disk = ? OR source_disk LIKE ?)"
+            params += [source_disk, f"%/{source_disk}"]
+        if status:
+            sql += " AND status = ?"
+            params.append(status)
+        sql += " ORDER BY created_at DESC"
+        if limit:
+            sql += f" LIMIT {int(limit)}"
+        return [_snapshot_record(row) for row in self._rows(sql, tuple(params))]
+
+    def latest_snapshot(self, project: str, name: str | None = None,
+                        source_disk: str | None = None) -> SnapshotRecord | None:
+        rows = self.find_snapshots(
+            project, name=name, source_disk=source_disk, limit=1)
+        return rows[0] if rows else None
+
+    def snapshot_exists(self, project: str, name: str) -> bool:
+        self.refresh_snapshots(project)
+        return bool(self._rows(
+            "SELECT 1 FROM snapshots WHERE project = ? AND name = ?", (project, name)))
+
+    def get_disk(self, project: str, zone: str, name: str) -> dict | None:
+        self.refresh_disks(project)
+        rows = self._rows(
+            "SELECT * FROM disks WHERE project = ? AND zone = ? AND name = ?", (project, zone, name))
+        return rows[0] if rows else None
+
+    def disk_exists(self, project: str, zone: str, name: str) -> bool:
+        return self.get_disk(project, zone, name) is not None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Refresh and query the local snapshot/disk inventory.")
+    parser.add_argument("-p", "--project_id",
+                        required=True, help="GCP Project ID")
+    parser.add_argument("--path", default=DEFAULT_PATH,
+                        help="Inventory database file")
+    parser.add_argument("--full", action="store_true",
+                        help="Re-list everything instead of refreshing incrementally")
+    parser.add_argument("--latest", metavar="DISK",
+                        help="Show the latest snapshot of this source disk")
+    args = parser.parse_args()
+
+    with Inventory(args.path) as inventory:
+        inventory.expire()
+        inventory.refresh_snapshots(args.project_id, force_full=args.full)
+        inventory.refresh_disks(args.project_id, force_full=args.full)
+        if args.latest:
+            pp.pprint(inventory.latest_snapshot(
+                args.project_id, source_disk=args.latest))
@@ -0,0 +1,111 @@
+#! /usr/bin/env python
+from __future__ import annotations
+import json
+import logging
+import os
+import threading
+import time
+from typing import Any
+from .plan import ALREADY_EXISTS, CREATE, SKIP, Plan
+
+# Append-only run journal, so an interrupted batch can be resumed.
+#
+# Every state change of a resource is one JSON line:
+#   {"t": ..., "kind": "disks", "key": "us-central1-a/vm-2", "state": "operation", "operation": "operation-123", ...}
+# Replaying the file gives the last state of each resource. A resumed run
+# skips what is READY and re-attaches to what was submitted but never
+# finished, instead of inserting it again. Keys are the plan keys
+# (plan.disk_key / plan.snapshot_key).
+
+SNAPSHOTS = "snapshots"
+DISKS = "disks"
+
+SUBMITTED = "submitted"
+OPERATION = "operation"
+READY = "ready"
+FAILED = "failed"
+
+
+def load(path: str) -> dict[tuple[str, str], dict]:
+    """Replay a journal file into {(kind, key): latest merged record}."""
+    entries: dict[tuple[str, str], dict] = {}
+    if not os.path.exists(path):
+        return entries
+    with open(path, encoding="utf-8") as f:
+        for number, line in enumerate(f, 1):
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # a crash can leave the last line half written
+                logging.warning(f"Ignoring unreadable journal line {number} in {path}")
+                continue
+            key = (record["kind"], record["key"])
+            entries[key] = {**entries.get(key, {}), **record}
+    return entries
+
+
+class Journal:
+    """Records resource state transitions to `path`; with resume=True the existing file is replayed first."""
+
+    def __init__(self, path: str, resume: bool = False, fsync: bool = True):
+        self.path = path
+        self.fsync = fsync
+        self._lock = threading.Lock()
+        self.entries = load(path) if resume else {}
+        # a fresh run starts a fresh journal
+        self._file = open(path, "a" if resume else "w", encoding="utf-8")
+
+    def record(self, kind: str, key: str, state: str, **fields: Any) -> None:
+        record = {"t": round(time.time(), 3), "kind": kind, "key": key, "state": state, **fields}
+        line = json.dumps(record) + "\n"
+        with self._lock:
+            merged = {**self.entries.get((kind, key), {}), **record}
+            # an error from an earlier attempt doesn't belong to the new state
+            if state != FAILED:
+                merged.pop("error", None)
+            self.entries[(kind, key)] = merged
+            self._file.write(line)
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+
+    def state(self, kind: str, key: str) -> str | None:
+        entry = self.entries.get((kind, key))
+        return entry["state"] if entry else None
+
+    def is_done(self, kind: str, key: str) -> bool:
+        return self.state(kind, key) == READY
+
+    def pending(self, kind: str, key: str) -> dict | None:
+        """The record of a resource that was submitted but never reached READY or FAILED."""
+        entry = self.entries.get((kind, key))
+        return entry if entry and entry["state"] in (SUBMITTED, OPERATION) else None
+
+    def close(self) -> None:
+        self._file.close()
+
+    def __enter__(self) -> Journal:
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def entries_to_run(plan: Plan, journal: Journal | None) -> list[dict]:
+    """Config entries a (possibly resumed) run still has to work on.
+
+    That is the plan's create entries, minus what the journal already has as
+    READY, plus resources the plan skipped because they exist but the journal
+    shows as still in flight, so they are waited on again.
+    """
+    if journal is None:
+        return plan.to_create
+    entries = []
+    for item in plan.items:
+        if journal.is_done(plan.kind, item.key):
+            continue
+        if item.action == CREATE:
+            entries.append(item.entry)
+        elif item.action == SKIP and item.reason == ALREADY_EXISTS and journal.pending(plan.kind, item.key):
+            entries.append(item.entry)
+    return entries
@@ -2,31 +2,123 @@
 
 
 # from google.cloud import compute_v1
+from __future__ import annotations
+import argparse
+import heapq
 import logging
-from google.auth import default
-from googleapiclient.discovery import build
 import pprint as pp
+import sys
+from datetime import datetime
+from typing import Iterable, Iterator
+from .clients import get_compute_service
+from .records import SNAPSHOT_LIST_FIELDS, SnapshotRecord
 # make sure to set your account as gcloud default auth login
 
 # Set the logging level to DEBUG
 logging.basicConfig(level=logging.DEBUG)
 
+# snapshots.list returns at most 500 items per page
+MAX_PAGE_SIZE = 500
 
-def list_snapshots(proj: str, filter: str):
+
+def creation_time(snapshot: dict) -> datetime:
+    # creationTimestamp carries a UTC offset ("...-07:00"), so compare parsed times, not strings
+    return datetime.fromisoformat(snapshot["creationTimestamp"])
+
+
+def iter_snapshots(
+    proj: str,
+    filter: str | None = None,
+    order_by: str | None = None,
+    max_results: int = MAX_PAGE_SIZE,
+    service=None,
+) -> Iterator[SnapshotRecord]:
+    """Yield every snapshot in the project, fetching the next page only when the previous one is used up.
+
+    Only the fields of a SnapshotRecord are requested and kept.
+    """
+    service = service or get_compute_service()
+    snapshots = service.snapshots()
+    kwargs = {"project": proj, "maxResults": max_results, "fields": SNAPSHOT_LIST_FIELDS}
+    if filter:
+        kwargs["filter"] = filter
+    if order_by:
+        kwargs["orderBy"] = order_by
+    request = snapshots.list(**kwargs)
+    while request is not None:
+        page = request.execute()
+        for item in page.get("items", []):
+            yield SnapshotRecord.from_api(item)
+        request = snapshots.list_next(
+            previous_request=request, previous_response=page)
+
+
+def top_k_snapshots(snapshots: Iterable[dict], k: int) -> list[dict]:
+    """Return the k most recently created snapshots, newest first, keeping only k in memory."""
+    return heapq.nlargest(k, snapshots, key=creation_time)
+
+
+def latest_snapshot(proj: str, filter: str | None = None, service=None) -> SnapshotRecord | None:
+    if not filter:
+        # without a filter the API can sort server side and return just one item
+        newest = iter_snapshots(proj, order_by="creationTimestamp desc",
+                                max_results=1, service=service)
+        return next(newest, None)
+    # orderBy can't be combined with a filter, so keep a running max over the stream
+    return max(iter_snapshots(proj, filter=filter, service=service), key=creation_time, default=None)
+
+
+def _local_filter(filter: str | None) -> dict | None:
+    # "name=snap-*" / "sourceDisk=..." / "status=READY" can be answered from the inventory;
+    # anything richer goes to the API
+    if not filter:
+        return {}
+    field, sep, value = filter.partition("=")
+    columns = {"name": "name", "sourceDisk": "source_disk", "status": "status"}
+    if not sep or field.strip() not in columns or any(c in value for c in "()<>!:"):
+        return None
+    return {columns[field.strip()]: value.strip().strip('"')}
+
+
+def recent_snapshots(proj: str, filter: str | None = None, k: int = 1, service=None,
+                     inventory=None) -> list[SnapshotRecord]:
+    """The k most recently created snapshots, newest first; an inventory answers the simple filters."""
+    local = _local_filter(filter) if inventory is not None else None
+    if local is not None:
+        return inventory.find_snapshots(proj, limit=k, **local)
+    return top_k_snapshots(iter_snapshots(proj, filter=filter, service=service), k)
+
+
+def list_snapshots(proj: str, filter: str | None = None, service=None, inventory=None) -> SnapshotRecord | None:
     """return the most recently created snapshots"""
-    service = build('compute', 'v1', cache_discovery=False)
-    request = service.snapshots().list(project=proj, filter=filter)
-    page = request.execute()
-    if len(page['items'] == 0):
+    local = _local_filter(filter) if inventory is not None else None
+    if local is not None:
+        # indexed lookup in the local inventory instead of a full list scan
+        found = inventory.find_snapshots(proj, limit=1, **local)
+        snapshot = found[0] if found else None
+    else:
+        snapshot = latest_snapshot(proj, filter, service=service)
+    if snapshot is None:
         logging.warning(f"No snapshot with in {proj} with filter {filter}")
-        return
-    sorted_snapshots = sorted(
-        page['items'], key=lambda x: x["creationTimestamp"], reverse=True)
-    return sorted_snapshots[-1]
+    return snapshot
 
 
-if __name__ == "__main__":
+def main(args: argparse.Namespace) -> None:
+    """`snapshot list`: print the most recent snapshots matching a filter."""
+    inventory = None
+    if args.inventory:
+        from .inventory import DEFAULT_PATH, Inventory
+        inventory = Inventory(DEFAULT_PATH if args.inventory is True else args.inventory)
+    try:
+        if args.top == 1:
+            pp.pprint(list_snapshots(args.project_id, args.filter, inventory=inventory))
+        else:
+            pp.pprint(recent_snapshots(args.project_id, args.filter, args.top, inventory=inventory))
+    finally:
+        if inventory is not None:
+            inventory.close()
 
-    # Reference gcloud command
-    # gcloud compute snapshots list --project apt-gear-446423-v0 --filter "name=snapshot-2"
-    list_snapshots("apt-gear-446423-v0", "name=snapshot-2")
+
+if __name__ == "__main__":
+    from . import cli
+    cli.main(["snapshot", "list", *sys.argv[1:]])
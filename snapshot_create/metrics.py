@@ -0,0 +1,292 @@
+#! /usr/bin/env python
+from __future__ import annotations
+import atexit
+import bisect
+import json
+import logging
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Iterator
+from urllib.parse import urlparse
+from .trace import TRACER
+
+# In-process metrics for API calls and waits.
+#
+# Every Compute API call is timed per method ("disks.get", "zoneOperations.wait",
+# ...) together with its error codes. Every wait_for_* call records how long it
+# waited, how many status reads it made and how it ended, and the create
+# helpers record insert-to-READY time. Nothing leaves the process until
+# write() (or --metrics_out / GCP_UTILITIES_METRICS_OUT at exit) dumps a
+# Prometheus text file (*.prom) or a JSON summary (anything else).
+
+PREFIX = "gcp_utilities_"
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+POLL_BUCKETS = (1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+
+_Labels = tuple[tuple[str, str], ...]
+
+
+def _labels(labels: dict[str, Any]) -> _Labels:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+class Histogram:
+    """Cumulative-bucket histogram, like a Prometheus one."""
+
+    __slots__ = ("buckets", "counts", "count", "sum")
+
+    def __init__(self, buckets: tuple[float, ...]):
+        self.buckets = buckets
+        # one slot per bucket plus +Inf
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> float | None:
+        # linear interpolation inside the bucket holding the q-th observation
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if n and seen + n >= rank:
+                low = self.buckets[i - 1] if i > 0 else 0.0
+                high = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+                return low + (high - low) * (rank - seen) / n
+            seen += n
+        return self.buckets[-1]
+
+    def summary(self) -> dict:
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 6),
+            "mean": round(self.sum / self.count, 6) if self.count else None,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+        }
+
+
+class Metrics:
+    """Thread-safe registry of counters and histograms keyed by name and labels."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: dict[str, dict[_Labels, float]] = {}
+        self._histograms: dict[str, dict[_Labels, Histogram]] = {}
+        self._buckets: dict[str, tuple[float, ...]] = {}
+
+    def inc(self, name: str, value: float = 1, **labels: Any) -> None:
+        key = _labels(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name: str, value: float, buckets: tuple[float, ...] = LATENCY_BUCKETS, **labels: Any) -> None:
+        key = _labels(labels)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = Histogram(self._buckets.setdefault(name, buckets))
+            histogram.observe(value)
+
+    def counter(self, name: str, **labels: Any) -> float:
+        with self._lock:
+            return self._counters.get(name, {}).get(_labels(labels), 0)
+
+    def histogram(self, name: str, **labels: Any) -> Histogram | None:
+        with self._lock:
+            return self._histograms.get(name, {}).get(_labels(labels))
+
+    def reset(self) -> None:
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def to_json(self) -> dict:
+        with self._lock:
+            return {
+                "counters": {
+                    name: [{"labels": dict(key), "value": value} for key, value in sorted(series.items())]
+                    for name, series in sorted(self._counters.items())
+                },
+                "histograms": {
+                    name: [{"labels": dict(key), **histogram.summary()} for key, histogram in sorted(series.items())]
+                    for name, series in sorted(self._histograms.items())
+                },
+            }
+
+    def to_prometheus(self) -> str:
+        def fmt(labels: _Labels, extra: tuple = ()) -> str:
+            pairs = [f'{k}="{v}"' for k, v in labels + extra]
+            return "{" + ",".join(pairs) + "}" if pairs else ""
+
+        lines = []
+        with self._lock:
+            for name, series in sorted(self._counters.items()):
+                lines.append(f"# TYPE {PREFIX}{name} counter")
+                for key, value in sorted(series.items()):
+                    lines.append(f"{PREFIX}{name}{fmt(key)} {value:g}")
+            for name, series in sorted(self._histograms.items()):
+                lines.append(f"# TYPE {PREFIX}{name} histogram")
+                for key, histogram in sorted(series.items()):
+                    cumulative = 0
+                    for bound, n in zip(histogram.buckets + (float("inf"),), histogram.counts):
+                        cumulative += n
+                        le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                        lines.append(f"{PREFIX}{name}_bucket{fmt(key, (('le', le),))} {cumulative}")
+                    lines.append(f"{PREFIX}{name}_sum{fmt(key)} {histogram.sum:g}")
+                    lines.append(f"{PREFIX}{name}_count{fmt(key)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path: str) -> None:
+        """Prometheus text format for *.prom files (node_exporter textfile collector), JSON otherwise."""
+        content = self.to_prometheus() if path.endswith(".prom") else json.dumps(self.to_json(), indent=2)
+        # write then rename so a scraper never reads half a file
+        tmp = f"{path}.tmp{os.getpid()}"
+        with open(tmp, "w") as f:
+            f.write(content)
+        os.replace(tmp, path)
+
+
+METRICS = Metrics()
+
+
+# ---- API calls ---------------------------------------------------------------
+
+def record_call(method: str, seconds: float, code: int | None = None) -> None:
+    METRICS.observe("api_request_seconds", seconds, method=method)
+    if TRACER.enabled:
+        end = time.monotonic()
+        TRACER.complete(method, "api", end - seconds, end, **({"code": code} if code is not None else {}))
+    if code is not None and code >= 400:
+        METRICS.inc("api_errors_total", method=method, code=code)
+
+
+def record_retry(method: str) -> None:
+    METRICS.inc("api_retries_total", method=method)
+
+
+@contextmanager
+def timed_call(method: str) -> Iterator[None]:
+    """Time one API call; HTTP errors are counted by status code."""
+    start = time.monotonic()
+    code = None
+    try:
+        yield
+    except Exception as e:
+        code = error_code(e)
+        raise
+    finally:
+        record_call(method, time.monotonic() - start, code)
+
+
+def error_code(error: BaseException) -> int | None:
+    # googleapiclient HttpError has .resp.status, api_core errors have .code
+    resp = getattr(error, "resp", None)
+    if resp is not None and getattr(resp, "status", None) is not None:
+        return int(resp.status)
+    code = getattr(error, "code", None)
+    return code if isinstance(code, int) else None
+
+
+_SCOPED = {("zones", "operations"): "zoneOperations", ("regions", "operations"): "regionOperations",
+           ("global", "operations"): "globalOperations", ("regions", "disks"): "regionDisks"}
+_VERBS = {"GET": "get", "DELETE": "delete", "PATCH": "patch", "PUT": "update"}
+
+
+def rest_method(http_method: str, url: str) -> str:
+    """Name a compute v1 REST call the way discovery does, e.g. GET .../zones/z/disks/d -> disks.get."""
+    path = urlparse(url).path
+    match = re.search(r"/compute/v1/projects/[^/]+/(.*)$", path)
+    if not match:
+        return f"{http_method.lower()} {path}"
+    parts = match.group(1).split("/")
+    if parts[0] == "aggregated":
+        return f"{parts[1]}.aggregatedList"
+    scope = parts[0]
+    parts = parts[2:] if scope in ("zones", "regions") else parts[1:]
+    collection = _SCOPED.get((scope, parts[0]), parts[0])
+    if len(parts) == 1:
+        return f"{collection}.{'list' if http_method == 'GET' else 'insert'}"
+    if len(parts) == 2:
+        return f"{collection}.{_VERBS.get(http_method, http_method.lower())}"
+    # custom verbs such as operations/<name>/wait or disks/<name>/setLabels
+    return f"{collection}.{parts[2]}"
+
+
+def response_hook(response, *args, **kwargs) -> None:
+    """requests response hook for the REST transport of compute_v1 clients."""
+    request = response.request
+    record_call(rest_method(request.method, request.url),
+                response.elapsed.total_seconds(), response.status_code)
+
+
+# ---- waits -------------------------------------------------------------------
+
+_local = threading.local()
+
+
+class _Wait:
+    __slots__ = ("polls", "outcome")
+
+    def __init__(self):
+        self.polls = 0
+        # the caller sets "ready" / "not_ready"; an exception leaves "error"
+        self.outcome = "error"
+
+
+@contextmanager
+def tracked_wait(kind: str) -> Iterator[_Wait]:
+    """Record duration, status reads and outcome of one wait_for_* call."""
+    wait = _Wait()
+    outer = getattr(_local, "wait", None)
+    _local.wait = wait
+    start = time.monotonic()
+    try:
+        yield wait
+    finally:
+        _local.wait = outer
+        end = time.monotonic()
+        TRACER.complete(f"wait {kind}", "wait", start, end, polls=wait.polls, outcome=wait.outcome)
+        METRICS.observe("wait_seconds", end - start, kind=kind, outcome=wait.outcome)
+        METRICS.observe("wait_polls", wait.polls, buckets=POLL_BUCKETS, kind=kind)
+        METRICS.inc("waits_total", kind=kind, outcome=wait.outcome)
+
+
+def count_poll() -> None:
+    # one status read (get, operations.wait) by the wait running on this thread
+    wait = getattr(_local, "wait", None)
+    if wait is not None:
+        wait.polls += 1
+
+
+def record_ready(kind: str, seconds: float) -> None:
+    # insert to READY
+    METRICS.observe("time_to_ready_seconds", seconds, kind=kind)
+    TRACER.instant("ready", "ready", kind=kind, seconds=round(seconds, 3))
+
+
+# ---- export ------------------------------------------------------------------
+
+def export_at_exit(path: str) -> None:
+    def write() -> None:
+        try:
+            METRICS.write(path)
+            logging.info(f"Metrics written to {path}")
+        except OSError as e:
+            logging.error(f"Could not write metrics to {path}: {e}")
+    atexit.register(write)
+
+
+if os.environ.get("GCP_UTILITIES_METRICS_OUT"):
+    export_at_exit(os.environ["GCP_UTILITIES_METRICS_OUT"])
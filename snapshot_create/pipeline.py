@@ -0,0 +1,210 @@
+#! /usr/bin/env python
+from __future__ import annotations
+import argparse
+import logging
+import sys
+import threading
+from collections import defaultdict
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from .batch import BatchResult, BoundedExecutor, run_entry
+from .create_snapshot import create_snapshot
+from .create_disk_from_snapshot import create_disk_from_snapshot
+from .journal import Journal, entries_to_run
+from .metrics import export_at_exit
+from .plan import plan_disks, plan_snapshots
+from .preflight import format_problems, preflight_disks, preflight_snapshots
+from .config import load_config
+from .watcher import ReadinessWatcher
+
+# Set the logging level to DEBUG
+logging.basicConfig(level=logging.DEBUG)
+
+
+@dataclass
+class PipelineResult:
+    snapshots: list[BatchResult] = field(default_factory=list)
+    disks: list[BatchResult] = field(default_factory=list)
+
+    @property
+    def ok(self) -> bool:
+        return all(r.ok for r in self.snapshots + self.disks)
+
+
+def _create_disk_and_wait(target_project_id: str, disk: dict, watcher: ReadinessWatcher | None,
+                          journal: Journal | None = None) -> bool:
+    create_disk_from_snapshot(
+        src_project_id=disk["src_project_id"],
+        target_zone=disk["target_zone"],
+        disk_name=disk["disk_name"],
+        disk_type=disk["disk_type"],
+        disk_size_gb=disk["disk_size_gb"],
+        target_project_id=target_project_id,
+        src_snapshot_name=disk["src_snapshot_name"],
+        raise_on_error=True,
+        wait=True,
+        watcher=watcher,
+        journal=journal,
+    )
+    return True
+
+
+def run_pipeline(
+    snapshot_project_id: str,
+    target_project_id: str,
+    snapshot_entries: list[dict],
+    disk_entries: list[dict],
+    snapshot_workers: int = 4,
+    disk_workers: int = 4,
+    max_pending_disks: int | None = None,
+    watcher: ReadinessWatcher | None = None,
+    journal: Journal | None = None,
+) -> PipelineResult:
+    """Create snapshots and the disks cloned from them as two overlapping stages.
+
+    A disk whose `src_snapshot_name` is created by this run (in
+    `snapshot_project_id`) is handed to the disk stage as soon as that
+    snapshot is READY; other disks start right away. Each stage has its own
+    worker pool, and the disk stage holds at most `max_pending_disks` queued
+    disks, so snapshot workers block (backpressure) when disks fall behind.
+    Pass a ReadinessWatcher to poll every pending resource with shared list calls,
+    and a Journal to record progress for a later --resume.
+    """
+    snapshot_names = {s["src_snapshot_name"] for s in snapshot_entries}
+    dependents: dict[str, list[dict]] = defaultdict(list)
+    independent: list[dict] = []
+    for disk in disk_entries:
+        if disk["src_project_id"] == snapshot_project_id and disk["src_snapshot_name"] in snapshot_names:
+            dependents[disk["src_snapshot_name"]].append(disk)
+        else:
+            independent.append(disk)
+
+    result = PipelineResult()
+    disk_futures: list[Future] = []
+    lock = threading.Lock()
+
+    def create_disk(disk: dict) -> bool:
+        return _create_disk_and_wait(target_project_id, disk, watcher, journal)
+
+    with BoundedExecutor(disk_workers, max_pending_disks, name="disk-stage") as disk_stage:
+
+        def submit_disk(disk: dict) -> None:
+            # blocks while the disk stage is full
+            future = disk_stage.submit(
+                run_entry, create_disk, disk["disk_name"], disk)
+            with lock:
+                disk_futures.append(future)
+
+        def create_snapshot_then_disks(entry: dict) -> str:
+            create_snapshot(
+                target_project_id=snapshot_project_id,
+                disk_name=entry["disk_name"],
+                snapshot_name=entry["src_snapshot_name"],
+                zone=entry["target_zone"],
+                disk_project_id=entry.get("disk_project_id"),
+                exit_on_error=False,
+                watcher=watcher,
+                journal=journal,
+            )
+            logging.debug(
+                f"Snapshot {entry['src_snapshot_name']} ready, starting {len(dependents[entry['src_snapshot_name']])} disk(s)")
+            for disk in dependents[entry["src_snapshot_name"]]:
+                submit_disk(disk)
+            return entry["src_snapshot_name"]
+
+        # disks that need none of this run's snapshots are fed alongside the snapshot stage,
+        # so neither waits on the other's backpressure
+        feeder = threading.Thread(target=lambda: [submit_disk(disk) for disk in independent],
+                                  name="independent-disks")
+        feeder.start()
+        with BoundedExecutor(snapshot_workers, name="snapshot-stage") as snapshot_stage:
+            snapshot_futures = [
+                snapshot_stage.submit(
+                    run_entry, create_snapshot_then_disks, entry["src_snapshot_name"], entry)
+                for entry in snapshot_entries
+            ]
+            result.snapshots = [f.result() for f in snapshot_futures]
+        feeder.join()
+
+        # disks of a failed snapshot never reach the disk stage; report them as failed
+        for snapshot in result.snapshots:
+            if not snapshot.ok:
+                for disk in dependents[snapshot.key]:
+                    result.disks.append(BatchResult(
+                        disk["disk_name"], disk,
+                        error=RuntimeError(f"source snapshot {snapshot.key} failed")))
+
+        result.disks.extend(f.result() for f in disk_futures)
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Create snapshots and clone disks from them as soon as each snapshot is ready.")
+    parser.add_argument("-s", "--snapshot_config", required=True,
+                        help="Path to the create_snapshot_config.yaml file")
+    parser.add_argument("-c", "--disk_config", required=True,
+                        help="Path to the create_disk_config.yaml file")
+    parser.add_argument("--snapshot_project_id", required=True,
+                        help="GCP Project ID the snapshots are created in")
+    parser.add_argument("-p", "--project_id", required=True,
+                        help="GCP Project ID the disks are created in")
+    parser.add_argument("--snapshot_workers", type=int, default=4,
+                        help="Snapshots created at once")
+    parser.add_argument("--disk_workers", type=int, default=4,
+                        help="Disks created at once")
+    parser.add_argument("--max_pending_disks", type=int, default=None,
+                        help="Disks allowed to queue before snapshot workers wait")
+    parser.add_argument("-d", "--dry_run", action="store_true",
+                        help="Only show what would be created, skipped or is in conflict.")
+    parser.add_argument("--journal", default=None,
+                        help="Journal file of this run (default: DISK_CONFIG.journal)")
+    parser.add_argument("--resume", action="store_true",
+                        help="Continue the run recorded in the journal: skip finished resources, re-attach to pending ones.")
+    parser.add_argument("--skip_preflight", action="store_true",
+                        help="Don't check zones, disk types and sources of every entry before creating anything")
+    parser.add_argument("--metrics_out", default=None,
+                        help="Write API/wait metrics here at exit (*.prom: Prometheus text, else JSON)")
+    args = parser.parse_args()
+    if args.metrics_out:
+        export_at_exit(args.metrics_out)
+
+    # existing snapshots are skipped, so disks cloned from them start right away
+    snapshot_plan = plan_snapshots(
+        args.snapshot_project_id, load_config(args.snapshot_config, args.snapshot_project_id)["snapshots"])
+    disk_plan = plan_disks(args.project_id, load_config(args.disk_config, args.project_id)["disks"])
+    print(snapshot_plan.format())
+    print(disk_plan.format())
+    conflicts = snapshot_plan.has_conflicts or disk_plan.has_conflicts
+    if not args.skip_preflight:
+        # disks of snapshots this run creates can't look them up yet
+        upcoming = [(args.snapshot_project_id, entry["src_snapshot_name"]) for entry in snapshot_plan.to_create]
+        problems = preflight_snapshots(args.snapshot_project_id, snapshot_plan.to_create) + preflight_disks(
+            args.project_id, disk_plan.to_create, upcoming_snapshots=upcoming)
+        print(format_problems(problems))
+        if problems:
+            sys.exit(1)
+    if args.dry_run:
+        sys.exit(1 if conflicts else 0)
+
+    journal = Journal(args.journal or f"{args.disk_config}.journal", resume=args.resume)
+    watcher = ReadinessWatcher()
+    result = run_pipeline(
+        snapshot_project_id=args.snapshot_project_id,
+        target_project_id=args.project_id,
+        snapshot_entries=entries_to_run(snapshot_plan, journal),
+        disk_entries=entries_to_run(disk_plan, journal),
+        snapshot_workers=args.snapshot_workers,
+        disk_workers=args.disk_workers,
+        max_pending_disks=args.max_pending_disks,
+        watcher=watcher,
+        journal=journal,
+    )
+    watcher.stop()
+    journal.close()
+    for failed in [r for r in result.snapshots + result.disks if not r.ok]:
+        logging.error(f"{failed.key} failed: {failed.error}")
+    logging.info(
+        f"Snapshots ok: {sum(r.ok for r in result.snapshots)}/{len(result.snapshots)}, "
+        f"disks ok: {sum(r.ok for r in result.disks)}/{len(result.disks)}")
+    sys.exit(0 if result.ok and not conflicts else 1)
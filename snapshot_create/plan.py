@@ -0,0 +1,184 @@
+#! /usr/bin/env python
+from __future__ import annotations
+import argparse
+import logging
+import sys
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Callable, Iterable
+from .config import load_config
+from .inventory import iter_disks
+from .list_snapshot import iter_snapshots
+
+# Reconcile a config against what already exists before acting.
+#
+# A plan deduplicates the config entries, reads the existing resources with
+# one (paginated) list per project and sorts every entry into create, skip
+# (already there, matching the entry) or conflict (there, but different, or
+# the config contradicts itself). Only the create entries are executed, so a
+# rerun of a finished config does a single list call and nothing else.
+
+CREATE = "create"
+SKIP = "skip"
+CONFLICT = "conflict"
+
+# reason of a skip for a resource that exists and matches its entry
+ALREADY_EXISTS = "already exists"
+
+_MARKS = {CREATE: "+", SKIP: "=", CONFLICT: "!"}
+
+
+@dataclass
+class PlanItem:
+    action: str
+    key: str
+    entry: dict = field(repr=False)
+    reason: str = ""
+
+
+@dataclass
+class Plan:
+    kind: str
+    project_id: str
+    items: list[PlanItem] = field(default_factory=list)
+
+    def of(self, action: str) -> list[PlanItem]:
+        return [item for item in self.items if item.action == action]
+
+    @property
+    def to_create(self) -> list[dict]:
+        return [item.entry for item in self.of(CREATE)]
+
+    @property
+    def has_conflicts(self) -> bool:
+        return any(item.action == CONFLICT for item in self.items)
+
+    def counts(self) -> dict[str, int]:
+        counts = Counter(item.action for item in self.items)
+        return {action: counts.get(action, 0) for action in (CREATE, SKIP, CONFLICT)}
+
+    def format(self) -> str:
+        lines = [f"Plan for {self.kind} in {self.project_id}:"]
+        for item in self.items:
+            reason = f" ({item.reason})" if item.reason else ""
+            lines.append(f"  {_MARKS[item.action]} {item.action:<8} {item.key}{reason}")
+        counts = self.counts()
+        lines.append(f"{counts[CREATE]} to create, {counts[SKIP]} to skip, {counts[CONFLICT]} in conflict")
+        return "\n".join(lines)
+
+
+def _dedupe(entries: Iterable[dict], key: Callable[[dict], str]) -> tuple[dict[str, dict], list[PlanItem]]:
+    # the first entry for a key wins; exact repeats are skipped, different ones conflict
+    unique: dict[str, dict] = {}
+    items: list[PlanItem] = []
+    for entry in entries:
+        k = key(entry)
+        if k not in unique:
+            unique[k] = entry
+        elif unique[k] == entry:
+            items.append(PlanItem(SKIP, k, entry, "duplicate config entry"))
+        else:
+            items.append(PlanItem(CONFLICT, k, entry, "config has another entry with different settings"))
+    return unique, items
+
+
+def _ends_with(link: str | None, path: str) -> bool:
+    return bool(link) and link.endswith(path)
+
+
+def disk_key(entry: dict) -> str:
+    return f"{entry['target_zone']}/{entry['disk_name']}"
+
+
+def disk_differences(entry: dict, disk: dict) -> list[str]:
+    """Settings of an existing disk that don't match its config entry."""
+    differences = []
+    source = f"projects/{entry['src_project_id']}/global/snapshots/{entry['src_snapshot_name']}"
+    if not _ends_with(disk.get("sourceSnapshot"), source):
+        differences.append(f"source snapshot is {disk.get('sourceSnapshot')}")
+    if str(disk.get("sizeGb")) != str(entry["disk_size_gb"]):
+        differences.append(f"size is {disk.get('sizeGb')} GB")
+    if not _ends_with(disk.get("type"), f"/diskTypes/{entry['disk_type']}"):
+        differences.append(f"type is {disk.get('type', '').rsplit('/', 1)[-1]}")
+    if disk.get("status") == "FAILED":
+        differences.append("status is FAILED")
+    return differences
+
+
+def plan_disks(target_project_id: str, entries: list[dict], service=None,
+               existing: dict[str, dict] | None = None) -> Plan:
+    """Plan the `disks` config entries against the disks in the target project.
+
+    `existing` maps "zone/name" to the disk resource; without it the project
+    is read with one disks.aggregatedList.
+    """
+    unique, items = _dedupe(entries, disk_key)
+    if existing is None:
+        existing = {f"{zone}/{disk['name']}": disk
+                    for zone, disk in iter_disks(target_project_id, service=service)}
+    plan = Plan("disks", target_project_id)
+    for key, entry in unique.items():
+        disk = existing.get(key)
+        if disk is None:
+            plan.items.append(PlanItem(CREATE, key, entry))
+            continue
+        differences = disk_differences(entry, disk)
+        if differences:
+            plan.items.append(PlanItem(CONFLICT, key, entry, "exists, but " + ", ".join(differences)))
+        else:
+            plan.items.append(PlanItem(SKIP, key, entry, ALREADY_EXISTS))
+    plan.items.extend(items)
+    return plan
+
+
+def snapshot_key(entry: dict) -> str:
+    return entry["src_snapshot_name"]
+
+
+def plan_snapshots(target_project_id: str, entries: list[dict], service=None,
+                   existing: dict[str, dict] | None = None) -> Plan:
+    """Plan the `snapshots` config entries against the snapshots in the target project.
+
+    `existing` maps snapshot name to the snapshot resource; without it the
+    project is read with one snapshots.list.
+    """
+    unique, items = _dedupe(entries, snapshot_key)
+    if existing is None:
+        existing = {s["name"]: s for s in iter_snapshots(target_project_id, service=service)}
+    plan = Plan("snapshots", target_project_id)
+    for key, entry in unique.items():
+        snapshot = existing.get(key)
+        if snapshot is None:
+            plan.items.append(PlanItem(CREATE, key, entry))
+            continue
+        disk_project_id = entry.get("disk_project_id") or target_project_id
+        source = f"projects/{disk_project_id}/zones/{entry['target_zone']}/disks/{entry['disk_name']}"
+        if not _ends_with(snapshot.get("sourceDisk"), source):
+            plan.items.append(PlanItem(
+                CONFLICT, key, entry, f"exists, but taken from {snapshot.get('sourceDisk')}"))
+        elif snapshot.get("status") == "FAILED":
+            plan.items.append(PlanItem(CONFLICT, key, entry, "exists, but status is FAILED"))
+        else:
+            plan.items.append(PlanItem(SKIP, key, entry, ALREADY_EXISTS))
+    plan.items.extend(items)
+    return plan
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(
+        description="Show what a config would create, skip or conflict with, without changing anything.")
+    parser.add_argument("-c", "--config", required=True,
+                        help="Path to a create_disk_config.yaml or create_snapshot_config.yaml file")
+    parser.add_argument("-p", "--project_id", required=True,
+                        help="GCP Project ID the resources are created in")
+    args = parser.parse_args()
+    config = load_config(args.config, args.project_id)
+    plans = []
+    if "disks" in config:
+        plans.append(plan_disks(args.project_id, config["disks"]))
+    if "snapshots" in config:
+        plans.append(plan_snapshots(args.project_id, config["snapshots"]))
+    for plan in plans:
+        print(plan.format())
+    sys.exit(1 if any(plan.has_conflicts for plan in plans) else 0)
@@ -0,0 +1,190 @@
+#! /usr/bin/env python
+from __future__ import annotations
+import argparse
+import logging
+import re
+import sys
+from dataclasses import dataclass
+from typing import Any, Callable, Iterable
+from google.api_core import exceptions
+from google.cloud import compute_v1
+from .batch import run_batch
+from .clients import get_client
+from .config import load_config
+from .plan import disk_key, snapshot_key
+from .records import field_mask
+
+# Preflight: check every config entry before anything is created.
+#
+# A bad entry late in a config used to surface only after the entries before
+# it had been created and waited for. Preflight reads everything the entries
+# refer to up front: zones, disk types, source snapshots and source disks.
+# Each distinct lookup, e.g. one (project, zone, diskType), is made once,
+# however many entries share it, and all of them run in parallel. Every
+# problem is reported together. Name collisions with existing resources and
+# between entries are the plan's job (plan.py); preflight checks what the
+# plan can't see.
+
+DEFAULT_CONCURRENCY = 16
+
+# RFC 1035 names, as Compute requires for disks and snapshots
+NAME_PATTERN = re.compile(r"[a-z]([-a-z0-9]{0,61}[a-z0-9])?")
+
+
+@dataclass
+class Problem:
+    key: str
+    message: str
+
+
+def _lookup(calls: dict[tuple, Callable[[], Any]], concurrency: int) -> dict[tuple, Any]:
+    # one call per distinct lookup; a resource that is missing or out of reach comes back as its error
+    def run(entry: dict) -> Any:
+        try:
+            return entry["call"]()
+        except (exceptions.NotFound, exceptions.Forbidden) as e:
+            return e
+
+    results = run_batch(run, [{"lookup": lookup, "call": call} for lookup, call in calls.items()],
+                        key=lambda entry: "/".join(entry["lookup"]), concurrency=concurrency)
+    return {r.entry["lookup"]: r.value if r.ok else r.error for r in results}
+
+
+def _describe(found: Any, what: str) -> str | None:
+    if isinstance(found, exceptions.NotFound):
+        return f"{what} does not exist"
+    if isinstance(found, exceptions.Forbidden):
+        return f"no access to {what}"
+    if isinstance(found, Exception):
+        return f"could not check {what}: {found}"
+    return None
+
+
+def _check_name(key: str, name: str, what: str, problems: list[Problem]) -> None:
+    if not NAME_PATTERN.fullmatch(name):
+        problems.append(Problem(key, f"{what} name {name!r} is not a valid resource name "
+                                     "(lowercase letters, digits and hyphens, at most 63 characters)"))
+
+
+def preflight_disks(
+    target_project_id: str,
+    entries: Iterable[dict],
+    concurrency: int = DEFAULT_CONCURRENCY,
+    upcoming_snapshots: Iterable[tuple[str, str]] = (),
+) -> list[Problem]:
+    """Check disk entries: zone, disk type in that zone, source snapshot and its size.
+
+    `upcoming_snapshots` are (project, name) snapshots the same run creates
+    first; they aren't looked up.
+    """
+    entries = list(entries)
+    upcoming = set(upcoming_snapshots)
+    zones = get_client(compute_v1.ZonesClient)
+    disk_types = get_client(compute_v1.DiskTypesClient)
+    snapshots = get_client(compute_v1.SnapshotsClient)
+    calls: dict[tuple, Callable[[], Any]] = {}
+    for entry in entries:
+        zone, disk_type = entry["target_zone"], entry["disk_type"]
+        src = (entry["src_project_id"], entry["src_snapshot_name"])
+        calls.setdefault(("zone", target_project_id, zone),
+                         lambda zone=zone: zones.get(project=target_project_id, zone=zone, metadata=field_mask("name")))
+        calls.setdefault(("diskType", target_project_id, zone, disk_type),
+                         lambda zone=zone, disk_type=disk_type: disk_types.get(
+                             project=target_project_id, zone=zone, disk_type=disk_type, metadata=field_mask("name")))
+        if src not in upcoming:
+            calls.setdefault(("snapshot", *src),
+                             lambda src=src: snapshots.get(project=src[0], snapshot=src[1],
+                                                           metadata=field_mask("status,diskSizeGb")))
+    found = _lookup(calls, concurrency)
+
+    problems: list[Problem] = []
+    for entry in entries:
+        key = disk_key(entry)
+        zone, disk_type = entry["target_zone"], entry["disk_type"]
+        _check_name(key, entry["disk_name"], "disk", problems)
+        zone_problem = _describe(found[("zone", target_project_id, zone)], f"zone {zone}")
+        if zone_problem:
+            problems.append(Problem(key, zone_problem))
+        else:
+            type_problem = _describe(found[("diskType", target_project_id, zone, disk_type)],
+                                     f"disk type {disk_type} in {zone}")
+            if type_problem:
+                problems.append(Problem(key, type_problem))
+        src = (entry["src_project_id"], entry["src_snapshot_name"])
+        if src in upcoming:
+            continue
+        snapshot = found[("snapshot", *src)]
+        snapshot_problem = _describe(snapshot, f"snapshot {src[1]} in project {src[0]}")
+        if snapshot_problem:
+            problems.append(Problem(key, snapshot_problem))
+        elif snapshot.status != "READY":
+            problems.append(Problem(key, f"snapshot {src[1]} in project {src[0]} is {snapshot.status}"))
+        elif snapshot.disk_size_gb and int(entry["disk_size_gb"]) < snapshot.disk_size_gb:
+            problems.append(Problem(key, f"disk_size_gb {entry['disk_size_gb']} is smaller than "
+                                         f"snapshot {src[1]} ({snapshot.disk_size_gb} GB)"))
+    return problems
+
+
+def preflight_snapshots(
+    target_project_id: str,
+    entries: Iterable[dict],
+    concurrency: int = DEFAULT_CONCURRENCY,
+) -> list[Problem]:
+    """Check snapshot entries: snapshot name, zone and source disk."""
+    entries = list(entries)
+    zones = get_client(compute_v1.ZonesClient)
+    disks = get_client(compute_v1.DisksClient)
+    calls: dict[tuple, Callable[[], Any]] = {}
+    for entry in entries:
+        project, zone, disk = entry["disk_project_id"], entry["target_zone"], entry["disk_name"]
+        calls.setdefault(("zone", project, zone), lambda project=project, zone=zone: zones.get(
+            project=project, zone=zone, metadata=field_mask("name")))
+        calls.setdefault(("disk", project, zone, disk), lambda project=project, zone=zone, disk=disk: disks.get(
+            project=project, zone=zone, disk=disk, metadata=field_mask("status")))
+    found = _lookup(calls, concurrency)
+
+    problems: list[Problem] = []
+    for entry in entries:
+        key = snapshot_key(entry)
+        project, zone, disk = entry["disk_project_id"], entry["target_zone"], entry["disk_name"]
+        _check_name(key, entry["src_snapshot_name"], "snapshot", problems)
+        zone_problem = _describe(found[("zone", project, zone)], f"zone {zone} in project {project}")
+        if zone_problem:
+            problems.append(Problem(key, zone_problem))
+            continue
+        disk_problem = _describe(found[("disk", project, zone, disk)],
+                                 f"source disk {disk} in {zone} of project {project}")
+        if disk_problem:
+            problems.append(Problem(key, disk_problem))
+        elif found[("disk", project, zone, disk)].status == "FAILED":
+            problems.append(Problem(key, f"source disk {disk} in {zone} is FAILED"))
+    return problems
+
+
+def format_problems(problems: list[Problem]) -> str:
+    if not problems:
+        return "Preflight: no problems found"
+    lines = [f"Preflight: {len(problems)} problem(s), nothing was changed:"]
+    lines += [f"  ! {problem.key}: {problem.message}" for problem in problems]
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(
+        description="Check every entry of a config against the API without changing anything.")
+    parser.add_argument("-c", "--config", required=True,
+                        help="Path to a create_disk_config.yaml or create_snapshot_config.yaml file")
+    parser.add_argument("-p", "--project_id", required=True,
+                        help="GCP Project ID the resources are created in")
+    parser.add_argument("-n", "--concurrency", type=int, default=DEFAULT_CONCURRENCY,
+                        help=f"Lookups in parallel (default {DEFAULT_CONCURRENCY})")
+    args = parser.parse_args()
+    config = load_config(args.config, args.project_id)
+    problems = []
+    if "snapshots" in config:
+        problems += preflight_snapshots(args.project_id, config["snapshots"], args.concurrency)
+    if "disks" in config:
+        problems += preflight_disks(args.project_id, config["disks"], args.concurrency)
+    print(format_problems(problems))
+    sys.exit(1 if problems else 0)
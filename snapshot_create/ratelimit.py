@@ -0,0 +1,393 @@
+#! /usr/bin/env python
+from __future__ import annotations
+import email.utils
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Callable
+from requests.adapters import HTTPAdapter
+from .metrics import METRICS, record_retry, rest_method
+from .trace import span
+
+# Quota-aware rate limiting, retries and circuit breaking for Compute calls.
+#
+# Every call is charged to a token bucket per (project, quota group), sized
+# after the default GCE per-project quotas, so a wide batch paces itself
+# instead of running into 429s. Transient failures (429, rateLimitExceeded,
+# 5xx, dropped connections) are retried with full-jitter exponential backoff,
+# never sooner than a Retry-After / RetryInfo hint from the server. Mutations
+# are only retried when the server rejected them unprocessed (429 / rate
+# limit), so an insert is never sent twice after it may have gone through.
+# Each project has a circuit breaker: after `failure_threshold` server errors
+# or timeouts in a row (throttling doesn't count), calls fail fast with CircuitOpenError for
+# `reset_timeout` seconds, then one probe call decides whether to close it.
+#
+# The compute_v1 clients get this through GuardedAdapter on their HTTP
+# session, discovery requests through clients.InstrumentedRequest, and the
+# fake backend through guarded_call(); nothing else needs to know about it.
+
+READ = "read"
+LIST = "list"
+OPERATION = "operation"
+MUTATION = "mutation"
+
+# default GCE quotas per project: 1,500 reads, 500 lists, 3,000 operation
+# reads and 1,500 mutations per minute
+QUOTA_PER_SECOND = {READ: 25.0, LIST: 8.0, OPERATION: 50.0, MUTATION: 25.0}
+
+RETRYABLE_CODES = frozenset({429, 500, 502, 503, 504})
+RATE_LIMIT_REASONS = frozenset({"rateLimitExceeded", "userRateLimitExceeded", "RATE_LIMIT_EXCEEDED"})
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised instead of calling a project whose circuit breaker is open."""
+
+
+def category_of(method: str) -> str:
+    """Quota group of a method name such as "disks.get" or "zoneOperations.wait"."""
+    collection, _, verb = method.partition(".")
+    if collection.endswith("Operations") or collection == "operations":
+        return OPERATION
+    if verb in ("list", "aggregatedList"):
+        return LIST
+    if verb == "get":
+        return READ
+    return MUTATION
+
+
+def project_of(url: str) -> str:
+    match = re.search(r"/projects/([^/?]+)", url)
+    return match.group(1) if match else ""
+
+
+class TokenBucket:
+    """`rate` tokens per second, holding at most `burst`."""
+
+    def __init__(self, rate: float, burst: float | None = None, clock: Callable[[], float] = time.monotonic):
+        self.rate = rate
+        self.burst = burst or max(1.0, rate)
+        self._clock = clock
+        self._tokens = self.burst
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """Take a token and return how long to wait before using it."""
+        with self._lock:
+            now = self._clock()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            # tokens may go negative: later callers queue up behind earlier ones
+            self._tokens -= 1
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+
+class CircuitBreaker:
+    """Closed -> open after `failure_threshold` consecutive failures -> half-open after `reset_timeout`."""
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0,
+                 clock: Callable[[], float] = time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at: float | None = None
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            return "half_open" if self._clock() - self._opened_at >= self.reset_timeout else "open"
+
+    def before_call(self, name: str) -> None:
+        with self._lock:
+            if self._opened_at is None:
+                return
+            if self._clock() - self._opened_at < self.reset_timeout or self._probing:
+                raise CircuitOpenError(f"Circuit for {name} is open after {self._failures} failures")
+            # half-open: this call is the probe
+            self._probing = True
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    def record_throttled(self) -> None:
+        # a throttled probe says nothing either way: stay half-open so the next call probes again
+        with self._lock:
+            self._probing = False
+
+    def record_failure(self) -> bool:
+        """Count a transient failure; True if this opened the circuit."""
+        with self._lock:
+            self._failures += 1
+            reopened = self._probing
+            self._probing = False
+            if reopened or (self._opened_at is None and self._failures >= self.failure_threshold):
+                self._opened_at = self._clock()
+                return True
+            return False
+
+
+@dataclass
+class RetryPolicy:
+    max_attempts: int = 6
+    initial: float = 1.0
+    maximum: float = 32.0
+    multiplier: float = 2.0
+    # longest a server hint is honored before giving up on the call
+    max_hint: float = 120.0
+
+    def backoff(self, attempt: int) -> float:
+        # full jitter, attempt counts from 1
+        return random.uniform(0, min(self.maximum, self.initial * self.multiplier ** (attempt - 1)))
+
+
+# ---- classifying failures -------------------------------------------------------
+
+
+class RetryableResponse(Exception):
+    """Carries an HTTP response that should be retried through Guard.call()."""
+
+    def __init__(self, response: Any):
+        super().__init__(f"HTTP {response.status_code}")
+        self.response = response
+
+
+def _reasons_from_body(body: Any) -> set[str]:
+    try:
+        error = json.loads(body).get("error", {})
+    except (TypeError, ValueError, AttributeError):
+        return set()
+    reasons = {e.get("reason") for e in error.get("errors", []) if isinstance(e, dict)}
+    reasons |= {d.get("reason") for d in error.get("details", []) if isinstance(d, dict)}
+    if error.get("status"):
+        reasons.add(error["status"])
+    return {r for r in reasons if r}
+
+
+def status_and_reasons(error: BaseException) -> tuple[int | None, set[str]]:
+    if isinstance(error, RetryableResponse):
+        response = error.response
+        reasons = _reasons_from_body(response.content) if response.status_code == 403 else set()
+        return response.status_code, reasons
+    # googleapiclient HttpError
+    resp = getattr(error, "resp", None)
+    if resp is not None and getattr(resp, "status", None) is not None:
+        return int(resp.status), _reasons_from_body(getattr(error, "content", None))
+    # google.api_core GoogleAPICallError
+    code = getattr(error, "code", None)
+    reasons = {getattr(error, "reason", None)} | {
+        e.get("reason") for e in getattr(error, "errors", None) or [] if isinstance(e, dict)}
+    return (code if isinstance(code, int) else None), {r for r in reasons if r}
+
+
+def is_rate_limited(error: BaseException) -> bool:
+    code, reasons = status_and_reasons(error)
+    return code == 429 or (code == 403 and bool(reasons & RATE_LIMIT_REASONS))
+
+
+def is_retryable(error: BaseException, category: str) -> bool:
+    if isinstance(error, CircuitOpenError):
+        return False
+    if isinstance(error, (ConnectionError, TimeoutError)) or type(error).__name__ in (
+            "ConnectionError", "ConnectTimeout", "ReadTimeout", "ServiceUnavailable"):
+        # a dropped connection may have delivered a mutation already
+        return category != MUTATION or type(error).__name__ == "ConnectTimeout"
+    if is_rate_limited(error):
+        return True
+    code, _ = status_and_reasons(error)
+    return category != MUTATION and code in RETRYABLE_CODES
+
+
+def _parse_seconds(value: Any) -> float | None:
+    if value is None:
+        return None
+    value = str(value).strip()
+    try:
+        return float(value.rstrip("s"))
+    except ValueError:
+        pass
+    try:
+        # Retry-After may also be an HTTP date
+        when = email.utils.parsedate_to_datetime(value)
+        return max(0.0, when.timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def retry_hint(error: BaseException) -> float | None:
+    """Seconds the server asked us to wait: Retry-After header or google.rpc.RetryInfo."""
+    headers = None
+    if isinstance(error, RetryableResponse):
+        headers = error.response.headers
+    elif getattr(error, "resp", None) is not None:
+        headers = error.resp
+    elif getattr(error, "response", None) is not None:
+        headers = getattr(error.response, "headers", None)
+    if headers is not None:
+        hint = _parse_seconds(headers.get("retry-after") or headers.get("Retry-After"))
+        if hint is not None:
+            return hint
+    for detail in getattr(error, "details", None) or []:
+        if isinstance(detail, dict) and "retryDelay" in detail:
+            return _parse_seconds(detail["retryDelay"])
+    return None
+
+
+# ---- the guard ---------------------------------------------------------------
+
+
+class Guard:
+    """Token buckets, retry policy and circuit breakers shared by every call of the process."""
+
+    def __init__(
+        self,
+        quota_per_second: dict[str, float] | None = None,
+        policy: RetryPolicy | None = None,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30.0,
+        sleep: Callable[[float], None] = time.sleep,
+        clock: Callable[[], float] = time.monotonic,
+        project_share: dict[str, float] | None = None,
+    ):
+        self.quota_per_second = {**QUOTA_PER_SECOND, **(quota_per_second or {})}
+        # fraction of a project's quota this process may use, when other processes call it too
+        self.project_share = project_share or {}
+        self.policy = policy or RetryPolicy()
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.sleep = sleep
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._buckets: dict[tuple[str, str], TokenBucket] = {}
+        self._breakers: dict[str, CircuitBreaker] = {}
+
+    def on_clock(self, sleep: Callable[[float], None], clock: Callable[[], float]) -> Guard:
+        """A fresh guard with the same limits and policy, sleeping and timing with other functions."""
+        return Guard(self.quota_per_second, self.policy, self.failure_threshold, self.reset_timeout, sleep, clock,
+                     self.project_share)
+
+    def with_share(self, project_share: dict[str, float]) -> Guard:
+        """A fresh guard with the same limits and policy, using only a share of some projects' quota."""
+        return Guard(self.quota_per_second, self.policy, self.failure_threshold, self.reset_timeout, self.sleep,
+                     self.clock, project_share)
+
+    def bucket(self, project: str, category: str) -> TokenBucket | None:
+        rate = self.quota_per_second.get(category)
+        if not rate:
+            return None
+        with self._lock:
+            key = (project, category)
+            if key not in self._buckets:
+                self._buckets[key] = TokenBucket(rate * self.project_share.get(project, 1.0), clock=self.clock)
+            return self._buckets[key]
+
+    def breaker(self, project: str) -> CircuitBreaker:
+        with self._lock:
+            if project not in self._breakers:
+                self._breakers[project] = CircuitBreaker(self.failure_threshold, self.reset_timeout, self.clock)
+            return self._breakers[project]
+
+    def throttle(self, project: str, category: str) -> None:
+        bucket = self.bucket(project, category)
+        delay = bucket.reserve() if bucket else 0.0
+        if delay > 0:
+            METRICS.observe("ratelimit_wait_seconds", delay, category=category)
+            with span("rate limit wait", "ratelimit", category=category):
+                self.sleep(delay)
+
+    def admit(self, method: str, project: str) -> None:
+        """Wait for the call's token; CircuitOpenError if its project's breaker is open."""
+        self.breaker(project).before_call(f"project {project}")
+        self.throttle(project, category_of(method))
+
+    def succeeded(self, project: str) -> None:
+        self.breaker(project).record_success()
+
+    def failed(self, method: str, project: str, error: BaseException, attempt: int) -> float | None:
+        """Book a failed attempt; return the delay before retrying it, or None to give up."""
+        breaker = self.breaker(project)
+        if not is_retryable(error, category_of(method)):
+            # the project answered, so it is healthy even if the call failed
+            breaker.record_success()
+            return None
+        # throttling says nothing about the project's health, only errors and timeouts count
+        if is_rate_limited(error):
+            breaker.record_throttled()
+        elif breaker.record_failure():
+            METRICS.inc("circuit_open_total", project=project)
+            logging.error(f"Circuit for project {project} opened after repeated failures of {method}")
+            return None
+        hint = retry_hint(error)
+        if attempt >= self.policy.max_attempts or (hint or 0) > self.policy.max_hint:
+            return None
+        record_retry(method)
+        return max(hint or 0.0, self.policy.backoff(attempt))
+
+    def call(self, method: str, project: str, fn: Callable[[], Any]) -> Any:
+        """Run fn() under the project's rate limit and breaker, retrying transient failures."""
+        attempt = 0
+        while True:
+            attempt += 1
+            self.admit(method, project)
+            try:
+                result = fn()
+            except Exception as e:
+                delay = self.failed(method, project, e, attempt)
+                if delay is None:
+                    raise
+                logging.warning(f"{method} in {project} failed ({e}); retry {attempt} in {delay:.1f}s")
+                self.sleep(delay)
+                continue
+            self.succeeded(project)
+            return result
+
+
+_guard = Guard(json.loads(os.environ["GCP_UTILITIES_QUOTA"]) if os.environ.get("GCP_UTILITIES_QUOTA") else None)
+
+
+def get_guard() -> Guard:
+    return _guard
+
+
+def configure(guard: Guard) -> None:
+    """Replace the process-wide guard, e.g. configure(Guard({"mutation": 5.0}))."""
+    global _guard
+    _guard = guard
+
+
+def guarded_call(method: str, project: str, fn: Callable[[], Any]) -> Any:
+    return _guard.call(method, project, fn)
+
+
+class GuardedAdapter(HTTPAdapter):
+    """requests adapter that sends every Compute REST request through the guard."""
+
+    def send(self, request, **kwargs):
+        method = rest_method(request.method, request.url)
+        category = category_of(method)
+
+        def attempt():
+            response = super(GuardedAdapter, self).send(request, **kwargs)
+            if response.status_code in RETRYABLE_CODES or response.status_code == 403:
+                error = RetryableResponse(response)
+                if is_retryable(error, category):
+                    raise error
+            return response
+
+        try:
+            return guarded_call(method, project_of(request.url), attempt)
+        except RetryableResponse as e:
+            # out of retries: hand the last response to the client, which raises its usual error
+            return e.response
@@ -0,0 +1,116 @@
+#! /usr/bin/env python
+from __future__ import annotations
+import sys
+from typing import Any, Iterable
+
+# Compact records for what the tools read back from the API.
+#
+# A snapshot or disk resource carries a few dozen fields; the tools read less
+# than ten of them. List and get calls ask for just those (`fields=` on
+# discovery requests, an x-goog-fieldmask header on compute_v1 calls), and the
+# items are kept as __slots__ records instead of dicts, with the values that
+# repeat across thousands of items (status, disk type, source URL) interned.
+# Records read like the API dicts they replace, `record["sourceDisk"]` and
+# `record.get("labels")`, and like the compute_v1 messages, `record.status`,
+# `record.self_link`.
+
+
+class Record:
+    __slots__ = ()
+    # API field names, in slot order
+    FIELDS: tuple[str, ...] = ()
+    # fields whose values repeat across items; interned
+    SHARED: frozenset[str] = frozenset()
+    _SLOTS: dict[str, str] = {}
+
+    def __init_subclass__(cls) -> None:
+        super().__init_subclass__()
+        cls._SLOTS = dict(zip(cls.FIELDS, cls.__slots__))
+
+    def __init__(self, *values: Any) -> None:
+        for slot, value in zip(self.__slots__, values):
+            setattr(self, slot, value)
+        for slot in self.__slots__[len(values):]:
+            setattr(self, slot, None)
+
+    @classmethod
+    def from_api(cls, item: dict) -> Record:
+        """Keep the FIELDS of an API dict; everything else is dropped."""
+        values = []
+        for field in cls.FIELDS:
+            value = item.get(field)
+            if field in cls.SHARED and isinstance(value, str):
+                value = sys.intern(value)
+            values.append(value)
+        return cls(*values)
+
+    # dict-style reads, keyed by API field name
+
+    def __getitem__(self, field: str) -> Any:
+        value = getattr(self, self._SLOTS[field]) if field in self._SLOTS else None
+        if value is None:
+            raise KeyError(field)
+        return value
+
+    def get(self, field: str, default: Any = None) -> Any:
+        slot = self._SLOTS.get(field)
+        value = getattr(self, slot) if slot else None
+        return default if value is None else value
+
+    def __contains__(self, field: str) -> bool:
+        return self.get(field) is not None
+
+    def to_dict(self) -> dict:
+        return {field: value for field, slot in self._SLOTS.items()
+                if (value := getattr(self, slot)) is not None}
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, Record):
+            return type(self) is type(other) and self.to_dict() == other.to_dict()
+        if isinstance(other, dict):
+            return self.to_dict() == other
+        return NotImplemented
+
+    __hash__ = None  # type: ignore[assignment]
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({self.to_dict()!r})"
+
+
+class SnapshotRecord(Record):
+    __slots__ = ("name", "status", "creation_timestamp", "source_disk", "disk_size_gb",
+                 "storage_bytes", "labels", "self_link")
+    FIELDS = ("name", "status", "creationTimestamp", "sourceDisk", "diskSizeGb",
+              "storageBytes", "labels", "selfLink")
+    SHARED = frozenset({"status", "sourceDisk"})
+
+
+class DiskRecord(Record):
+    __slots__ = ("name", "status", "creation_timestamp", "type", "size_gb", "source_snapshot",
+                 "users", "labels", "self_link")
+    FIELDS = ("name", "status", "creationTimestamp", "type", "sizeGb", "sourceSnapshot",
+              "users", "labels", "selfLink")
+    SHARED = frozenset({"status", "type", "sourceSnapshot"})
+
+
+def get_fields(record: type[Record]) -> str:
+    # partial response for a get call: just the record's fields
+    return ",".join(record.FIELDS)
+
+
+def list_fields(record: type[Record]) -> str:
+    # partial response for a list call: the record's fields of every item, and the page token
+    return f"items({get_fields(record)}),nextPageToken"
+
+
+def field_mask(fields: Iterable[str] | str) -> list[tuple[str, str]]:
+    """Call metadata asking a compute_v1 call for a partial response, e.g. field_mask("status")."""
+    if not isinstance(fields, str):
+        fields = ",".join(fields)
+    return [("x-goog-fieldmask", fields)]
+
+
+# partial responses of the list calls
+SNAPSHOT_LIST_FIELDS = list_fields(SnapshotRecord)
+# what the readiness watcher reads of each listed item
+STATUS_LIST_FIELDS = "items(name,status),nextPageToken"
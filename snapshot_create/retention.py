@@ -0,0 +1,213 @@
+#! /usr/bin/env python
+from __future__ import annotations
+import argparse
+import fnmatch
+import logging
+import sys
+from collections import defaultdict
+from dataclasses import dataclass, field, fields
+from datetime import datetime, timedelta, timezone
+from typing import Iterable
+from .batch import BatchResult, run_batch, summarize
+from .list_snapshot import creation_time, iter_snapshots
+from .metrics import export_at_exit
+from .config import read_config
+from .utils import delete_snapshot
+
+# Snapshot retention: decide what to keep, delete the rest in parallel.
+#
+# The project's snapshots are streamed once and indexed by (policy,
+# sourceDisk), holding only the creation time and name of each. Every group
+# is then decided on its own, newest first:
+#   keep_last N     the N newest snapshots; never deleted, not even by max_age_days
+#   keep_daily N    the newest snapshot of each of the N most recent days with one
+#   keep_weekly N   the same per ISO week
+#   max_age_days D  anything older is deleted, whatever the daily/weekly rules say
+# Without any keep_* rule a policy only applies max_age_days. A policy only
+# sees the snapshots its `labels` / `name_pattern` selector matches, and a snapshot is
+# deleted only if every policy that matches it says so. Only READY snapshots
+# are ever deleted. Days and weeks are UTC.
+#
+# A config file holds the policies:
+#   retention:
+#     - name: prod-disks
+#       labels: {env: prod}        # "*" matches any value of the label
+#       name_pattern: "daily-*"    # fnmatch pattern on the snapshot name
+#       keep_last: 3
+#       keep_daily: 7
+#       keep_weekly: 4
+#       max_age_days: 90
+
+# parallel snapshots.delete (each one waits for its operation)
+DEFAULT_CONCURRENCY = 16
+
+
+@dataclass
+class Policy:
+    name: str = "default"
+    labels: dict[str, str] = field(default_factory=dict)
+    # fnmatch pattern on the snapshot name
+    name_pattern: str | None = None
+    keep_last: int | None = None
+    keep_daily: int | None = None
+    keep_weekly: int | None = None
+    max_age_days: float | None = None
+
+    @classmethod
+    def from_dict(cls, config: dict) -> Policy:
+        known = {f.name for f in fields(cls)}
+        unknown = set(config) - known
+        if unknown:
+            raise ValueError(f"Unknown retention setting(s): {', '.join(sorted(unknown))}")
+        policy = cls(**config)
+        for count in ("keep_last", "keep_daily", "keep_weekly"):
+            value = getattr(policy, count)
+            if value is not None and (not isinstance(value, int) or value < 0):
+                raise ValueError(f"{count} must be a non-negative integer, got {value!r}")
+        if not policy.has_keep_rules and policy.max_age_days is None:
+            raise ValueError(f"Retention policy {policy.name} has no keep_* rule and no max_age_days")
+        return policy
+
+    def matches(self, snapshot: dict) -> bool:
+        if self.name_pattern and not fnmatch.fnmatchcase(snapshot["name"], self.name_pattern):
+            return False
+        labels = snapshot.get("labels") or {}
+        return all(key in labels and value in ("*", labels[key]) for key, value in self.labels.items())
+
+    @property
+    def has_keep_rules(self) -> bool:
+        return any(n is not None for n in (self.keep_last, self.keep_daily, self.keep_weekly))
+
+
+@dataclass
+class Decision:
+    name: str
+    source_disk: str
+    created: datetime
+    delete: bool
+    reason: str
+
+
+# (creation time, snapshot name), newest first once sorted
+_Entry = tuple[datetime, str]
+
+
+def index_snapshots(snapshots: Iterable[dict], policies: list[Policy]) -> dict[tuple[int, str], list[_Entry]]:
+    """One pass over the listing: {(policy index, sourceDisk): [(created, name), ...]} for READY snapshots."""
+    index: dict[tuple[int, str], list[_Entry]] = defaultdict(list)
+    for snapshot in snapshots:
+        if snapshot.get("status", "READY") != "READY":
+            continue
+        entry = (creation_time(snapshot), snapshot["name"])
+        source = snapshot.get("sourceDisk") or ""
+        for i, policy in enumerate(policies):
+            if policy.matches(snapshot):
+                index[(i, source)].append(entry)
+    return index
+
+
+def _keep_newest_per(entries: list[_Entry], bucket, count: int, reason: str, kept: dict[str, str]) -> None:
+    seen = set()
+    for created, name in entries:
+        if len(seen) >= count:
+            break
+        key = bucket(created.astimezone(timezone.utc))
+        if key not in seen:
+            seen.add(key)
+            kept.setdefault(name, reason)
+
+
+def decide(policy: Policy, entries: list[_Entry], now: datetime) -> dict[str, str | None]:
+    """Map each snapshot name of one group to why it is kept, or None if the policy deletes it."""
+    entries = sorted(entries, reverse=True)
+    kept: dict[str, str] = {}
+    for _, name in entries[:policy.keep_last or 0]:
+        kept[name] = f"{policy.name}: last {policy.keep_last}"
+    floor = set(kept)
+    if policy.keep_daily:
+        _keep_newest_per(entries, lambda t: t.date(), policy.keep_daily,
+                         f"{policy.name}: daily {policy.keep_daily}", kept)
+    if policy.keep_weekly:
+        _keep_newest_per(entries, lambda t: t.isocalendar()[:2], policy.keep_weekly,
+                         f"{policy.name}: weekly {policy.keep_weekly}", kept)
+    if not policy.has_keep_rules:
+        kept = {name: f"{policy.name}: younger than {policy.max_age_days} days" for _, name in entries}
+    if policy.max_age_days is not None:
+        cutoff = now - timedelta(days=policy.max_age_days)
+        for created, name in entries:
+            if created < cutoff and name not in floor:
+                kept.pop(name, None)
+    return {name: kept.get(name) for _, name in entries}
+
+
+def evaluate(snapshots: Iterable[dict], policies: list[Policy], now: datetime | None = None) -> list[Decision]:
+    """Decide every snapshot matched by at least one policy, oldest first."""
+    now = now or datetime.now(timezone.utc)
+    index = index_snapshots(snapshots, policies)
+    keep_reasons: dict[str, list[str]] = defaultdict(list)
+    seen: dict[str, tuple[datetime, str]] = {}
+    for (i, source), entries in index.items():
+        for created, name in entries:
+            seen[name] = (created, source)
+        for name, reason in decide(policies[i], entries, now).items():
+            if reason:
+                keep_reasons[name].append(reason)
+    decisions = [
+        Decision(name, source, created, delete=name not in keep_reasons,
+                 reason=", ".join(keep_reasons[name]) if name in keep_reasons else "not kept by any policy")
+        for name, (created, source) in seen.items()
+    ]
+    return sorted(decisions, key=lambda d: (d.created, d.name))
+
+
+def delete_snapshots(project_id: str, names: list[str], concurrency: int = DEFAULT_CONCURRENCY) -> list[BatchResult]:
+    """Delete snapshots through a bounded worker pool; one BatchResult per name, failures included."""
+    return run_batch(lambda entry: delete_snapshot(project_id, entry["name"]),
+                     [{"name": name} for name in names], key=lambda entry: entry["name"],
+                     concurrency=concurrency)
+
+
+def prune(project_id: str, policies: list[Policy], concurrency: int = DEFAULT_CONCURRENCY,
+          dry_run: bool = False, service=None, now: datetime | None = None) -> tuple[list[Decision], list[BatchResult]]:
+    """Apply the policies to the project's snapshots; returns the decisions and the delete results."""
+    decisions = evaluate(iter_snapshots(project_id, service=service), policies, now)
+    doomed = [d.name for d in decisions if d.delete]
+    logging.info(f"Retention: {len(decisions) - len(doomed)} snapshots to keep, {len(doomed)} to delete")
+    if dry_run or not doomed:
+        return decisions, []
+    return decisions, delete_snapshots(project_id, doomed, concurrency)
+
+
+def read_policies(path: str) -> list[Policy]:
+    return [Policy.from_dict(entry) for entry in read_config(path)["retention"]]
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(
+        description="Delete the snapshots that no retention policy keeps.")
+    parser.add_argument("-c", "--config", required=True,
+                        help="YAML file with a `retention` list of policies")
+    parser.add_argument("-p", "--project_id", required=True,
+                        help="GCP Project ID whose snapshots are pruned")
+    parser.add_argument("-d", "--dry_run", action="store_true",
+                        help="Only show what would be kept and deleted")
+    parser.add_argument("-n", "--concurrency", type=int, default=DEFAULT_CONCURRENCY,
+                        help=f"Snapshots deleted in parallel (default {DEFAULT_CONCURRENCY})")
+    parser.add_argument("--metrics_out", default=None,
+                        help="Write API metrics here at exit (*.prom: Prometheus text, else JSON)")
+    args = parser.parse_args()
+    if args.metrics_out:
+        export_at_exit(args.metrics_out)
+
+    decisions, results = prune(args.project_id, read_policies(args.config),
+                               concurrency=args.concurrency, dry_run=args.dry_run)
+    for decision in decisions:
+        mark = "-" if decision.delete else "="
+        print(f"  {mark} {decision.created.isoformat()} {decision.name} ({decision.reason})")
+    summary = summarize(results)
+    if args.dry_run:
+        print(f"{sum(d.delete for d in decisions)} of {len(decisions)} snapshots would be deleted")
+    else:
+        print(f"Snapshots deleted: {len(summary.get('succeeded', []))}, failed: {len(summary.get('failed', []))}")
+    sys.exit(1 if summary.get("failed") else 0)
@@ -0,0 +1,212 @@
+#! /usr/bin/env python
+from __future__ import annotations
+import logging
+import multiprocessing
+import os
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import nullcontext
+from dataclasses import dataclass, field
+from . import ratelimit
+from .config import DISKS, SNAPSHOTS, TARGET_PROJECT
+from .create_disk_from_snapshot import create_disks_from_snapshots
+from .create_snapshot import create_snapshots
+from .journal import Journal, entries_to_run
+from .plan import CONFLICT, plan_disks, plan_snapshots
+from .preflight import preflight_disks, preflight_snapshots
+from .watcher import ReadinessWatcher
+
+# Sharded runs: one worker process per project.
+#
+# One process tops out well below what several projects' quotas allow. A
+# sharded run partitions the config entries by (target project, source
+# project), optionally also by zone, and runs each shard in a worker process
+# of its own: own clients and connections, own rate limiter and circuit
+# breakers (ratelimit.py), own plan, preflight and journal. Up to `processes`
+# shards run at once. A project called by several shards that may run at the
+# same time has its quota split evenly between them, so together they stay
+# within it. The parent only partitions and merges the per-shard reports into
+# one, so throughput grows with the number of projects.
+#
+# Workers are spawned, not forked: a fork would inherit the parent's clients,
+# their connection pools and background threads.
+
+DEFAULT_PROCESSES = os.cpu_count() or 4
+
+
+@dataclass
+class Shard:
+    section: str
+    target_project_id: str
+    source_project_id: str
+    zone: str | None = None
+    entries: list[dict] = field(default_factory=list, repr=False)
+    # project -> fraction of its quota this shard may use; projects not listed get all of it
+    quota_share: dict[str, float] = field(default_factory=dict)
+
+    @property
+    def projects(self) -> set[str]:
+        return {self.target_project_id, self.source_project_id}
+
+    @property
+    def name(self) -> str:
+        # also names the shard's journal: CONFIG.journal.<name>
+        return "-".join(part for part in (self.target_project_id, self.source_project_id, self.zone) if part)
+
+
+@dataclass
+class ShardOptions:
+    dry_run: bool = False
+    skip_preflight: bool = False
+    # CONFIG.journal; each shard appends its name
+    journal: str | None = None
+    resume: bool = False
+    # snapshots created at once within a shard, and at most per disk project / zone
+    concurrency: int = 8
+    project_limit: int | None = None
+    zone_limit: int | None = None
+    # wait on the shard's snapshots through one ReadinessWatcher
+    watch: bool = False
+    # disks.insert / disks.get calls per batched request within a shard
+    batch_size: int | None = None
+
+
+@dataclass
+class ShardReport:
+    shard: str
+    entries: int
+    pid: int | None = None
+    plan: dict[str, int] = field(default_factory=dict)
+    conflicts: list[str] = field(default_factory=list)
+    problems: list[str] = field(default_factory=list)
+    succeeded: list[str] = field(default_factory=list)
+    failed: dict[str, str] = field(default_factory=dict)
+    # the shard itself broke: its worker died, or planning raised
+    error: str | None = None
+    seconds: float = 0.0
+
+    @property
+    def ok(self) -> bool:
+        return not (self.conflicts or self.problems or self.failed or self.error)
+
+
+def source_project(section: str, entry: dict) -> str:
+    return entry["disk_project_id"] if section == SNAPSHOTS else entry["src_project_id"]
+
+
+def partition(section: str, entries: list[dict], project_id: str, by_zone: bool = False) -> list[Shard]:
+    """Group entries into shards by target project (-p unless the entry names one), source project and,
+    with `by_zone`, zone; shards and the entries within them keep config order."""
+    shards: dict[tuple, Shard] = {}
+    for entry in entries:
+        target = entry.get(TARGET_PROJECT) or project_id
+        zone = entry["target_zone"] if by_zone else None
+        key = (target, source_project(section, entry), zone)
+        if key not in shards:
+            shards[key] = Shard(section, *key)
+        shards[key].entries.append(entry)
+    return list(shards.values())
+
+
+def share_quota(shards: list[Shard], processes: int) -> None:
+    """Split each project's quota evenly between the shards that may call it at the same time."""
+    callers: dict[str, int] = defaultdict(int)
+    for shard in shards:
+        for project in shard.projects:
+            callers[project] += 1
+    for shard in shards:
+        shard.quota_share = {project: 1 / min(callers[project], processes)
+                             for project in sorted(shard.projects) if min(callers[project], processes) > 1}
+
+
+def run_shard(shard: Shard, options: ShardOptions) -> ShardReport:
+    """Plan, preflight and create one shard; runs in a worker process."""
+    start = time.monotonic()
+    report = ShardReport(shard.name, len(shard.entries), pid=os.getpid())
+    target = shard.target_project_id
+    guard = ratelimit.get_guard()
+    if shard.quota_share:
+        ratelimit.configure(guard.with_share(shard.quota_share))
+    try:
+        plan = (plan_snapshots if shard.section == SNAPSHOTS else plan_disks)(target, shard.entries)
+        report.plan = plan.counts()
+        report.conflicts = [f"{item.key}: {item.reason}" for item in plan.of(CONFLICT)]
+        if not options.skip_preflight:
+            check = preflight_snapshots if shard.section == SNAPSHOTS else preflight_disks
+            report.problems = [f"{p.key}: {p.message}" for p in check(target, plan.to_create)]
+        if report.problems or options.dry_run:
+            return report
+        journal = Journal(f"{options.journal}.{shard.name}", resume=options.resume) if options.journal else None
+        entries = entries_to_run(plan, journal)
+        if shard.section == SNAPSHOTS:
+            with ReadinessWatcher() if options.watch else nullcontext() as watcher:
+                results = create_snapshots(target, entries, concurrency=options.concurrency,
+                                           project_limit=options.project_limit, zone_limit=options.zone_limit,
+                                           watcher=watcher, journal=journal)
+        else:
+            batch = {"batch_size": options.batch_size} if options.batch_size else {}
+            results = create_disks_from_snapshots(target, entries, journal=journal, **batch)
+        for result in results:
+            if result.ok:
+                report.succeeded.append(result.key)
+            else:
+                report.failed[result.key] = str(result.error)
+    except Exception as e:
+        logging.error(f"Shard {shard.name} failed: {e}", exc_info=True)
+        report.error = f"{type(e).__name__}: {e}"
+    finally:
+        ratelimit.configure(guard)
+        report.seconds = time.monotonic() - start
+    return report
+
+
+def run_sharded(
+    section: str,
+    project_id: str,
+    entries: list[dict],
+    processes: int = DEFAULT_PROCESSES,
+    by_zone: bool = False,
+    options: ShardOptions | None = None,
+) -> list[ShardReport]:
+    """Run every shard of `entries` in a pool of `processes` worker processes; one report per shard,
+    in shard order."""
+    options = options or ShardOptions()
+    shards = partition(section, entries, project_id, by_zone)
+    if not shards:
+        return []
+    share_quota(shards, processes)
+    reports: dict[str, ShardReport] = {}
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=min(processes, len(shards)), mp_context=context) as pool:
+        futures = {pool.submit(run_shard, shard, options): shard for shard in shards}
+        for future in as_completed(futures):
+            shard = futures[future]
+            try:
+                report = future.result()
+            except Exception as e:
+                # the worker process died (BrokenProcessPool) or the report couldn't come back
+                report = ShardReport(shard.name, len(shard.entries), error=f"{type(e).__name__}: {e}")
+            logging.info(f"Shard {report.shard} finished in {report.seconds:.1f}s: "
+                         f"{len(report.succeeded)} created, {len(report.failed)} failed")
+            reports[shard.name] = report
+    return [reports[shard.name] for shard in shards]
+
+
+def format_report(section: str, reports: list[ShardReport]) -> str:
+    lines = [f"Sharded run of {section}: {len(reports)} shard(s), {len({r.pid for r in reports if r.pid})} process(es)"]
+    for report in reports:
+        mark = "ok" if report.ok else "FAILED"
+        counts = ", ".join(f"{count} {action}" for action, count in report.plan.items())
+        lines.append(f"  {mark:<6} {report.shard}: {report.entries} entries ({counts or 'not planned'}), "
+                     f"{len(report.succeeded)} created, {len(report.failed)} failed, {report.seconds:.1f}s")
+        if report.error:
+            lines.append(f"    ! {report.error}")
+        lines += [f"    ! conflict {conflict}" for conflict in report.conflicts]
+        lines += [f"    ! preflight {problem}" for problem in report.problems]
+        lines += [f"    ! {key}: {error}" for key, error in report.failed.items()]
+    created = sum(len(r.succeeded) for r in reports)
+    failed = sum(len(r.failed) for r in reports)
+    broken = sum(1 for r in reports if not r.ok)
+    lines.append(f"{created} created, {failed} failed, {broken} shard(s) with problems")
+    return "\n".join(lines)
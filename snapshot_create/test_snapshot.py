@@ -1,9 +1,13 @@
 #! /usr/bin/env python
 
 # from ..snapshot_create.create_snapshot import *
+import os
+import sys
 import pytest
 import subprocess
-from list_snapshot import *
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
+from snapshot_create.list_snapshot import *
 
 # write single test expands to many other ones
 # @pytest.mark.parametrize(
@@ -0,0 +1,194 @@
+#! /usr/bin/env python
+from __future__ import annotations
+import atexit
+import contextvars
+import cProfile
+import functools
+import inspect
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Iterator
+
+# Run timeline in Chrome trace-event format.
+#
+# When enabled (--trace_out / --profile), the phases of a run are recorded as
+# complete ("X") events: config load, client and discovery setup, credential
+# refreshes, every API call (status reads of a wait included), the waits
+# themselves and an instant event when a resource is READY. Inside
+# resource(name) everything lands on that resource's own track, whatever
+# thread runs it, so a 500-resource run reads as 500 timelines. Gaps inside
+# a wait are sleeps between polls. Load the file in chrome://tracing or
+# https://ui.perfetto.dev.
+#
+# Disabled, a span costs one attribute check. --profile also runs cProfile
+# for the CPU side and dumps pstats for `python -m pstats` / snakeviz; like
+# any cProfile run it only sees the main thread, so worker pools show up as
+# waits there and as their API calls in the trace.
+
+_resource: contextvars.ContextVar[str | None] = contextvars.ContextVar("trace_resource", default=None)
+
+
+class Tracer:
+    def __init__(self):
+        self.enabled = False
+        self._lock = threading.Lock()
+        self._events: list[dict] = []
+        # resource name -> synthetic tid of its track
+        self._tracks: dict[str, int] = {}
+        self._origin = time.monotonic()
+        self._pid = os.getpid()
+
+    def enable(self) -> None:
+        self.enabled = True
+
+    def reset(self) -> None:
+        with self._lock:
+            self._events.clear()
+            self._tracks.clear()
+            self._origin = time.monotonic()
+
+    def _tid(self) -> int:
+        name = _resource.get()
+        if name is None:
+            return threading.get_ident()
+        tid = self._tracks.get(name)
+        if tid is None:
+            # tracks are numbered from 1 and named with a metadata event
+            tid = self._tracks[name] = len(self._tracks) + 1
+            self._events.append({"ph": "M", "name": "thread_name", "pid": self._pid, "tid": tid,
+                                 "args": {"name": name}})
+        return tid
+
+    def _us(self, t: float) -> float:
+        return round((t - self._origin) * 1e6, 1)
+
+    def complete(self, name: str, cat: str, start: float, end: float, **args: Any) -> None:
+        """Record a phase between two time.monotonic() readings."""
+        if not self.enabled:
+            return
+        event = {"ph": "X", "name": name, "cat": cat, "ts": self._us(start),
+                 "dur": round((end - start) * 1e6, 1), "pid": self._pid}
+        if args:
+            event["args"] = args
+        with self._lock:
+            event["tid"] = self._tid()
+            self._events.append(event)
+
+    def instant(self, name: str, cat: str, **args: Any) -> None:
+        if not self.enabled:
+            return
+        event = {"ph": "i", "s": "t", "name": name, "cat": cat, "ts": self._us(time.monotonic()),
+                 "pid": self._pid}
+        if args:
+            event["args"] = args
+        with self._lock:
+            event["tid"] = self._tid()
+            self._events.append(event)
+
+    @contextmanager
+    def span(self, name: str, cat: str = "phase", **args: Any) -> Iterator[None]:
+        if not self.enabled:
+            yield
+            return
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.complete(name, cat, start, time.monotonic(), **args)
+
+    def events(self) -> list[dict]:
+        with self._lock:
+            return list(self._events)
+
+    def write(self, path: str) -> None:
+        with open(path, "w") as f:
+            json.dump({"traceEvents": self.events(), "displayTimeUnit": "ms"}, f)
+
+
+TRACER = Tracer()
+
+
+def span(name: str, cat: str = "phase", **args: Any):
+    return TRACER.span(name, cat, **args)
+
+
+@contextmanager
+def resource(name: str) -> Iterator[None]:
+    """Put everything traced inside on the track of `name` (a disk or snapshot)."""
+    token = _resource.set(name)
+    try:
+        yield
+    finally:
+        _resource.reset(token)
+
+
+def traced(name: str, cat: str = "phase"):
+    """Decorator form of span()."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with TRACER.span(name, cat):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def on_track(kind: str, name_arg: str):
+    """Run the decorated function on the track of the resource named by its `name_arg` argument."""
+    def decorator(fn):
+        signature = inspect.signature(fn)
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not TRACER.enabled:
+                return fn(*args, **kwargs)
+            name = signature.bind_partial(*args, **kwargs).arguments.get(name_arg)
+            with resource(f"{kind} {name}"), TRACER.span(fn.__name__):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def trace_credential_refresh(credentials: Any) -> None:
+    # google-auth refreshes lazily, inside whichever call first finds the token expired
+    refresh = getattr(credentials, "refresh", None)
+    if refresh is None or getattr(refresh, "_traced", False):
+        return
+    try:
+        credentials.refresh = traced("credential refresh", "auth")(refresh)
+        credentials.refresh._traced = True
+    except (AttributeError, TypeError):
+        pass
+
+
+def trace_at_exit(trace_path: str | None = None, profile_path: str | None = None) -> None:
+    """Start tracing (and cProfile with a profile_path); both files are written at exit.
+
+    With only a profile_path, the trace goes to PROFILE_PATH.trace.json.
+    """
+    trace_path = trace_path or f"{profile_path}.trace.json"
+    TRACER.enable()
+    profiler = None
+    if profile_path:
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    def write() -> None:
+        try:
+            if profiler is not None:
+                profiler.disable()
+                profiler.dump_stats(profile_path)
+                logging.info(f"CPU profile written to {profile_path}")
+            TRACER.write(trace_path)
+            logging.info(f"Trace written to {trace_path}")
+        except OSError as e:
+            logging.error(f"Could not write the trace: {e}")
+    atexit.register(write)
+
+
+if os.environ.get("GCP_UTILITIES_TRACE_OUT"):
+    trace_at_exit(os.environ["GCP_UTILITIES_TRACE_OUT"])
@@ -3,26 +3,53 @@ import sys
 from typing import Any
 from google.cloud import compute_v1
 from google.api_core.extended_operation import ExtendedOperation
+from google.api_core.future import polling
+from google.api_core.retry import Retry, exponential_sleep_generator
 import logging
-import time
-import yaml
+from . import clients
+from .clients import get_client, get_compute_service
+from .metrics import count_poll, tracked_wait
+from .records import field_mask
 
 
 # Set the logging level to DEBUG
 logging.basicConfig(level=logging.DEBUG)
 
+# Backoff for status polls: the first check comes after at most 0.5 s and the
+# interval grows 1.5x up to 10 s, each sleep drawn uniformly (full jitter) so
+# hundreds of waiters don't poll in lockstep.
+POLL_INITIAL = 0.5
+POLL_MAXIMUM = 10.0
+POLL_MULTIPLIER = 1.5
 
-def read_config(file_path: str) -> dict:
-    # Read configuration from config.yaml
-    with open(file_path, 'r') as file:
-        return yaml.safe_load(file)
+
+def _counted(predicate):
+    # api-core polls inside ExtendedOperation.result(): every "not complete yet" is one operations.get
+    def not_complete(error: Exception) -> bool:
+        retry = predicate(error)
+        if retry:
+            count_poll()
+        return retry
+    return not_complete
+
+
+OPERATION_POLLING = Retry(
+    predicate=_counted(polling.POLLING_PREDICATE),
+    initial=POLL_INITIAL,
+    maximum=POLL_MAXIMUM,
+    multiplier=POLL_MULTIPLIER,
+    timeout=300,
+)
 
 
 def wait_for_extended_operation(
     operation: ExtendedOperation, verbose_name: str = "operation", timeout: int = 300
 ) -> Any:
-    # operation is long running operation
-    result = operation.result(timeout=timeout)
+    # operation is long running operation; the read that finds it DONE is a poll too,
+    # the ones before it are counted by OPERATION_POLLING's predicate
+    if getattr(operation.status, "name", operation.status) != "DONE":
+        count_poll()
+    result = operation.result(timeout=timeout, polling=OPERATION_POLLING)
     if operation.error_code:
         print(
             f"Error during {verbose_name}: [Code: {operation.error_code}]: {
@@ -42,64 +69,200 @@ def wait_for_extended_operation(
     return result
 
 
-def delete_snapshot(project_id: str, snapshot_name: str) -> None:
-    snapshot_client = compute_v1.SnapshotsClient()
+def operation_error(operation: Any, refresh: bool = False) -> BaseException | None:
+    """The error an operation finished with; None while it runs or once it succeeded.
+
+    Takes an ExtendedOperation or a discovery operation dict. Only with
+    `refresh` is an unfinished ExtendedOperation read again (one API call).
+    """
+    if isinstance(operation, dict):
+        if operation.get("status") == "DONE" and operation.get("error"):
+            return RuntimeError(f"Operation {operation.get('name')} failed: {operation['error'].get('errors', [])}")
+        return None
+    if refresh:
+        try:
+            operation.done()
+        except Exception as e:
+            logging.debug(f"Could not read operation {operation.name}: {e}")
+    if operation.error_code:
+        return operation.exception() or RuntimeError(operation.error_message)
+    return None
+
+
+def delete_snapshot(project_id: str, snapshot_name: str, snapshot_client: compute_v1.SnapshotsClient | None = None) -> None:
+    snapshot_client = snapshot_client or get_client(compute_v1.SnapshotsClient)
     operation = snapshot_client.delete(
         project=project_id, snapshot=snapshot_name)
     wait_for_extended_operation(operation, "snapshot deletion")
 
 
-def wait_for_disk_creation(project_id, zone, disk_name, operation):
-    max_retries = 60  # Maximum retries (e.g., 60 seconds)
-    retry_interval = 5  # Time to wait between retries (in seconds)
-    disk_client = compute_v1.DisksClient()
-    for attempt in range(max_retries):
-        result = disk_client.get(project=project_id, zone=zone, disk=disk_name)
-        if result.status == "READY":
-            logging.info(f"Disk '{disk_name}' is ready.")
+def wait_for_discovery_operation(
+    operation: dict, project_id: str, zone: str | None = None, service=None, timeout: int = 300
+) -> dict:
+    # operation is the dict returned by a discovery insert/delete .execute();
+    # operations.wait long-polls server side and returns as soon as it is DONE
+    service = service or get_compute_service()
+    operations = service.zoneOperations() if zone else service.globalOperations()
+    location = {"zone": zone} if zone else {}
+    deadline = clients.monotonic() + timeout
+    delays = exponential_sleep_generator(
+        POLL_INITIAL, POLL_MAXIMUM, POLL_MULTIPLIER)
+    while operation.get("status") != "DONE":
+        if clients.monotonic() >= deadline:
+            raise TimeoutError(
+                f"Operation {operation.get('name')} did not finish within {timeout} seconds")
+        previous_status = operation.get("status")
+        count_poll()
+        operation = operations.wait(
+            project=project_id, operation=operation["name"], **location).execute()
+        # wait may return early without progress; back off before asking again
+        if operation.get("status") == previous_status and operation.get("status") != "DONE":
+            clients.sleep(next(delays))
+    if operation.get("error"):
+        errors = operation["error"].get("errors", [])
+        raise RuntimeError(
+            f"Operation {operation.get('name')} failed: {errors}")
+    return operation
+
+
+def _wait_for_operation(operation, project_id: str, zone: str | None, service, verbose_name: str, timeout: int) -> None:
+    # compute_v1 inserts return an ExtendedOperation, discovery inserts an operation dict
+    if isinstance(operation, dict):
+        wait_for_discovery_operation(
+            operation, project_id, zone=zone, service=service, timeout=timeout)
+    else:
+        wait_for_extended_operation(operation, verbose_name, timeout=timeout)
+
+
+def _wait_until_ready(get_status, verbose_name: str, timeout: int) -> bool:
+    # poll with jittered exponential backoff until the resource reports READY
+    deadline = clients.monotonic() + timeout
+    delays = exponential_sleep_generator(
+        POLL_INITIAL, POLL_MAXIMUM, POLL_MULTIPLIER)
+    attempt = 0
+    while True:
+        attempt += 1
+        count_poll()
+        status = get_status()
+        if status == "READY":
+            logging.info(f"{verbose_name} is ready.")
             return True
-        else:
-            logging.info(
-                f"Waiting for disk '{disk_name}' to be ready... Attempt {attempt + 1}/{max_retries}")
-            time.sleep(retry_interval)
+        if status == "FAILED":
+            logging.error(f"{verbose_name} failed.")
+            return False
+        delay = min(next(delays), deadline - clients.monotonic())
+        if delay <= 0:
+            break
+        logging.info(
+            f"Waiting for {verbose_name} to be ready ({status})... Attempt {attempt}")
+        clients.sleep(delay)
 
     logging.error(
-        f"Disk '{disk_name}' did not become ready within the timeout period.")
+        f"{verbose_name} did not become ready within the timeout period.")
     return False
 
 
-def wait_for_snapshot_creation(project_id, snapshot_name):
-    max_retries = 60  # Maximum retries (e.g., 60 seconds)
-    retry_interval = 5  # Time to wait between retries (in seconds)
-    snapshot_client = compute_v1.SnapshotsClient()
-    for attempt in range(max_retries):
-        result = snapshot_client.get(
-            project=project_id, snapshot=snapshot_name)
-        if result.status == "READY":
-            logging.info(f"Snapshot '{snapshot_name}' is ready.")
-            return True
+def _check_operation(operation, verbose_name: str, refresh: bool = False) -> None:
+    # with a watcher the insert operation isn't waited on, but a rejected insert is already DONE with its error
+    error = operation_error(operation, refresh) if operation is not None else None
+    if error is not None:
+        logging.error(f"Error during {verbose_name}: {error}")
+        raise error
+
+
+def _wait_for_watched(future, verbose_name: str) -> bool:
+    # the watcher enforces the timeout and fails the future itself
+    try:
+        future.result()
+    except Exception as e:
+        logging.error(f"{verbose_name} did not become ready: {e}")
+        return False
+    logging.info(f"{verbose_name} is ready.")
+    return True
+
+
+def wait_for_disk_creation(project_id, zone, disk_name, operation=None, disk_client=None, service=None, timeout=300, watcher=None):
+    """Wait until a disk is READY.
+
+    With a shared ReadinessWatcher the disk is polled together with every
+    other pending resource of the run; an insert operation that already
+    failed raises its error instead of being watched. Otherwise, with the operation returned
+    by the insert (ExtendedOperation or discovery dict) this waits on the
+    operation and confirms with a single get; without one it falls back to
+    polling the disk with backoff.
+    """
+    with tracked_wait("disk") as wait:
+        if watcher is not None:
+            _check_operation(operation, f"disk '{disk_name}' creation")
+            ready = _wait_for_watched(
+                watcher.watch_disk(project_id, zone, disk_name, timeout=timeout),
+                f"Disk '{disk_name}'")
+            if not ready:
+                # the disk never became READY: a failed operation says why
+                _check_operation(operation, f"disk '{disk_name}' creation", refresh=True)
         else:
-            logging.info(
-                f"Waiting for snapshot '{snapshot_name}' to be ready... Attempt {attempt + 1}/{max_retries}")
-            time.sleep(retry_interval)
+            disk_client = disk_client or get_client(compute_v1.DisksClient)
+            start = clients.monotonic()
+            if operation is not None:
+                _wait_for_operation(operation, project_id, zone,
+                                    service, f"disk '{disk_name}' creation", timeout)
+            ready = _wait_until_ready(
+                lambda: disk_client.get(
+                    project=project_id, zone=zone, disk=disk_name, metadata=field_mask("status")).status,
+                f"Disk '{disk_name}'",
+                max(0, timeout - (clients.monotonic() - start)),
+            )
+        wait.outcome = "ready" if ready else "not_ready"
+        return ready
 
-    logging.error(
-        f"Snapshot '{snapshot_name}' did not become ready within the timeout period.")
-    return False
+
+def wait_for_snapshot_creation(project_id, snapshot_name, snapshot_client=None, operation=None, service=None, timeout=300, watcher=None):
+    """Wait until a snapshot is READY, the same way wait_for_disk_creation does for disks."""
+    with tracked_wait("snapshot") as wait:
+        if watcher is not None:
+            _check_operation(operation, f"snapshot '{snapshot_name}' creation")
+            ready = _wait_for_watched(
+                watcher.watch_snapshot(project_id, snapshot_name, timeout=timeout),
+                f"Snapshot '{snapshot_name}'")
+            if not ready:
+                _check_operation(operation, f"snapshot '{snapshot_name}' creation", refresh=True)
+        else:
+            snapshot_client = snapshot_client or get_client(compute_v1.SnapshotsClient)
+            start = clients.monotonic()
+            if operation is not None:
+                _wait_for_operation(operation, project_id, None, service,
+                                    f"snapshot '{snapshot_name}' creation", timeout)
+            ready = _wait_until_ready(
+                lambda: snapshot_client.get(
+                    project=project_id, snapshot=snapshot_name, metadata=field_mask("status")).status,
+                f"Snapshot '{snapshot_name}'",
+                max(0, timeout - (clients.monotonic() - start)),
+            )
+        wait.outcome = "ready" if ready else "not_ready"
+        return ready
 
 
-def delete_disk_if_exists(project_id: str, zone: str, disk_name: str) -> None:
+def delete_disk_if_exists(project_id: str, zone: str, disk_name: str, disk_client: compute_v1.DisksClient | None = None, inventory=None) -> None:
 
-    disk_client = compute_v1.DisksClient()
+    # a fresh inventory answers "does it exist" without an API call
+    if inventory is not None and not inventory.disk_exists(project_id, zone, disk_name):
+        logging.debug(
+            f"Disk '{disk_name}' not found in zone '{zone}' (inventory). No action taken.")
+        return
+    disk_client = disk_client or get_client(compute_v1.DisksClient)
     # Check if the disk exists before attempting to delete
     try:
-        res = disk_client.get(project=project_id, zone=zone, disk=disk_name)
-        print(disk_client.list(
-            project=project_id, zone=zone), file=sys.stderr, flush=True)
-        if (res):
+        res = disk_client.get(project=project_id, zone=zone, disk=disk_name, metadata=field_mask("name,users"))
+        # many disks at once: cleanup.delete_disks resolves them with list calls instead
+        if res and res.users:
+            logging.warning(
+                f"Disk '{disk_name}' in zone '{zone}' is attached to {', '.join(res.users)}. No action taken.")
+        elif (res):
             operation = disk_client.delete(
                 project=project_id, zone=zone, disk=disk_name)
             wait_for_extended_operation(operation, "disk deletion")
+            if inventory is not None:
+                inventory.forget_disk(project_id, zone, disk_name)
         else:
             logging.debug(
                 f"Disk '{disk_name}' not found in zone '{zone}'. No action taken.")
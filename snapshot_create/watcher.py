@@ -0,0 +1,225 @@
+#! /usr/bin/env python
+from __future__ import annotations
+from collections import defaultdict
+from concurrent.futures import Future
+from google.cloud import compute_v1
+import logging
+import threading
+from . import clients
+from .clients import get_client
+from .metrics import METRICS
+from .records import STATUS_LIST_FIELDS, field_mask
+
+# Names per list call; keeps the OR-filter well under the API's filter length.
+FILTER_CHUNK_SIZE = 50
+
+
+def name_filter(names: list[str]) -> str:
+    # (name = "a") OR (name = "b") ...
+    return " OR ".join(f'(name = "{name}")' for name in names)
+
+
+class _Pending:
+    __slots__ = ("future", "deadline", "waiting_for")
+
+    def __init__(self, future: Future, deadline: float, waiting_for: str = "become ready"):
+        self.future = future
+        self.deadline = deadline
+        # for the timeout message
+        self.waiting_for = waiting_for
+
+
+class ReadinessWatcher:
+    """Tracks every pending snapshot and disk of a run and polls them together.
+
+    Each tick issues one filtered `snapshots.list` per project with pending
+    snapshots and one `disks.aggregatedList` per project with pending disks
+    (chunked by FILTER_CHUNK_SIZE names), so status reads scale with the number
+    of projects rather than the number of resources. watch_*() returns a
+    Future that resolves to the resource once it is READY, or fails on FAILED
+    or timeout; watch_disk_deletion() resolves once the disk is gone.
+    """
+
+    def __init__(
+        self,
+        interval: float = 2.0,
+        timeout: float = 300,
+        snapshot_client: compute_v1.SnapshotsClient | None = None,
+        disk_client: compute_v1.DisksClient | None = None,
+        autostart: bool = True,
+    ):
+        self.interval = interval
+        # autostart=False leaves ticking to the caller via poll_once()
+        self.autostart = autostart
+        self.timeout = timeout
+        self._snapshot_client = snapshot_client
+        self._disk_client = disk_client
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread: threading.Thread | None = None
+        self._stopped = False
+        # project -> snapshot name -> pending
+        self._snapshots: dict[str, dict[str, _Pending]] = defaultdict(dict)
+        # project -> (zone, disk name) -> pending
+        self._disks: dict[str, dict[tuple[str, str], _Pending]] = defaultdict(dict)
+        # project -> (zone, disk name) -> pending deletion, resolved once the disk is gone
+        self._deleted_disks: dict[str, dict[tuple[str, str], _Pending]] = defaultdict(dict)
+
+    @property
+    def _tables(self) -> tuple[dict, ...]:
+        return (self._snapshots, self._disks, self._deleted_disks)
+
+    @property
+    def snapshot_client(self) -> compute_v1.SnapshotsClient:
+        return self._snapshot_client or get_client(compute_v1.SnapshotsClient)
+
+    @property
+    def disk_client(self) -> compute_v1.DisksClient:
+        return self._disk_client or get_client(compute_v1.DisksClient)
+
+    def _add(self, table: dict, project_id: str, key, callback, timeout: float | None,
+             waiting_for: str = "become ready") -> Future:
+        with self._lock:
+            # watching the same resource twice shares one future
+            pending = table[project_id].get(key)
+            if pending is None:
+                pending = _Pending(Future(), clients.monotonic() + (timeout or self.timeout), waiting_for)
+                table[project_id][key] = pending
+            if self.autostart:
+                self._ensure_running()
+        if callback:
+            pending.future.add_done_callback(callback)
+        return pending.future
+
+    def watch_snapshot(self, project_id: str, snapshot_name: str, callback=None, timeout: float | None = None) -> Future:
+        return self._add(self._snapshots, project_id, snapshot_name, callback, timeout)
+
+    def watch_disk(self, project_id: str, zone: str, disk_name: str, callback=None, timeout: float | None = None) -> Future:
+        return self._add(self._disks, project_id, (zone, disk_name), callback, timeout)
+
+    def watch_disk_deletion(self, project_id: str, zone: str, disk_name: str, callback=None,
+                            timeout: float | None = None) -> Future:
+        """Future that resolves to None once the disk no longer shows up in the listing."""
+        return self._add(self._deleted_disks, project_id, (zone, disk_name), callback, timeout, "be deleted")
+
+    def pending(self) -> int:
+        with self._lock:
+            return sum(len(v) for table in self._tables for v in table.values())
+
+    def _ensure_running(self) -> None:
+        # called with the lock held
+        if self._thread is None or not self._thread.is_alive():
+            self._stopped = False
+            self._thread = threading.Thread(
+                target=self._run, name="readiness-watcher", daemon=True)
+            self._thread.start()
+
+    def _run(self) -> None:
+        while not self._stopped:
+            try:
+                self.poll_once()
+            except Exception as e:
+                # a failed tick is retried next interval; watchers time out on their own
+                logging.warning(f"Readiness poll failed: {e}")
+            with self._lock:
+                # nothing left to watch: exit, the next watch_*() starts a new thread
+                if not any(entries for table in self._tables for entries in table.values()):
+                    self._thread = None
+                    return
+            # interval and timeouts are on the backend's clock, like every poll sleep
+            self._wakeup.wait(clients.real_seconds(self.interval))
+            self._wakeup.clear()
+
+    def _resolve(self, table: dict, project_id: str, key, resource) -> None:
+        with self._lock:
+            pending = table[project_id].pop(key, None)
+        if pending is None:
+            return
+        if resource.status == "READY":
+            pending.future.set_result(resource)
+        else:
+            pending.future.set_exception(
+                RuntimeError(f"{key} in {project_id} is {resource.status}"))
+
+    def _resolve_deleted(self, project_id: str, key) -> None:
+        with self._lock:
+            pending = self._deleted_disks[project_id].pop(key, None)
+        if pending is not None:
+            pending.future.set_result(None)
+
+    def _expire(self) -> None:
+        now = clients.monotonic()
+        expired = []
+        with self._lock:
+            for table in self._tables:
+                for project_id, entries in table.items():
+                    for key, pending in list(entries.items()):
+                        if pending.deadline <= now:
+                            expired.append((key, project_id, entries.pop(key)))
+        for key, project_id, pending in expired:
+            pending.future.set_exception(
+                TimeoutError(f"{key} in {project_id} did not {pending.waiting_for} in time"))
+
+    def poll_once(self) -> None:
+        """One tick: a list call per project (and name chunk), then resolve what finished."""
+        METRICS.inc("watcher_ticks_total")
+        with self._lock:
+            snapshot_work = {p: list(names) for p, names in self._snapshots.items() if names}
+            disk_work = {p: list(keys) for p, keys in self._disks.items() if keys}
+            deletion_work = {p: list(keys) for p, keys in self._deleted_disks.items() if keys}
+
+        for project_id, names in snapshot_work.items():
+            for i in range(0, len(names), FILTER_CHUNK_SIZE):
+                chunk = names[i:i + FILTER_CHUNK_SIZE]
+                request = compute_v1.ListSnapshotsRequest(
+                    project=project_id, filter=name_filter(chunk))
+                for snapshot in self.snapshot_client.list(request=request, metadata=field_mask(STATUS_LIST_FIELDS)):
+                    if snapshot.status in ("READY", "FAILED"):
+                        self._resolve(self._snapshots, project_id, snapshot.name, snapshot)
+
+        # disks being created and disks being deleted share the same list calls
+        for project_id in disk_work.keys() | deletion_work.keys():
+            keys = disk_work.get(project_id, []) + deletion_work.get(project_id, [])
+            names = sorted({name for _, name in keys})
+            present = set()
+            unreachable = set()
+            for i in range(0, len(names), FILTER_CHUNK_SIZE):
+                chunk = names[i:i + FILTER_CHUNK_SIZE]
+                request = compute_v1.AggregatedListDisksRequest(
+                    project=project_id, filter=name_filter(chunk), return_partial_success=True)
+                for scope, scoped_list in self.disk_client.aggregated_list(request=request):
+                    # scope looks like "zones/us-central1-a"
+                    zone = scope.rsplit("/", 1)[-1]
+                    if scoped_list.warning and scoped_list.warning.code == "UNREACHABLE":
+                        unreachable.add(zone)
+                    for disk in scoped_list.disks:
+                        present.add((zone, disk.name))
+                        if disk.status in ("READY", "FAILED"):
+                            self._resolve(self._disks, project_id, (zone, disk.name), disk)
+            for key in deletion_work.get(project_id, []):
+                # a zone missing from a partial listing says nothing about its disks
+                if key not in present and key[0] not in unreachable:
+                    self._resolve_deleted(project_id, key)
+
+        self._expire()
+
+    def stop(self) -> None:
+        self._stopped = True
+        self._wakeup.set()
+        thread = self._thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+        # nobody polls for what is left, so fail it instead of leaving waiters hanging
+        with self._lock:
+            leftovers = [pending for table in self._tables
+                         for entries in table.values() for pending in entries.values()]
+            for table in self._tables:
+                table.clear()
+        for pending in leftovers:
+            pending.future.set_exception(RuntimeError("readiness watcher stopped"))
+
+    def __enter__(self) -> ReadinessWatcher:
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.stop()